@@ -0,0 +1,321 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Callable, Iterable, Iterator
+
+import numpy as np
+import pandas as pd
+
+# Cache entries are stored in this directory next to the source file
+CACHE_DIR_NAME = ".patient_flow_cache"
+# Bump when the layout of cached tables changes
+CACHE_VERSION = 5
+# Rows per csv chunk, bounds peak memory while scanning a file
+CHUNK_ROWS = 250_000
+# Bytes per chunk when reading with pyarrow
+ARROW_BLOCK_BYTES = 32 << 20
+# Same missing value markers as pd.read_csv
+NA_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan",
+    "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a",
+    "nan", "null",
+]
+
+try:
+    import pyarrow  # noqa: F401
+
+    HAS_ARROW = True
+except ImportError:
+    HAS_ARROW = False
+
+
+def fingerprint(path: str) -> str:
+    """Identifies the current contents of a file by path, size and mtime."""
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{CACHE_VERSION}"
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def entry_prefix(path: str, kind: str) -> str:
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, CACHE_DIR_NAME, f"{name}.{kind}.")
+
+
+def scan(
+    path: str,
+    kind: str,
+    parse: Callable[[pd.DataFrame], pd.DataFrame] | None = None,
+    seq_ids: Iterable[int] | None = None,
+    columns: list[str] | None = None,
+    read_options: dict | None = None,
+    use_cache: bool = True,
+) -> pd.DataFrame:
+    """Reads the rows of a csv file whose seqID is in seq_ids (all rows if None).
+
+    The file is read in chunks of CHUNK_ROWS and every chunk is filtered before
+    the next one is read, so peak memory follows the selected rows and not the
+    file size. Only seqID and the given columns are kept.
+
+    Chunks are passed through parse and stored in the cache together with their
+    seqID range. Later scans of the unchanged file read the stored chunks
+    instead of the csv and skip the chunks whose range can't match.
+    """
+    wanted = None
+    if seq_ids is not None:
+        wanted = np.unique(np.asarray(list(seq_ids), dtype="int64"))
+    entry = entry_prefix(path, kind) + fingerprint(path)
+
+    if use_cache:
+        manifest = _read_manifest(entry)
+        if manifest is not None:
+            try:
+                return _scan_parts(entry, manifest, wanted, columns)
+            except Exception:
+                # Corrupt or written by an incompatible version, rebuild
+                pass
+
+    return _scan_csv(
+        path, entry if use_cache else None, parse, wanted, columns, read_options or {}
+    )
+
+
+def clear(directory: str) -> None:
+    shutil.rmtree(os.path.join(directory, CACHE_DIR_NAME), ignore_errors=True)
+
+
+def _select(
+    table: pd.DataFrame, wanted: np.ndarray | None, columns: list[str] | None
+) -> pd.DataFrame:
+    if wanted is not None:
+        table = table.loc[np.isin(table["seqID"].to_numpy(), wanted)]
+    if columns is not None:
+        table = table[["seqID"] + [c for c in columns if c != "seqID"]]
+    return table
+
+
+def _concat(frames: list[pd.DataFrame]) -> pd.DataFrame:
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _scan_parts(
+    entry: str, manifest: dict, wanted: np.ndarray | None, columns: list[str] | None
+) -> pd.DataFrame:
+    frames = [_read(os.path.join(entry, manifest["empty"]), columns)]
+    for part in manifest["parts"]:
+        if wanted is not None:
+            # Skip parts whose seqID range doesn't contain any wanted id
+            i = np.searchsorted(wanted, part["min_seq"])
+            if i == len(wanted) or wanted[i] > part["max_seq"]:
+                continue
+        table = _read(os.path.join(entry, part["file"]), columns)
+        frames.append(_select(table, wanted, None))
+    return _concat(frames)
+
+
+def _scan_csv(
+    path: str,
+    entry: str | None,
+    parse: Callable[[pd.DataFrame], pd.DataFrame] | None,
+    wanted: np.ndarray | None,
+    columns: list[str] | None,
+    read_options: dict,
+) -> pd.DataFrame:
+    # Chunks are written to a private directory that becomes the entry once
+    # the whole file is stored, concurrent scans never see each other's parts
+    building = None if entry is None else _prepare(entry)
+    writable = building is not None
+    if not writable and columns is not None and parse is None:
+        # Only parse the used columns when nothing is stored
+        read_options = dict(read_options, usecols=["seqID"] + columns)
+
+    def typed(chunk: pd.DataFrame) -> pd.DataFrame:
+        chunk = chunk.reset_index(drop=True)
+        return chunk if parse is None else parse(chunk)
+
+    try:
+        empty = typed(pd.read_csv(path, nrows=0, **read_options))
+        frames = [_select(empty, wanted, columns)]
+        parts: list[dict] = []
+        previous_max = None
+        in_order = True
+
+        for i, chunk in enumerate(_read_chunks(path, read_options)):
+            table = typed(chunk)
+            seq = table["seqID"].to_numpy()
+            if len(seq) == 0:
+                continue
+            if writable:
+                part = {"file": str(i), "min_seq": int(seq.min()), "max_seq": int(seq.max())}
+                writable = _write(os.path.join(building, part["file"]), table)
+                parts.append(part)
+            frames.append(_select(table, wanted, columns))
+
+            # Input sorted by seqID can't contain any wanted rows past the
+            # largest wanted id, stop reading unless the whole file is cached
+            in_order = in_order and bool(np.all(seq[1:] >= seq[:-1]))
+            in_order = in_order and (previous_max is None or seq[0] >= previous_max)
+            previous_max = seq[-1]
+            if not writable and wanted is not None and in_order:
+                if len(wanted) == 0 or previous_max > wanted[-1]:
+                    break
+
+        if writable and _write(os.path.join(building, "empty"), empty):
+            manifest = {"version": CACHE_VERSION, "empty": "empty", "parts": parts}
+            if _write_manifest(building, manifest):
+                _publish(building, entry)
+    finally:
+        if building is not None and os.path.isdir(building):
+            shutil.rmtree(building, ignore_errors=True)
+    return _concat(frames)
+
+
+def _read_chunks(path: str, read_options: dict) -> Iterator[pd.DataFrame]:
+    """Yields the rows of a csv file chunk by chunk.
+
+    When read_options only sets column types, pyarrow's streaming reader is
+    used. It parses without holding the GIL, so files can be read in parallel
+    threads.
+    """
+    dtype = read_options.get("dtype")
+    if HAS_ARROW and set(read_options) == {"dtype"} and isinstance(dtype, dict):
+        import pyarrow as pa
+        from pyarrow import csv as pa_csv
+
+        reader = pa_csv.open_csv(
+            path,
+            read_options=pa_csv.ReadOptions(block_size=ARROW_BLOCK_BYTES),
+            convert_options=pa_csv.ConvertOptions(
+                column_types={
+                    c: pa.string() if t is str else pa.from_numpy_dtype(np.dtype(t))
+                    for c, t in dtype.items()
+                },
+                null_values=NA_VALUES,
+                strings_can_be_null=True,
+            ),
+        )
+        for batch in reader:
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=CHUNK_ROWS, **read_options)
+
+
+def _prepare(entry: str) -> str | None:
+    """Removes stale entries of the file and creates a directory to build the
+    new entry in. Returns None if nothing can be stored."""
+    directory, name = os.path.split(entry)
+    prefix = name[: name.rfind(".") + 1]
+    try:
+        os.makedirs(directory, exist_ok=True)
+        for file in os.listdir(directory):
+            if file.startswith(prefix) and not file.startswith(name):
+                shutil.rmtree(os.path.join(directory, file), ignore_errors=True)
+        return tempfile.mkdtemp(prefix=name + ".tmp", dir=directory)
+    except OSError:
+        # Read-only data directory, run without cache
+        return None
+
+
+def _publish(building: str, entry: str) -> None:
+    try:
+        os.rename(building, entry)
+    except OSError:
+        # Another scan stored the same entry first
+        pass
+
+
+def _read_manifest(entry: str) -> dict | None:
+    try:
+        with open(os.path.join(entry, "manifest.json")) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != CACHE_VERSION:
+        return None
+    return manifest
+
+
+def _write_manifest(entry: str, manifest: dict) -> bool:
+    try:
+        with open(os.path.join(entry, "manifest.json"), "w") as f:
+            json.dump(manifest, f)
+    except OSError:
+        return False
+    return True
+
+
+def _read(file: str, columns: list[str] | None) -> pd.DataFrame:
+    if os.path.exists(file + ".feather"):
+        if columns is not None:
+            columns = ["seqID"] + [c for c in columns if c != "seqID"]
+        return pd.read_feather(file + ".feather", columns=columns)
+    with np.load(file + ".npz", allow_pickle=False) as stored:
+        names = stored["columns"].tolist()
+        kept = [
+            (i, n) for i, n in enumerate(names)
+            if columns is None or n == "seqID" or n in columns
+        ]
+        # Text is stored as fixed width strings, read back as objects
+        table = pd.DataFrame(
+            {
+                n: _from_stored(stored[f"column_{i}"], stored.get(f"missing_{i}"))
+                for i, n in kept
+            },
+            columns=[n for _, n in kept],
+        )
+    return _select(table, None, columns)
+
+
+def _write(file: str, table: pd.DataFrame) -> bool:
+    """Stores a table as feather, or as plain numpy arrays without pyarrow.
+    Returns False if the table can't be stored, the file isn't cached then."""
+    try:
+        if HAS_ARROW:
+            try:
+                table.to_feather(file + ".feather")
+                return True
+            except Exception:
+                # Mixed type columns can't be stored by arrow
+                if os.path.exists(file + ".feather"):
+                    os.remove(file + ".feather")
+        arrays = {}
+        for i, name in enumerate(table.columns):
+            stored = _to_stored(table[name])
+            if stored is None:
+                return False
+            arrays[f"column_{i}"], missing = stored
+            if missing is not None:
+                arrays[f"missing_{i}"] = missing
+        names = np.array([str(n) for n in table.columns], dtype=str)
+        np.savez(file + ".npz", columns=names, **arrays)
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def _to_stored(column: pd.Series) -> tuple[np.ndarray, np.ndarray | None] | None:
+    """Values of a column np.save can store without pickle and the mask of
+    the missing values of a text column. None if there are other objects
+    than strings and missing values, such as mixed types."""
+    values = column.to_numpy()
+    if values.dtype.kind in "biufcmM":
+        return values, None
+    missing = pd.isna(values)
+    text = values[~missing]
+    if not all(isinstance(v, str) for v in text):
+        return None
+    filled = np.full(len(values), "", dtype=object)
+    filled[~missing] = text
+    return np.array(filled.tolist(), dtype=str), missing if missing.any() else None
+
+
+def _from_stored(values: np.ndarray, missing: np.ndarray | None) -> np.ndarray:
+    if values.dtype.kind != "U":
+        return values
+    values = values.astype(object)
+    if missing is not None:
+        values[missing] = np.nan
+    return values
@@ -0,0 +1,306 @@
+import json
+import os
+import tempfile
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+import cache
+
+# The catalog of a directory is stored with the cached tables of its files
+CATALOG_NAME = "catalog.json"
+# Bump when the stored statistics change
+CATALOG_VERSION = 1
+# Rows read to infer the type of every column
+SAMPLE_ROWS = 1000
+# Distinct counts are estimated with 2**SKETCH_BITS HyperLogLog registers
+SKETCH_BITS = 10
+# Columns with at most this many distinct values list them
+MAX_VALUES = 50
+
+Progress = Callable[[str, float], None]
+
+
+class ColumnStats:
+    """Type, range and distinct values of one column of a csv file.
+
+    dtype is "integer", "float", "datetime" or "text". min and max compare
+    numbers as numbers and everything else as text, so ISO times sort right.
+    values holds the distinct values while there are at most MAX_VALUES.
+    """
+
+    def __init__(self, name: str, dtype: str) -> None:
+        self.name = name
+        self.dtype = dtype
+        self.min: float | str | None = None
+        self.max: float | str | None = None
+        self.missing = 0
+        self.registers = np.zeros(1 << SKETCH_BITS, dtype=np.uint8)
+        self.values: list[str] | None = []
+
+    @property
+    def is_numeric(self) -> bool:
+        return self.dtype in ("integer", "float")
+
+    @property
+    def distinct(self) -> int:
+        """Number of distinct values, exact if they are listed."""
+        if self.values is not None:
+            return len(self.values)
+        return hll_estimate(self.registers)
+
+    def add(self, column: pd.Series) -> None:
+        present = column[column.notna()]
+        self.missing += len(column) - len(present)
+        if len(present) == 0:
+            return
+        if self.is_numeric:
+            numbers = pd.to_numeric(present, errors="coerce")
+            low, high = numbers.min(), numbers.max()
+            if not pd.isna(low):
+                self.min = float(low) if self.min is None else min(self.min, float(low))
+                self.max = float(high) if self.max is None else max(self.max, float(high))
+        else:
+            low, high = str(present.min()), str(present.max())
+            self.min = low if self.min is None else min(str(self.min), low)
+            self.max = high if self.max is None else max(str(self.max), high)
+
+        unique = present.unique()
+        hll_add(self.registers, unique)
+        if self.values is not None:
+            values = set(self.values).union(unique.tolist())
+            self.values = sorted(values) if len(values) <= MAX_VALUES else None
+
+    def to_json(self) -> dict:
+        return {
+            "name": self.name,
+            "dtype": self.dtype,
+            "min": self.min,
+            "max": self.max,
+            "missing": self.missing,
+            "registers": self.registers.tobytes().hex(),
+            "values": self.values,
+        }
+
+    @classmethod
+    def from_json(cls, state: dict) -> "ColumnStats":
+        stats = cls(state["name"], state["dtype"])
+        stats.min = state["min"]
+        stats.max = state["max"]
+        stats.missing = state["missing"]
+        stats.registers = np.frombuffer(bytes.fromhex(state["registers"]), dtype=np.uint8).copy()
+        stats.values = state["values"]
+        return stats
+
+    def describe(self) -> str:
+        text = self.dtype
+        if self.min is not None and self.dtype != "text":
+            text += f", {_format(self.min)} to {_format(self.max)}"
+        return text + f", {self.distinct} distinct"
+
+
+class FileEntry:
+    """Statistics of one csv file, valid while its size and mtime don't change."""
+
+    def __init__(self, name: str, size: int, mtime_ns: int) -> None:
+        self.name = name
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.rows = 0
+        self.min_seq: int | None = None
+        self.max_seq: int | None = None
+        self.columns: list[ColumnStats] = []
+
+    def column(self, name: str) -> ColumnStats | None:
+        for stats in self.columns:
+            if stats.name == name:
+                return stats
+        return None
+
+    def column_names(self) -> list[str]:
+        return [stats.name for stats in self.columns]
+
+    def is_current(self, stat: os.stat_result) -> bool:
+        return self.size == stat.st_size and self.mtime_ns == stat.st_mtime_ns
+
+    def overlaps(self, seq_ids: np.ndarray) -> bool:
+        """If the file can have rows of any of the sorted seq_ids."""
+        if self.min_seq is None:
+            return False
+        i = np.searchsorted(seq_ids, self.min_seq)
+        return bool(i < len(seq_ids) and seq_ids[i] <= self.max_seq)
+
+    def to_json(self) -> dict:
+        return {
+            "name": self.name,
+            "size": self.size,
+            "mtime_ns": self.mtime_ns,
+            "rows": self.rows,
+            "min_seq": self.min_seq,
+            "max_seq": self.max_seq,
+            "columns": [stats.to_json() for stats in self.columns],
+        }
+
+    @classmethod
+    def from_json(cls, state: dict) -> "FileEntry":
+        entry = cls(state["name"], state["size"], state["mtime_ns"])
+        entry.rows = state["rows"]
+        entry.min_seq = state["min_seq"]
+        entry.max_seq = state["max_seq"]
+        entry.columns = [ColumnStats.from_json(c) for c in state["columns"]]
+        return entry
+
+
+class Catalog:
+    """Schema and statistics of the csv files of a data source directory.
+
+    The catalog is stored next to the data, refresh only reads the files that
+    were added or changed since it was stored. Files that can't be read are
+    left out.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = os.path.abspath(directory)
+        self.files: dict[str, FileEntry] = {}
+
+    @classmethod
+    def load(cls, directory: str) -> "Catalog":
+        catalog = cls(directory)
+        try:
+            with open(catalog._path()) as f:
+                state = json.load(f)
+            if state.get("version") == CATALOG_VERSION:
+                for file_state in state["files"]:
+                    entry = FileEntry.from_json(file_state)
+                    catalog.files[entry.name] = entry
+        except (OSError, ValueError, KeyError):
+            # Missing or unreadable, everything is read again
+            catalog.files.clear()
+        return catalog
+
+    def refresh(self, progress: Progress | None = None) -> bool:
+        """Reads the changed files, returns True if anything changed."""
+        names = sorted(
+            f for f in os.listdir(self.directory) if f.endswith(".csv") and not f.startswith(".")
+        )
+        changed = [n for n in self.files if n not in names]
+        for n in changed:
+            del self.files[n]
+
+        for i, name in enumerate(names):
+            if progress is not None:
+                progress("Cataloging", i / len(names))
+            stat = os.stat(os.path.join(self.directory, name))
+            entry = self.files.get(name)
+            if entry is not None and entry.is_current(stat):
+                continue
+            changed.append(name)
+            try:
+                self.files[name] = _read_entry(self.directory, name, stat)
+            except (OSError, ValueError, pd.errors.ParserError):
+                self.files.pop(name, None)
+        if len(changed) > 0:
+            self.save()
+        return len(changed) > 0
+
+    def save(self) -> None:
+        state = {
+            "version": CATALOG_VERSION,
+            "files": [self.files[name].to_json() for name in sorted(self.files)],
+        }
+        try:
+            os.makedirs(os.path.dirname(self._path()), exist_ok=True)
+            # Written to a temporary file first, readers never see half of it
+            fd, temp = tempfile.mkstemp(dir=os.path.dirname(self._path()))
+            with os.fdopen(fd, "w") as f:
+                json.dump(state, f)
+            os.replace(temp, self._path())
+        except OSError:
+            # Read-only data directory, the catalog is only kept in memory
+            pass
+
+    def entry(self, path: str) -> FileEntry | None:
+        """Entry of a file of the directory, None if unknown or changed since."""
+        directory, name = os.path.split(os.path.abspath(path))
+        entry = self.files.get(name)
+        if directory != self.directory or entry is None:
+            return None
+        try:
+            return entry if entry.is_current(os.stat(path)) else None
+        except OSError:
+            return None
+
+    def _path(self) -> str:
+        return os.path.join(self.directory, cache.CACHE_DIR_NAME, CATALOG_NAME)
+
+
+def lookup(path: str) -> FileEntry | None:
+    """Stored entry of a file if it is up to date, the files aren't read."""
+    return Catalog.load(os.path.dirname(os.path.abspath(path))).entry(path)
+
+
+def hll_add(registers: np.ndarray, values: np.ndarray) -> None:
+    """Adds values to the HyperLogLog registers."""
+    hashes = pd.util.hash_array(np.asarray(values, dtype=object))
+    index = (hashes >> np.uint64(64 - SKETCH_BITS)).astype(np.int64)
+    rest = hashes & np.uint64((1 << (64 - SKETCH_BITS)) - 1)
+    # Position of the first set bit of the remaining bits, counted from the top
+    rank = np.full(len(hashes), 64 - SKETCH_BITS + 1, dtype=np.uint8)
+    nonzero = rest > 0
+    rank[nonzero] = (64 - SKETCH_BITS) - np.floor(np.log2(rest[nonzero].astype(float)))
+    np.maximum.at(registers, index, rank)
+
+
+def hll_estimate(registers: np.ndarray) -> int:
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.exp2(-registers.astype(float)))
+    zeros = int(np.count_nonzero(registers == 0))
+    if estimate <= 2.5 * m and zeros > 0:
+        # Few values, linear counting is more accurate
+        estimate = m * np.log(m / zeros)
+    return int(round(estimate))
+
+
+def _read_entry(directory: str, name: str, stat: os.stat_result) -> FileEntry:
+    path = os.path.join(directory, name)
+    entry = FileEntry(name, stat.st_size, stat.st_mtime_ns)
+    sample = pd.read_csv(path, nrows=SAMPLE_ROWS)
+    entry.columns = [ColumnStats(c, _infer_dtype(sample[c])) for c in sample.columns]
+
+    # Values are kept as text, numeric columns are converted per chunk
+    for chunk in pd.read_csv(path, chunksize=cache.CHUNK_ROWS, dtype=str):
+        entry.rows += len(chunk)
+        for stats in entry.columns:
+            stats.add(chunk[stats.name])
+        if "seqID" in chunk.columns:
+            seq = pd.to_numeric(chunk["seqID"], errors="coerce").dropna()
+            if len(seq) > 0:
+                low, high = int(seq.min()), int(seq.max())
+                entry.min_seq = low if entry.min_seq is None else min(entry.min_seq, low)
+                entry.max_seq = high if entry.max_seq is None else max(entry.max_seq, high)
+    return entry
+
+
+def _infer_dtype(column: pd.Series) -> str:
+    if pd.api.types.is_integer_dtype(column):
+        return "integer"
+    if pd.api.types.is_float_dtype(column):
+        # Integers with missing values are read as floats
+        present = column.dropna()
+        if len(present) > 0 and bool((present == present.round()).all()):
+            return "integer"
+        return "float"
+    present = column.dropna().astype(str)
+    if len(present) > 0:
+        times = pd.to_datetime(present, errors="coerce", format="ISO8601")
+        if bool(times.notna().all()):
+            return "datetime"
+    return "text"
+
+
+def _format(value: float | str | None) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
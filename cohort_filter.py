@@ -0,0 +1,221 @@
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import cache
+from catalog import lookup
+from data import read_csv, read_event_table
+
+# Sequence ids matched by the predicates evaluated most recently
+RESULT_CACHE_SIZE = 64
+_results: OrderedDict[tuple, np.ndarray] = OrderedDict()
+
+
+class Predicate:
+    """A set of sequence ids defined on the data source files.
+
+    evaluate returns the sorted ids of universe that are in the set.
+    """
+
+    def evaluate(self, universe: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def paths(self) -> list[str]:
+        """Files the predicate reads."""
+        return []
+
+
+class FilePredicate(Predicate):
+    """Sequences with a row of a file that passes a test on one column.
+
+    The matching ids of the whole file are computed once and kept, keyed by
+    the fingerprint of the file and the test, so changing other predicates
+    or the cohort doesn't read the file again.
+    """
+
+    path: str
+
+    def key(self) -> tuple:
+        raise NotImplementedError
+
+    def matches(self) -> np.ndarray:
+        raise NotImplementedError
+
+    def evaluate(self, universe: np.ndarray) -> np.ndarray:
+        entry = lookup(self.path)
+        if entry is not None and not entry.overlaps(universe):
+            # No row of the file can match, it isn't read
+            return universe[:0]
+        key = (cache.fingerprint(self.path),) + self.key()
+        matched = _results.get(key)
+        if matched is None:
+            matched = np.unique(self.matches().astype(np.int64))
+            matched.flags.writeable = False
+            _results[key] = matched
+            if len(_results) > RESULT_CACHE_SIZE:
+                _results.popitem(last=False)
+        else:
+            _results.move_to_end(key)
+        return np.intersect1d(universe, matched, assume_unique=True)
+
+    def paths(self) -> list[str]:
+        return [self.path]
+
+    def _column(self, column: str) -> pd.DataFrame:
+        # Read as text like the catalog does, so an integer column with
+        # blanks isn't turned into floats that no longer match "1"
+        return read_csv(self.path, None, [column])
+
+
+class RangePredicate(FilePredicate):
+    """A value of column between low and high, both included."""
+
+    def __init__(self, path: str, column: str, low: float, high: float) -> None:
+        self.path = path
+        self.column = column
+        self.low = low
+        self.high = high
+
+    def key(self) -> tuple:
+        return ("range", self.column, self.low, self.high)
+
+    def matches(self) -> np.ndarray:
+        table = self._column(self.column)
+        values = pd.to_numeric(table[self.column], errors="coerce")
+        return table["seqID"].to_numpy()[values.between(self.low, self.high).to_numpy()]
+
+
+class CategoryPredicate(FilePredicate):
+    """A value of column that is one of values, compared as text."""
+
+    def __init__(self, path: str, column: str, values: list[str]) -> None:
+        self.path = path
+        self.column = column
+        self.values = sorted(values)
+
+    def key(self) -> tuple:
+        return ("category", self.column, tuple(self.values))
+
+    def matches(self) -> np.ndarray:
+        table = self._column(self.column)
+        text = table[self.column].fillna("").astype(str).str.strip()
+        return table["seqID"].to_numpy()[text.isin(self.values).to_numpy()]
+
+
+class EventPredicate(FilePredicate):
+    """An event of an event file with the given type, and value if not empty."""
+
+    def __init__(self, path: str, event_type: str, event_value: str = "") -> None:
+        self.path = path
+        self.event_type = event_type
+        self.event_value = event_value
+
+    def key(self) -> tuple:
+        return ("event", self.event_type, self.event_value)
+
+    def matches(self) -> np.ndarray:
+        # The parsed table is cached by the tree builds too
+        table = read_event_table(self.path)
+        found = table["event_type"].to_numpy() == self.event_type
+        if self.event_value != "":
+            found &= table["event_value"].to_numpy() == self.event_value
+        return table["seqID"].to_numpy()[found]
+
+
+class AllOf(Predicate):
+    def __init__(self, predicates: list[Predicate]) -> None:
+        self.predicates = predicates
+
+    def evaluate(self, universe: np.ndarray) -> np.ndarray:
+        # Every predicate only looks at the ids the ones before kept
+        for predicate in self.predicates:
+            universe = predicate.evaluate(universe)
+        return universe
+
+    def paths(self) -> list[str]:
+        return [path for p in self.predicates for path in p.paths()]
+
+
+class AnyOf(Predicate):
+    def __init__(self, predicates: list[Predicate]) -> None:
+        self.predicates = predicates
+
+    def evaluate(self, universe: np.ndarray) -> np.ndarray:
+        matched = np.zeros(0, dtype=np.int64)
+        for predicate in self.predicates:
+            rest = np.setdiff1d(universe, matched, assume_unique=True)
+            matched = np.union1d(matched, predicate.evaluate(rest))
+        return matched
+
+    def paths(self) -> list[str]:
+        return [path for p in self.predicates for path in p.paths()]
+
+
+class Not(Predicate):
+    def __init__(self, predicate: Predicate) -> None:
+        self.predicate = predicate
+
+    def evaluate(self, universe: np.ndarray) -> np.ndarray:
+        return np.setdiff1d(universe, self.predicate.evaluate(universe), assume_unique=True)
+
+    def paths(self) -> list[str]:
+        return self.predicate.paths()
+
+
+class CohortFilter:
+    """A predicate compiled from a spec, the json form stored in the settings
+    and in snapshot headers.
+
+    A spec is {"combine": "and" | "or", "predicates": [...]} where every
+    predicate is a dict with "kind" ("range", "category" or "event"), "path",
+    the arguments of its class and optionally "negate".
+    """
+
+    spec: dict
+    predicate: Predicate
+
+    def __init__(self, spec: dict, predicate: Predicate) -> None:
+        self.spec = spec
+        self.predicate = predicate
+
+    def apply(self, seq_ids: np.ndarray) -> np.ndarray:
+        """Mask of the seq_ids that pass the filter, in any order."""
+        universe = np.unique(np.asarray(seq_ids, dtype=np.int64))
+        return np.isin(seq_ids, self.predicate.evaluate(universe))
+
+    def paths(self) -> list[str]:
+        return sorted(set(self.predicate.paths()))
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, CohortFilter) and self.spec == other.spec
+
+
+def from_spec(spec: dict | None) -> CohortFilter | None:
+    """Compiles a spec, None if it has no predicates."""
+    if spec is None or len(spec.get("predicates", [])) == 0:
+        return None
+    predicates = [_compile(p) for p in spec["predicates"]]
+    if spec.get("combine", "and") == "or":
+        return CohortFilter(spec, AnyOf(predicates))
+    return CohortFilter(spec, AllOf(predicates))
+
+
+def _compile(spec: dict) -> Predicate:
+    predicate: Predicate
+    match spec["kind"]:
+        case "range":
+            predicate = RangePredicate(
+                spec["path"], spec["column"], float(spec["low"]), float(spec["high"])
+            )
+        case "category":
+            predicate = CategoryPredicate(spec["path"], spec["column"], spec["values"])
+        case "event":
+            predicate = EventPredicate(
+                spec["path"], spec["event_type"], spec.get("event_value", "")
+            )
+        case kind:
+            raise ValueError(f"Unknown predicate kind {kind}")
+    if spec.get("negate", False):
+        predicate = Not(predicate)
+    return predicate
@@ -0,0 +1,93 @@
+import numpy as np
+
+from timeline import EventAggregate
+
+# How a node is combined with the cohort of the nodes before it
+OPERATIONS = ["and", "or", "not"]
+OPERATION_NAMES = {"and": "Intersection", "or": "Union", "not": "Difference"}
+OPERATION_WORDS = {"and": " and ", "or": " or ", "not": " but not "}
+
+
+def contains(ids: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Mask of the values that are in the sorted array ids."""
+    if len(ids) == 0:
+        return np.zeros(len(values), dtype=bool)
+    index = np.searchsorted(ids, values)
+    index[index == len(ids)] = 0
+    return ids[index] == values
+
+
+def intersect(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # Every id of the smaller array is searched for in the larger one, so
+    # a small node against a large cohort costs little
+    small, large = (a, b) if len(a) <= len(b) else (b, a)
+    return small[contains(large, small)]
+
+
+def union(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # Merges the ids missing from a into it instead of sorting both again
+    extra = difference(b, a)
+    return np.insert(a, np.searchsorted(a, extra), extra)
+
+
+def difference(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return a[~contains(b, a)]
+
+
+COMBINE = {"and": intersect, "or": union, "not": difference}
+
+
+class NodeSelection:
+    """Nodes of an aggregate combined into a cohort, left to right.
+
+    The first node is the start of the cohort, every later node is
+    intersected with ("and"), added to ("or") or removed from ("not") the
+    cohort of the nodes before it. The sequence ids of the nodes are the
+    sorted member arrays of the tree, nothing is copied to combine them.
+    """
+
+    def __init__(self, nodes: list[EventAggregate], operations: list[str]) -> None:
+        # The operation of the first node isn't used
+        self.nodes = nodes
+        self.operations = operations
+        self._seq_ids: np.ndarray | None = None
+
+    def seq_ids(self) -> np.ndarray:
+        """Sorted sequence ids of the cohort."""
+        if self._seq_ids is None:
+            seq_ids = np.zeros(0, dtype=np.int64)
+            if len(self.nodes) > 0:
+                seq_ids = self.nodes[0].seq_ids
+            for node, operation in zip(self.nodes[1:], self.operations[1:]):
+                seq_ids = COMBINE[operation](seq_ids, node.seq_ids)
+            self._seq_ids = seq_ids
+        return self._seq_ids
+
+    def ends(self) -> tuple[EventAggregate, EventAggregate] | None:
+        """First and last node that aren't removed, None if they are the same."""
+        if len(self.nodes) == 0:
+            return None
+        kept = self.nodes[:1]
+        kept += [n for n, o in zip(self.nodes[1:], self.operations[1:]) if o != "not"]
+        if len(kept) < 2:
+            return None
+        return kept[0], kept[-1]
+
+    def time_diffs(self) -> np.ndarray:
+        """Minutes between the events at the ends of the cohort's patients
+        that pass through both, pairs with a missing time are skipped."""
+        ends = self.ends()
+        if ends is None:
+            return np.zeros(0)
+        a, b = ends
+        # The pair is kept by the tree, only the cohort is applied here
+        seq_ids, diffs, timed = a.tree.node_pair(a, b)
+        return diffs[contains(self.seq_ids(), seq_ids[timed])]
+
+    def describe(self) -> str:
+        if len(self.nodes) == 0:
+            return ""
+        text = self.nodes[0].key
+        for node, operation in zip(self.nodes[1:], self.operations[1:]):
+            text += OPERATION_WORDS[operation] + node.key
+        return text
@@ -0,0 +1,127 @@
+import numpy as np
+
+from cohort_sets import contains
+from data import PatientAttributeStore
+from timeline import EventTimelineAggregate
+
+# Ways to split the timelines of a plot into cohorts, besides the
+# discrete attributes of PatientAttributeStore
+SPLIT_NONE = "None"
+SPLIT_EVENT = "Has event"
+SPLITS = [SPLIT_NONE, SPLIT_EVENT] + list(PatientAttributeStore.DISCRETE_COLUMNS)
+
+
+class CohortComparison:
+    """Counts of every node of one tree split over disjoint cohorts.
+
+    The timelines of all cohorts are in the same tree, built from one event
+    store, so each cohort is a label per timeline and the counts of all
+    cohorts are one bincount over the member arrays. Timelines without a
+    label are only counted in the sizes of the tree.
+    """
+
+    names: list[str]
+    counts: np.ndarray  # int64, nodes x cohorts
+    totals: np.ndarray  # int64, timelines of every cohort
+
+    def __init__(
+        self,
+        tree: EventTimelineAggregate,
+        names: list[str],
+        seq_ids: np.ndarray,
+        labels: np.ndarray,
+    ) -> None:
+        """seq_ids are sorted and labels holds the cohort of every one."""
+        self.names = names
+        num_nodes = len(tree)
+        num_cohorts = len(names)
+
+        member_nodes = np.repeat(np.arange(num_nodes), np.diff(tree.member_offsets))
+        found = contains(seq_ids, tree.member_seq_ids)
+        member_labels = np.asarray(labels, dtype=np.int64)[
+            np.searchsorted(seq_ids, tree.member_seq_ids[found])
+        ]
+        self.counts = np.bincount(
+            member_nodes[found] * num_cohorts + member_labels,
+            minlength=num_nodes * num_cohorts,
+        ).reshape(num_nodes, num_cohorts)
+        # Every timeline passes through one child of the root
+        self.totals = self.counts[tree.parents == 0].sum(axis=0)
+
+    @property
+    def frequencies(self) -> np.ndarray:
+        """Share of the timelines of every cohort passing through every node."""
+        return self.counts / np.maximum(self.totals, 1)
+
+    @property
+    def differences(self) -> np.ndarray:
+        """Frequency of the first cohort minus that of all others together,
+        zero everywhere without cohorts."""
+        if len(self.names) == 0:
+            return np.zeros(len(self.counts))
+        rest = self.counts[:, 1:].sum(axis=1) / max(int(self.totals[1:].sum()), 1)
+        return self.frequencies[:, 0] - rest
+
+    def describe(self, node: int) -> str:
+        lines = [
+            f"{name}: {count} ({frequency:.1%})"
+            for name, count, frequency in zip(
+                self.names, self.counts[node].tolist(), self.frequencies[node].tolist()
+            )
+        ]
+        if len(self.names) > 1:
+            rest = "the other" if len(self.names) == 2 else "the others"
+            lines.append(
+                f"{self.names[0]} vs {rest}: {float(self.differences[node]):+.1%}"
+            )
+        return "\n".join(lines)
+
+
+def compare(
+    tree: EventTimelineAggregate,
+    attributes: PatientAttributeStore,
+    split: str,
+    event_title: str = "",
+) -> CohortComparison | None:
+    """Splits the timelines of tree by split, one of SPLITS. None if the plot
+    isn't split."""
+    if split == SPLIT_NONE:
+        return None
+    if split == SPLIT_EVENT:
+        return split_by_event(tree, event_title)
+    return split_by_attribute(tree, attributes, split)
+
+
+def split_by_event(tree: EventTimelineAggregate, title: str) -> CohortComparison:
+    """Timelines with and without an event of the given type (file event_type)."""
+    # Only the timelines in the tree are looked at, the store of a tree that
+    # was updated can hold others
+    seq_ids, rows = tree.timeline_rows()
+    order = np.argsort(seq_ids)
+    seq_ids, rows = seq_ids[order], rows[order]
+    has_event = np.zeros(len(seq_ids), dtype=bool)
+    store = tree.store
+    if store is not None and title in store.title_table:
+        # Events of the type counted up to every row, compared at the ends
+        # of every timeline
+        found = np.zeros(len(store.titles) + 1, dtype=np.int64)
+        np.cumsum(store.titles == store.title_table.index(title), out=found[1:])
+        has_event = found[store.offsets[rows + 1]] > found[store.offsets[rows]]
+    labels = np.where(has_event, 0, 1)
+    return CohortComparison(tree, [f"With {title}", f"Without {title}"], seq_ids, labels)
+
+
+def split_by_attribute(
+    tree: EventTimelineAggregate, attributes: PatientAttributeStore, title: str
+) -> CohortComparison:
+    """One cohort per value of a discrete attribute, in sorted order."""
+    categories = attributes.categories[title]
+    order = np.argsort(categories.astype(str), kind="stable")
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return CohortComparison(
+        tree,
+        categories[order].astype(str).tolist(),
+        attributes.seq_ids,
+        rank[attributes.codes[title]],
+    )
@@ -1,7 +1,21 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable
+
+import numpy as np
 import pandas as pd
-from timeline import Event, EventTimeline, EventTimelineAggregate
-from time_utils import str2datetime
-import math
+import cache
+from catalog import Catalog
+from timeline import Event, EventStore, EventTimeline, EventTimelineAggregate
+from time_utils import parse_times
+
+if TYPE_CHECKING:
+    from cohort_filter import CohortFilter
+
+
+# Called with the name of the current stage and the fraction of it that is
+# done. Raising from it stops the work.
+Progress = Callable[[str, float], None]
 
 
 def create_aggregate(
@@ -9,68 +23,418 @@ def create_aggregate(
     pick_from_csv: str,
     patient_attributes_csv: str,
     num_patients: int,
+    progress: Progress | None = None,
+    cohort_filter: "CohortFilter | None" = None,
 ):
+    return CohortAggregate.build(
+        data_paths,
+        pick_from_csv,
+        patient_attributes_csv,
+        num_patients,
+        progress,
+        cohort_filter,
+    ).aggregate
+
+
+class CohortAggregate:
+    """The aggregate of the first num_patients sequences of a pick-from file
+    that pass the cohort filter, and the files it was built from.
+
+    update makes the aggregate of another patient count or set of event files
+    from this one, re-reading only the timelines that change.
+    """
+
+    data_paths: list[str]
+    pick_from_csv: str
+    patient_attributes_csv: str
+    num_patients: int
+    # seqID and ankomst_tidpunkt of the cohort, read when needed if None
+    sequence_info: pd.DataFrame | None
+    aggregate: EventTimelineAggregate
+    cohort_filter: "CohortFilter | None"
+
+    def __init__(
+        self,
+        data_paths: list[str],
+        pick_from_csv: str,
+        patient_attributes_csv: str,
+        num_patients: int,
+        sequence_info: pd.DataFrame | None,
+        aggregate: EventTimelineAggregate,
+        cohort_filter: "CohortFilter | None" = None,
+    ) -> None:
+        self.data_paths = list(data_paths)
+        self.pick_from_csv = pick_from_csv
+        self.patient_attributes_csv = patient_attributes_csv
+        self.num_patients = num_patients
+        self.sequence_info = sequence_info
+        self.aggregate = aggregate
+        self.cohort_filter = cohort_filter
+
+    @staticmethod
+    def build(
+        data_paths: list[str],
+        pick_from_csv: str,
+        patient_attributes_csv: str,
+        num_patients: int,
+        progress: Progress | None = None,
+        cohort_filter: "CohortFilter | None" = None,
+    ) -> "CohortAggregate":
+        progress = progress or _no_progress
+
+        # Extract which seq-ids to use
+        progress("Reading", 0.0)
+        sequence_info = _read_sequence_info(
+            pick_from_csv, patient_attributes_csv, num_patients, cohort_filter
+        )
+
+        store = load_event_store(data_paths, sequence_info, progress)
+        progress("Building tree", 0.0)
+        agg = EventTimelineAggregate()
+        agg.add_event_timelines(store, _arrival_rows(store))
+        progress("Building tree", 1.0)
+        return CohortAggregate(
+            data_paths,
+            pick_from_csv,
+            patient_attributes_csv,
+            num_patients,
+            sequence_info,
+            agg,
+            cohort_filter,
+        )
+
+    def update(
+        self,
+        data_paths: list[str],
+        pick_from_csv: str,
+        patient_attributes_csv: str,
+        num_patients: int,
+        progress: Progress | None = None,
+        cohort_filter: "CohortFilter | None" = None,
+    ) -> "CohortAggregate | None":
+        """The aggregate of the given files, made from this one.
+
+        Timelines of sequences that left the cohort are removed, timelines of
+        new sequences are added and timelines with events in an added or
+        removed event file are read again. This aggregate is not changed.
+        Returns None if the update needs a full build, when the pick-from or
+        patient attribute file changed or the event files were reordered.
+        """
+        if (
+            pick_from_csv != self.pick_from_csv
+            or patient_attributes_csv != self.patient_attributes_csv
+        ):
+            return None
+        # Duplicates are collapsed in file order, which must stay the same
+        kept_paths = [p for p in data_paths if p in self.data_paths]
+        if kept_paths != [p for p in self.data_paths if p in data_paths]:
+            return None
+        progress = progress or _no_progress
+
+        progress("Reading", 0.0)
+        previous_info = self.sequence_info
+        if previous_info is None:
+            previous_info = _read_sequence_info(
+                pick_from_csv,
+                patient_attributes_csv,
+                self.num_patients,
+                self.cohort_filter,
+            )
+        sequence_info = previous_info
+        # A filter is evaluated again in case one of its files changed, its
+        # results are cached while they don't
+        filtered = cohort_filter is not None or self.cohort_filter is not None
+        if num_patients != self.num_patients or filtered:
+            sequence_info = _read_sequence_info(
+                pick_from_csv, patient_attributes_csv, num_patients, cohort_filter
+            )
+        old_ids = np.unique(previous_info["seqID"].to_numpy(dtype="int64"))
+        new_ids = np.unique(sequence_info["seqID"].to_numpy(dtype="int64"))
+        kept = np.intersect1d(old_ids, new_ids, assume_unique=True)
+
+        # Kept sequences with events in a file that was added or removed
+        changed_paths = [p for p in data_paths if p not in self.data_paths] + [
+            p for p in self.data_paths if p not in data_paths
+        ]
+        reread = np.zeros(0, dtype=np.int64)
+        if len(kept) > 0:
+            for path in changed_paths:
+                events = read_event_table(path, pd.Series(kept))
+                reread = np.union1d(reread, events["seqID"].to_numpy(dtype="int64"))
+
+        agg = self.aggregate.copy()
+        agg.remove_event_timelines(
+            np.concatenate([np.setdiff1d(old_ids, new_ids, assume_unique=True), reread])
+        )
+        threaded = np.union1d(np.setdiff1d(new_ids, old_ids, assume_unique=True), reread)
+        if len(threaded) > 0:
+            store = load_event_store(
+                data_paths,
+                sequence_info[sequence_info["seqID"].isin(threaded)],
+                progress,
+            )
+            progress("Building tree", 0.0)
+            agg.add_event_timelines(store, _arrival_rows(store))
+        # A build adds the timelines in the order of the cohort, which picks
+        # the info of every node and the order of siblings
+        agg.renumber(sequence_info["seqID"].to_numpy(dtype="int64"))
+        # The removed and the replaced timelines are still in the store
+        agg.compact()
+        progress("Building tree", 1.0)
+        return CohortAggregate(
+            data_paths,
+            pick_from_csv,
+            patient_attributes_csv,
+            num_patients,
+            sequence_info,
+            agg,
+            cohort_filter,
+        )
+
+
+def _read_sequence_info(
+    pick_from_csv: str,
+    patient_attributes_csv: str,
+    num_patients: int,
+    cohort_filter: "CohortFilter | None" = None,
+) -> pd.DataFrame:
+    # Get attributes of the patients with the given sequence ids
+    seq_ids = pick_seq_ids(pick_from_csv, num_patients, cohort_filter)
+    return read_csv(patient_attributes_csv, seq_ids, ["ankomst_tidpunkt"])
+
+
+def _arrival_rows(store: EventStore) -> np.ndarray:
+    # Ignore all timelines that don't start with arrival
+    starts = store.offsets[:-1]
+    non_empty = store.offsets[1:] > starts
+    first_types = store.types[starts[non_empty]]
+    return np.flatnonzero(non_empty)[first_types == Event.Type.ARRIVAL.value]
+
+
+def _no_progress(stage: str, fraction: float) -> None:
+    pass
+
+
+# Columns of the patient attribute file used for the attribute breakdown
+ATTRIBUTE_COLUMNS = [
+    "kon",
+    "akutankomstsatt_namn",
+    "prioritet_akut_kod",
+    "besokorsak_forsta",
+    "alder",
+]
+
+# Read text columns of event files as strings so every chunk gets the same type
+EVENT_READ_OPTIONS = {
+    "dtype": {"time": str, "event_type": str, "event_value": str, "event_info": str}
+}
+
+
+def pick_seq_ids(
+    pick_from_csv: str, num_patients: int, cohort_filter: "CohortFilter | None" = None
+) -> pd.Series:
+    """The sequence ids of the first num_patients rows of the pick-from file,
+    of the rows that pass cohort_filter if it is given."""
+    if cohort_filter is None:
+        return pd.read_csv(pick_from_csv, usecols=["seqID"], nrows=num_patients)["seqID"]
+    seq_ids = pd.read_csv(pick_from_csv, usecols=["seqID"])["seqID"]
+    passed = seq_ids[cohort_filter.apply(seq_ids.to_numpy(dtype="int64"))]
+    return passed.head(num_patients).reset_index(drop=True)
 
-    # Extract which seq-ids to use
-    pick_from_df = pd.read_csv(pick_from_csv).head(num_patients)
 
-    # Get attributes of all patients
-    patient_attributes_df: pd.DataFrame = pd.read_csv(patient_attributes_csv)
+def read_header(csv_path: str) -> list[str]:
+    return pd.read_csv(csv_path, nrows=0).columns.to_list()
 
-    # Filter to all rows with the given sequence ids
-    patient_attributes_df = patient_attributes_df.loc[
-        patient_attributes_df["seqID"].isin(pick_from_df["seqID"])
-    ]
 
-    tl_dict = load_event_timelines(data_paths, patient_attributes_df)
-    agg = EventTimelineAggregate()
-    for key in tl_dict.keys():
-        # Ignore all timelines that don't start with arrival
-        if tl_dict[key].events[0].event_type != Event.Type.ARRIVAL:
-            continue
-        agg.add_event_timeline(tl_dict[key])
-    return agg
+def text_read_options(csv_path: str) -> dict:
+    """Options reading seqID as int64 and every other column as text, so the
+    types don't depend on the values of the chunk a row is in."""
+    return {"dtype": {c: "int64" if c == "seqID" else str for c in read_header(csv_path)}}
 
 
-def read_csv(csv_path: str, seq_ids: pd.Series) -> pd.DataFrame:
-    data = pd.read_csv(csv_path)
-    subset = data.loc[data["seqID"].isin(seq_ids)]
-    return subset
+def read_csv(
+    csv_path: str, seq_ids: pd.Series | None, columns: list[str] | None = None
+) -> pd.DataFrame:
+    """Reads the rows with the given sequence ids (all rows if None), chunk by
+    chunk. Every column but seqID is text.
+
+    Only seqID and columns (all columns if None) are returned.
+    """
+    return cache.scan(
+        csv_path,
+        "csv",
+        seq_ids=seq_ids,
+        columns=columns,
+        read_options=text_read_options(csv_path),
+    )
+
+
+def read_event_table(csv_path: str, seq_ids: pd.Series | None = None) -> pd.DataFrame:
+    """Reads an event file with parsed times and classified event types.
+
+    Times are int64 epoch seconds, missing times are flagged in time_missing
+    and set to MISSING_TIME. The typed table is cached on disk so unchanged
+    files are only parsed once.
+    """
+    return cache.scan(
+        csv_path,
+        "events",
+        _parse_event_table,
+        seq_ids=seq_ids,
+        read_options=EVENT_READ_OPTIONS,
+    )
+
+
+def _parse_event_table(dataset: pd.DataFrame) -> pd.DataFrame:
+    event_type = _to_str(dataset["event_type"])
+    times, time_missing = parse_times(dataset["time"])
+    return pd.DataFrame(
+        {
+            "seqID": dataset["seqID"].to_numpy(dtype="int64"),
+            "time": times,
+            "time_missing": time_missing,
+            "event_type": event_type,
+            "event_value": _to_str(dataset["event_value"]),
+            "event_info": (
+                _to_str(dataset["event_info"])
+                if "event_info" in dataset.columns
+                else np.full(len(dataset), "", dtype=object)
+            ),
+            "type": pd.Series(event_type, dtype=object)
+            .map(Event.TITLE_TYPES)
+            .fillna(Event.Type.OTHER.value)
+            .to_numpy(dtype="int8"),
+        }
+    )
 
 
 def load_event_timelines(
     data_paths: list[str], sequence_info: pd.DataFrame
 ) -> dict[int, EventTimeline]:
+    store = load_event_store(data_paths, sequence_info)
+    return {timeline.seq_id: timeline for timeline in store.timelines()}
+
+
+def load_event_store(
+    data_paths: list[str],
+    sequence_info: pd.DataFrame,
+    progress: Progress | None = None,
+) -> EventStore:
+    """Reads the events of every sequence in sequence_info into an EventStore.
 
-    # Initialize timelines
-    timelines: dict[int, EventTimeline] = {}
-    for _i, row in sequence_info.iterrows():
-        tl: EventTimeline = EventTimeline(
-            row["seqID"], str2datetime(row["ankomst_tidpunkt"])
+    Timelines are in order of first appearance in sequence_info, a sequence
+    listed more than once gets the start time of its last row.
+    """
+    # One timeline per sequence
+    info_seq_ids = sequence_info["seqID"].to_numpy(dtype="int64")
+    start_epochs, _ = parse_times(sequence_info["ankomst_tidpunkt"])
+    seq_ids, first = np.unique(info_seq_ids, return_index=True)
+    last = len(info_seq_ids) - 1 - np.unique(info_seq_ids[::-1], return_index=True)[1]
+    order = np.argsort(first, kind="stable")
+    rows_by_seq = np.empty(len(seq_ids), dtype=np.int64)
+    rows_by_seq[order] = np.arange(len(seq_ids))
+
+    events = read_event_frame(data_paths, sequence_info["seqID"], progress)
+    if progress is not None:
+        progress("Parsing", 0.0)
+
+    # Events are grouped by sequence id, reorder the groups to timeline order
+    event_rows = rows_by_seq[np.searchsorted(seq_ids, events["seqID"].to_numpy())]
+    event_order = np.argsort(event_rows, kind="stable")
+
+    return EventStore(
+        seq_ids[order],
+        start_epochs[last][order],
+        np.bincount(event_rows, minlength=len(seq_ids)),
+        events["time"].to_numpy(dtype="int64")[event_order],
+        events["time_missing"].to_numpy(dtype=bool)[event_order],
+        events["event_type"].to_numpy(dtype=object)[event_order],
+        events["event_value"].to_numpy(dtype=object)[event_order],
+        events["event_info"].to_numpy(dtype=object)[event_order],
+    )
+
+
+def read_event_frame(
+    data_paths: list[str], seq_ids: pd.Series, progress: Progress | None = None
+) -> pd.DataFrame:
+    """Reads all event files into one frame grouped by seqID and sorted by time.
+
+    Consecutive events of the same type and value (in file order) are collapsed
+    the same way as EventTimeline.add_event does.
+    """
+    data_paths = _may_have_rows(data_paths, seq_ids)
+
+    # Files are independent until they are merged, read them in parallel
+    frames: list[pd.DataFrame] = []
+    if len(data_paths) > 0:
+        workers = min(len(data_paths), os.cpu_count() or 1)
+        pool = ThreadPoolExecutor(max_workers=workers)
+        try:
+            futures = [pool.submit(read_event_table, p, seq_ids) for p in data_paths]
+            for i, future in enumerate(futures):
+                if progress is not None:
+                    progress("Reading", i / len(futures))
+                frames.append(future.result())
+        finally:
+            # Files not started yet are skipped if reading was stopped
+            pool.shutdown(cancel_futures=True)
+
+    if len(frames) == 0:
+        return pd.DataFrame(
+            columns=[
+                "seqID",
+                "time",
+                "time_missing",
+                "event_type",
+                "event_value",
+                "event_info",
+                "type",
+            ]
         )
-        timelines[int(row["seqID"])] = tl
+    events = pd.concat(frames, ignore_index=True)
+
+    # Group by sequence id while keeping file order within each sequence
+    events = events.iloc[np.argsort(events["seqID"].to_numpy(), kind="stable")]
 
-    # Read each csv
+    # Collapse consecutive duplicates
+    seq_ids_arr = events["seqID"].to_numpy()
+    types_arr = events["type"].to_numpy()
+    values_arr = events["event_value"].to_numpy()
+    duplicate = np.zeros(len(events), dtype=bool)
+    duplicate[1:] = (
+        (seq_ids_arr[1:] == seq_ids_arr[:-1])
+        & (types_arr[1:] == types_arr[:-1])
+        & (values_arr[1:] == values_arr[:-1])
+    )
+    events = events.iloc[np.flatnonzero(~duplicate)]
+
+    # Sort each sequence by time, ties keep their order
+    order = np.lexsort((events["time"].to_numpy(), events["seqID"].to_numpy()))
+    return events.iloc[order].reset_index(drop=True)
+
+
+def _may_have_rows(data_paths: list[str], seq_ids: pd.Series) -> list[str]:
+    """Leaves out the files whose seqID range in the catalog has none of
+    seq_ids. Files that aren't cataloged or changed since are kept."""
+    wanted = np.unique(seq_ids.to_numpy(dtype="int64"))
+    catalogs: dict[str, Catalog] = {}
+    kept = []
     for path in data_paths:
-        dataset = read_csv(path, sequence_info["seqID"])
-        has_info = "event_info" in dataset.columns
-
-        dataset = dataset.reindex()
-        for _i, row in dataset.iterrows():
-            t = row["time"]
-            if not (type(t) is str) and math.isnan(t):
-                t = "2000-01-01 00:00:00"
-            if has_info:
-                timelines[int(row["seqID"])].add_event(
-                    Event(str2datetime(t), row["event_type"], str(row["event_value"]), str(row["event_info"]))
-                )
-            else:
-                timelines[int(row["seqID"])].add_event(
-                    Event(str2datetime(t), row["event_type"], str(row["event_value"]))
-                )
-    for id in timelines.keys():
-        timelines[id].sort()
-    return timelines
+        directory = os.path.dirname(os.path.abspath(path))
+        if directory not in catalogs:
+            catalogs[directory] = Catalog.load(directory)
+        entry = catalogs[directory].entry(path)
+        if entry is None or entry.overlaps(wanted):
+            kept.append(path)
+    return kept
+
+
+def _to_str(column: pd.Series) -> np.ndarray:
+    # Same as calling str() on every value, missing values become "nan"
+    values = column.to_numpy(dtype=object, copy=True)
+    values[pd.isna(values)] = "nan"
+    return values.astype(str).astype(object)
+
 
 class AggregateDict():
     data_discrete:dict
@@ -107,22 +471,70 @@ class AggregateDict():
             agg_str += f"[{key}]\n" + str(sorted(self.data_continuous[key])) + "\n"
         return agg_str
 
-def get_patient_attribute_aggregate(pa_path:str, seq_ids:list[int]):
-    # Get attributes of all patients
-    patient_attributes_df: pd.DataFrame = pd.read_csv(pa_path)
+class PatientAttributeStore:
+    """Patient attributes of a cohort indexed by seqID.
 
-    # Filter to all rows with the given sequence ids
-    patient_attributes_df = patient_attributes_df.loc[
-        patient_attributes_df["seqID"].isin(seq_ids)
-    ]
+    Discrete attributes are stored as category codes so the breakdown of any
+    set of sequence ids is a bincount per attribute.
+    """
 
-    agg = AggregateDict()
-    for _i, row in patient_attributes_df.drop_duplicates(subset="seqID").iterrows():
-        agg.add_discrete("Gender", str(row["kon"]))
-        agg.add_discrete("Arrival", str(row["akutankomstsatt_namn"]))
-        agg.add_discrete("Priority", str(row["prioritet_akut_kod"]))
-        agg.add_discrete("Visit reason", str(row["besokorsak_forsta"]))
-        agg.add_continuous("Age", row["alder"])
+    # Title shown in the breakdown -> column in the patient attribute file
+    DISCRETE_COLUMNS = {
+        "Gender": "kon",
+        "Arrival": "akutankomstsatt_namn",
+        "Priority": "prioritet_akut_kod",
+        "Visit reason": "besokorsak_forsta",
+    }
 
-    return agg
+    seq_ids: np.ndarray
+    codes: dict[str, np.ndarray]
+    categories: dict[str, np.ndarray]
+    age: np.ndarray
 
+    def __init__(self, attributes: pd.DataFrame) -> None:
+        # First row of every sequence id, sorted by sequence id
+        attributes = attributes.drop_duplicates(subset="seqID")
+        attributes = attributes.iloc[
+            np.argsort(attributes["seqID"].to_numpy(), kind="stable")
+        ]
+        self.seq_ids = attributes["seqID"].to_numpy(dtype="int64")
+
+        self.codes = {}
+        self.categories = {}
+        for title, column in self.DISCRETE_COLUMNS.items():
+            codes, categories = pd.factorize(_to_str(attributes[column]))
+            self.codes[title] = codes
+            self.categories[title] = np.asarray(categories, dtype=object)
+        self.age = pd.to_numeric(attributes["alder"], errors="coerce").to_numpy()
+
+    @staticmethod
+    def load(pa_path: str, seq_ids: pd.Series) -> "PatientAttributeStore":
+        return PatientAttributeStore(read_csv(pa_path, seq_ids, ATTRIBUTE_COLUMNS))
+
+    def rows(self, seq_ids) -> np.ndarray:
+        """Row of every given sequence id that has attributes."""
+        seq_ids = np.unique(np.asarray(seq_ids, dtype="int64"))
+        rows = np.searchsorted(self.seq_ids, seq_ids)
+        found = rows < len(self.seq_ids)
+        found[found] = self.seq_ids[rows[found]] == seq_ids[found]
+        return rows[found]
+
+    def aggregate(self, seq_ids) -> AggregateDict:
+        rows = self.rows(seq_ids)
+        agg = AggregateDict()
+        if len(rows) == 0:
+            return agg
+
+        for title, codes in self.codes.items():
+            categories = self.categories[title]
+            counts = np.bincount(codes.take(rows), minlength=len(categories))
+            present = np.flatnonzero(counts)
+            agg.data_discrete[title] = dict(
+                zip(categories[present].tolist(), counts[present].tolist())
+            )
+        agg.data_continuous["Age"] = self.age.take(rows).tolist()
+        return agg
+
+
+def get_patient_attribute_aggregate(pa_path:str, seq_ids:list[int]):
+    return PatientAttributeStore.load(pa_path, seq_ids).aggregate(seq_ids)
@@ -10,12 +10,18 @@ from PySide6.QtWidgets import (
 )
 from PySide6.QtCore import Qt
 
-from data import create_aggregate
+import snapshot
+from cohort_filter import from_spec
+from data import CohortAggregate, PatientAttributeStore
+from comparison import CohortComparison
+from timeline import EventTimelineAggregate
 
 from gui.icicle_plot import IciclePlot
+from gui.icicle_canvas import IcicleCanvas
 from gui.filter_menu import FilterMenu
 from gui.data_display_menu import DataDisplayMenu
 from gui.collapsable_widget import HideBox
+from gui.generate_job import GenerateJob
 
 class Main(QGroupBox):
 
@@ -51,19 +57,95 @@ class Main(QGroupBox):
         self.icicle_plot = QWidget()  # dummy
         self.window_layout.addWidget(self.icicle_plot)
 
-        self.filter_menu.generate_plot_signal.connect(lambda d: self.create_icicle(d))
+        # Running generate, older jobs are kept until their thread finishes
+        self.generate_job: GenerateJob | None = None
+        self.jobs: list[GenerateJob] = []
+        # Aggregate of the plot shown, updated by the next generate
+        self.cohort: CohortAggregate | None = None
 
-    def create_icicle(self, data: dict):
-        agg = create_aggregate(
+        self.filter_menu.generate_plot_signal.connect(self.generate)
+        self.filter_menu.cancel_signal.connect(self.cancel_generate)
+
+        # Reopen the plot of the last session if it is stored and up to date
+        data = self.filter_menu.plot_parameters()
+        if snapshot.is_current(
             data["data_paths"],
             data["pick_from"],
             data["patient_attributes"],
             data["num_patients"],
-        )
+            from_spec(data["cohort_filter"]),
+        ):
+            self.generate(data)
+
+    def generate(self, data: dict):
+        # A new generate replaces the running one
+        self.cancel_generate()
+        job = GenerateJob(data, self.cohort)
+        job.progress_signal.connect(self._on_generate_progress)
+        job.done_signal.connect(self._on_generate_done)
+        job.failed_signal.connect(self._on_generate_failed)
+        job.finished.connect(self._on_job_finished)
+        self.generate_job = job
+        self.jobs.append(job)
+        job.start()
+
+    def cancel_generate(self):
+        if self.generate_job is not None:
+            self.generate_job.cancel()
+            self.generate_job = None
+        self.filter_menu.clear_progress()
+
+    def _on_generate_progress(self, stage: str, percent: int):
+        if self.sender() is self.generate_job:
+            self.filter_menu.set_progress(stage, percent)
+
+    def _on_generate_failed(self, message: str):
+        if self.sender() is self.generate_job:
+            self.generate_job = None
+            self.filter_menu.set_progress(message, 0)
+
+    def _on_generate_done(
+        self,
+        cohort: CohortAggregate,
+        agg: EventTimelineAggregate,
+        attributes: PatientAttributeStore,
+        comparison: CohortComparison | None,
+    ):
+        if self.sender() is not self.generate_job:
+            return  # superseded or cancelled
+        self.generate_job = None
+        self.cohort = cohort
+        self.create_icicle(self.sender().data, agg, attributes, comparison)
+        self.filter_menu.clear_progress()
+
+    def _on_job_finished(self):
+        self.jobs.remove(self.sender())
+
+    def create_icicle(
+        self,
+        data: dict,
+        agg: EventTimelineAggregate,
+        attributes: PatientAttributeStore,
+        comparison: CohortComparison | None = None,
+    ):
+        # Loaded once per plot, every selection reads from the store
+        self.data_display_menu.set_patient_attributes(attributes)
         self.window_layout.removeWidget(self.icicle_plot)
-        self.icicle_plot = IciclePlot(
-            agg.event_aggregate_root, data["row_height"], data["group_similar"]
-        )
+        # Only the canvas colors nodes by the difference of cohorts
+        if data["renderer"] == "Canvas" or comparison is not None:
+            self.icicle_plot = IcicleCanvas(
+                agg.event_aggregate_root,
+                data["row_height"],
+                data["group_similar"],
+                comparison,
+            )
+        else:
+            self.icicle_plot = IciclePlot(
+                agg.event_aggregate_root,
+                data["row_height"],
+                data["group_similar"],
+                compress_chains=data["compress_chains"],
+            )
         self.window_layout.addWidget(self.icicle_plot)
         self.icicle_plot.icicle_selection_signal.connect(self.data_display_menu.display)
 
@@ -0,0 +1,23 @@
+from PySide6.QtCore import QThread, Signal
+
+from catalog import Catalog
+
+
+class CatalogJob(QThread):
+    """Brings the catalog of a data source directory up to date in a
+    background thread, only new and changed files are read."""
+
+    done_signal = Signal(Catalog)
+
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = directory
+
+    def run(self) -> None:
+        catalog = Catalog.load(self.directory)
+        try:
+            catalog.refresh()
+        except OSError:
+            # The directory can't be listed, entries are checked when used
+            pass
+        self.done_signal.emit(catalog)
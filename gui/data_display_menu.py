@@ -5,22 +5,35 @@ from PySide6.QtWidgets import (
     QHBoxLayout,
     QVBoxLayout,
     QSizePolicy,
+    QFormLayout,
 )
 from PySide6.QtCore import Qt, QSettings
 
-from gui.histogram import HistogramWidget
+from gui.histogram import HistogramWidget, format_minutes
 from gui.icicle_plot import Icicle
-from data import get_patient_attribute_aggregate, AggregateDict
-from gui.gui_components import ColorBox
+from gui.icicle_canvas import CanvasIcicle
+from data import PatientAttributeStore, AggregateDict
+from timeline import EventAggregate
+from gui.gui_components import ColorBox, NoScrollComboBox
+from cohort_sets import NodeSelection, OPERATIONS, OPERATION_NAMES
 
 import gui.stacked_bar as sb
 
 
 class DataDisplayMenu(QGroupBox):
 
+    patient_attributes: PatientAttributeStore | None
+    # Selected nodes in click order, and how each is combined with the
+    # cohort of the nodes before it
+    nodes: list[EventAggregate]
+    operations: dict[EventAggregate, str]
+
     def __init__(self):
         super().__init__("Data display")
         self.settings = QSettings("InfraVis", "PatientFlow")
+        self.patient_attributes = None
+        self.nodes = []
+        self.operations = {}
         self.main_layout = QVBoxLayout()
         self.main_layout.setAlignment(Qt.AlignmentFlag.AlignTop)
         self.setSizePolicy(QSizePolicy.Policy.MinimumExpanding, QSizePolicy.Policy.MinimumExpanding)
@@ -40,62 +53,108 @@ class DataDisplayMenu(QGroupBox):
 
         title_label_widget.setLayout(title_label_layout)
 
+        # Every selected node after the first with its operation
+        self.operations_layout = QFormLayout()
+        operations_widget = QWidget()
+        operations_widget.setLayout(self.operations_layout)
+        self.cohort_label = QLabel()
+        self.cohort_label.setWordWrap(True)
+
+        # Waits since the previous event of a single selected node
+        self.wait_label = QLabel()
+
         self.histogram = QWidget()  # dummy
         self.patient_data_vis = QWidget()  # dummy
         self.patient_data = QLabel()
         self.patient_data.setWordWrap(True)
 
         self.main_layout.addWidget(title_label_widget)
+        self.main_layout.addWidget(operations_widget)
+        self.main_layout.addWidget(self.cohort_label)
+        self.main_layout.addWidget(self.wait_label)
         self.main_layout.addWidget(self.histogram)
         # self.main_layout.addWidget(self.patient_data_vis)
         self.main_layout.addWidget(self.patient_data)
 
-    def display(self, i1: Icicle | None, i2: Icicle | None) -> None:
+    def set_patient_attributes(self, store: PatientAttributeStore) -> None:
+        self.patient_attributes = store
+
+    def display(self, selected: list[Icicle | CanvasIcicle]) -> None:
+        self.nodes = [icicle.data for icicle in selected]
+        # Nodes that stay selected keep their operation, new ones intersect
+        self.operations = {node: self.operations.get(node, "and") for node in self.nodes}
+
+        while self.operations_layout.rowCount() > 0:
+            self.operations_layout.removeRow(0)
+        for node in self.nodes[1:]:
+            combo_box = NoScrollComboBox()
+            combo_box.addItems([OPERATION_NAMES[o] for o in OPERATIONS])
+            combo_box.setCurrentIndex(OPERATIONS.index(self.operations[node]))
+            combo_box.currentIndexChanged.connect(
+                lambda i, node=node: self.set_operation(node, OPERATIONS[i])
+            )
+            self.operations_layout.addRow(QLabel(node.key), combo_box)
+        self.update_cohort()
+
+    def set_operation(self, node: EventAggregate, operation: str) -> None:
+        self.operations[node] = operation
+        self.update_cohort()
+
+    def update_cohort(self) -> None:
         self.main_layout.removeWidget(self.histogram)
         self.histogram.deleteLater()
+        self.histogram = QWidget()
 
-        # self.main_layout.removeWidget(self.patient_data_vis)
-        # self.patient_data_vis.deleteLater()
+        selection = NodeSelection(self.nodes, [self.operations[n] for n in self.nodes])
+        ends = selection.ends()
+        self.from_event_label.setText("<from>" if len(self.nodes) == 0 else self.nodes[0].key)
+        self.to_event_label.setText("<to>" if ends is None else ends[1].key)
 
-        self.from_event_label.setText("<from>" if i1 is None else i1.data.key)
-        self.to_event_label.setText("<to>" if i2 is None else i2.data.key)
+        # Wait of a single node, counted when the tree was built
+        single = len(self.nodes) == 1
+        self.wait_label.setText(wait_text(self.nodes[0]) if single else "")
 
-        # Histogram
-        if (i1 is None) or (i2 is None):
-            self.histogram = QWidget()
-            # self.patient_data_vis = QWidget()
-        else:
-            data = i1.data.get_time_diffs(i2.data)
-            self.histogram = HistogramWidget(data, 500, 350, 5)
-            self.main_layout.addWidget(self.histogram)
-
-        # Data
-        seq_ids:list[int] = []
-        if (i1 is None) and (i2 is None):
+        if len(self.nodes) == 0:
+            self.cohort_label.setText("")
             self.patient_data.setText("")
             return
-        elif not((i1 is None) or (i2 is None)):
-            seq_ids = i1.data.get_common_seqids(i2.data)
-        elif not(i1 is None):
-            seq_ids = list(i1.data.events.keys())
-        elif not(i2 is None):
-            seq_ids = list(i2.data.events.keys())
+
+        seq_ids = selection.seq_ids()
+        self.cohort_label.setText(
+            "" if single else f"{len(seq_ids)} patients: {selection.describe()}"
+        )
+
+        # Histogram between the first and the last node of the cohort
+        if ends is not None:
+            self.histogram = HistogramWidget(selection.time_diffs(), 500, 350, 5)
+            index = self.main_layout.indexOf(self.patient_data)
+            self.main_layout.insertWidget(index, self.histogram)
 
         if len(seq_ids) == 0:
             self.patient_data.setText("No common sequences")
             return
 
-        pa = (
-            str(self.settings.value("data_source_dir", ""))
-            + "/"
-            + str(self.settings.value("patient_attributes", "", str))
-        )
-        agg_dict = get_patient_attribute_aggregate(pa, seq_ids)
+        if self.patient_attributes is None:
+            self.patient_data.setText("")
+            return
+        agg_dict = self.patient_attributes.aggregate(seq_ids)
         self.patient_data.setText(str(agg_dict))
 
         # self.patient_data_vis = PatientDataVis(agg_dict)
         # self.main_layout.addWidget(self.patient_data_vis)
 
+def wait_text(data: EventAggregate) -> str:
+    wait = data.wait_stats
+    if wait.count == 0:
+        return "No waits from the previous event"
+    return (
+        f"Wait from the previous event ({wait.count} patients)\n"
+        f"mean {format_minutes(wait.mean)}, p50 {format_minutes(wait.quantile(0.5))}"
+        f", p90 {format_minutes(wait.quantile(0.9))}\n"
+        f"min {format_minutes(wait.min)}, max {format_minutes(wait.max)}"
+    )
+
+
 class ColorLabel(QLabel):
     def __init__(self,text:str, color:str, width: int, height: int, tooltip:str):
         super().__init__(text)
@@ -9,6 +9,9 @@ from PySide6.QtWidgets import (
     QCheckBox,
     QLineEdit,
     QSpinBox,
+    QDoubleSpinBox,
+    QProgressBar,
+    QHBoxLayout,
 )
 from PySide6.QtCore import Qt, QSettings, Signal
 
@@ -17,15 +20,24 @@ import os
 from gui.collapsable_widget import HideBox
 from gui.gui_components import NoScrollComboBox
 from gui.value_filter import ValueFilter
+from gui.catalog_job import CatalogJob
+from catalog import Catalog
+from comparison import SPLITS, SPLIT_EVENT
+
+RENDERERS = ["Widgets", "Canvas"]
 
 class FilterMenu(QWidget):
 
     generate_plot_signal = Signal(dict)
+    cancel_signal = Signal()
     refresh_signal = Signal(str)  # directory path as argument
+    catalog_signal = Signal(Catalog)  # catalog of the refreshed directory
 
     def __init__(self):
         super().__init__()
         self.settings = QSettings("InfraVis", "PatientFlow")
+        # Running catalog updates, kept until they finish
+        self.catalog_jobs: list[CatalogJob] = []
         # Header
         header_group_box = QGroupBox("Source")
         self.header_layout = QFormLayout()
@@ -103,12 +115,97 @@ class FilterMenu(QWidget):
         )
 
         display_layout.addRow(QLabel("Group similar events"), self.group_similar_cb)
+
+        self.compress_chains_cb = QCheckBox()
+        compress_chains = self.settings.value("compress_chains", False, bool)
+        if type(compress_chains) is bool:
+            self.compress_chains_cb.setChecked(compress_chains)
+        self.compress_chains_cb.checkStateChanged.connect(
+            lambda x: self.settings.setValue(
+                "compress_chains", self.compress_chains_cb.isChecked()
+            )
+        )
+        display_layout.addRow(QLabel("Compress chains"), self.compress_chains_cb)
+
+        # Widgets per node, or one canvas that paints the nodes in view
+        self.renderer_cb = NoScrollComboBox()
+        self.renderer_cb.setFocusPolicy(Qt.FocusPolicy.StrongFocus)
+        self.renderer_cb.addItems(RENDERERS)
+        renderer = self.settings.value("renderer", RENDERERS[0], str)
+        if renderer in RENDERERS:
+            self.renderer_cb.setCurrentText(renderer)
+        self.renderer_cb.currentTextChanged.connect(
+            lambda x: self.settings.setValue("renderer", x)
+        )
+        display_layout.addRow(QLabel("Renderer"), self.renderer_cb)
+
+        # Cohorts to compare, the nodes are colored by their difference
+        self.compare_cb = NoScrollComboBox()
+        self.compare_cb.setFocusPolicy(Qt.FocusPolicy.StrongFocus)
+        self.compare_cb.addItems(SPLITS)
+        compare = self.settings.value("compare", SPLITS[0], str)
+        if compare in SPLITS:
+            self.compare_cb.setCurrentText(compare)
+        self.compare_cb.currentTextChanged.connect(
+            lambda x: self.settings.setValue("compare", x)
+        )
+        display_layout.addRow(QLabel("Compare"), self.compare_cb)
+
+        self.compare_event_edit = QLineEdit()
+        self.compare_event_edit.setText(str(self.settings.value("compare_event", "rontgen")))
+        self.compare_event_edit.textChanged.connect(
+            lambda x: self.settings.setValue("compare_event", x)
+        )
+        display_layout.addRow(QLabel("Compare event"), self.compare_event_edit)
+        display_layout.setRowVisible(
+            self.compare_event_edit, self.compare_cb.currentText() == SPLIT_EVENT
+        )
+        self.compare_cb.currentTextChanged.connect(
+            lambda x: display_layout.setRowVisible(self.compare_event_edit, x == SPLIT_EVENT)
+        )
+
+        # Pruning, rare events are merged into an "other" node
+        self.min_support_spin_box = QSpinBox()
+        self.min_support_spin_box.setMaximum(1000000)
+        min_support = self.settings.value("min_support", 0, int)
+        if type(min_support) is int:
+            self.min_support_spin_box.setValue(min_support)
+        self.min_support_spin_box.valueChanged.connect(
+            lambda x: self.settings.setValue("min_support", x)
+        )
+        display_layout.addRow(QLabel("Min support (patients)"), self.min_support_spin_box)
+
+        self.min_support_percent_spin_box = QDoubleSpinBox()
+        self.min_support_percent_spin_box.setMaximum(100)
+        self.min_support_percent_spin_box.setSingleStep(0.1)
+        min_support_percent = self.settings.value("min_support_percent", 0.0, float)
+        if type(min_support_percent) is float:
+            self.min_support_percent_spin_box.setValue(min_support_percent)
+        self.min_support_percent_spin_box.valueChanged.connect(
+            lambda x: self.settings.setValue("min_support_percent", x)
+        )
+        display_layout.addRow(QLabel("Min support (%)"), self.min_support_percent_spin_box)
+
+        self.max_children_spin_box = QSpinBox()
+        self.max_children_spin_box.setMaximum(1000000)
+        self.max_children_spin_box.setSpecialValueText("No limit")
+        self.max_children_spin_box.setToolTip(
+            "Children shown per node at most, the merged \"other\" child included"
+        )
+        max_children = self.settings.value("max_children", 0, int)
+        if type(max_children) is int:
+            self.max_children_spin_box.setValue(max_children)
+        self.max_children_spin_box.valueChanged.connect(
+            lambda x: self.settings.setValue("max_children", x)
+        )
+        display_layout.addRow(QLabel("Max children"), self.max_children_spin_box)
         
         # Filter
         value_filter_group_box = QGroupBox("Filter")
         value_filter_layout = QVBoxLayout()
         self.value_filter = ValueFilter()
         self.refresh_signal.connect(self.value_filter.update_files)
+        self.catalog_signal.connect(self.value_filter.update_catalog)
         value_filter_group_box.setLayout(value_filter_layout)
         value_filter_layout.addWidget(self.value_filter)
 
@@ -116,6 +213,19 @@ class FilterMenu(QWidget):
         self.generate_plot_button = QPushButton("Generate plot")
         self.generate_plot_button.clicked.connect(self.generate)
 
+        # Progress of a running generate
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancel_signal.emit)
+        progress_layout = QHBoxLayout()
+        progress_layout.setContentsMargins(0, 0, 0, 0)
+        progress_layout.addWidget(self.progress_bar)
+        progress_layout.addWidget(self.cancel_button)
+        self.progress_widget = QWidget()
+        self.progress_widget.setLayout(progress_layout)
+        self.progress_widget.setVisible(False)
+
         # Main
         self.main_layout = QVBoxLayout()
         self.main_widget = QWidget()
@@ -143,8 +253,9 @@ class FilterMenu(QWidget):
         self.main_layout.addWidget(rows_group_box)
         self.main_layout.addWidget(num_patients_widget)
         self.main_layout.addWidget(display_group_box)
-        # self.main_layout.addWidget(value_filter_group_box)
+        self.main_layout.addWidget(value_filter_group_box)
         self.main_layout.addWidget(self.generate_plot_button)
+        self.main_layout.addWidget(self.progress_widget)
         self.refresh()
 
     def refresh(self):
@@ -162,7 +273,8 @@ class FilterMenu(QWidget):
         if not os.path.exists(self.data_source.text()):
             return
 
-        files = os.listdir(self.data_source.text())
+        # Skip hidden entries such as the parsed file cache
+        files = [f for f in os.listdir(self.data_source.text()) if not f.startswith(".")]
         files.sort()
 
         for p in files:
@@ -195,7 +307,17 @@ class FilterMenu(QWidget):
         )
         self.refresh_signal.emit(self.data_source.text())
 
+        # Column types and statistics of the files, read in the background
+        job = CatalogJob(self.data_source.text())
+        job.done_signal.connect(self.catalog_signal.emit)
+        job.finished.connect(lambda: self.catalog_jobs.remove(job))
+        self.catalog_jobs.append(job)
+        job.start()
+
     def generate(self):
+        self.generate_plot_signal.emit(self.plot_parameters())
+
+    def plot_parameters(self) -> dict:
         data_paths: list[str] = []
 
         for fc in self.rows:
@@ -213,8 +335,25 @@ class FilterMenu(QWidget):
             + self.patient_attributes_cb.currentText(),
             "group_similar": self.group_similar_cb.checkState().value,
             "row_height": self.row_height_spin_box.value(),
+            "compress_chains": self.compress_chains_cb.isChecked(),
+            "renderer": self.renderer_cb.currentText(),
+            "cohort_filter": self.value_filter.spec(),
+            "compare": self.compare_cb.currentText(),
+            "compare_event": self.compare_event_edit.text(),
+            "min_support": self.min_support_spin_box.value(),
+            "min_support_percent": self.min_support_percent_spin_box.value(),
+            "max_children": self.max_children_spin_box.value(),
         }
-        self.generate_plot_signal.emit(out)
+        return out
+
+
+    def set_progress(self, stage: str, percent: int) -> None:
+        self.progress_widget.setVisible(True)
+        self.progress_bar.setFormat(f"{stage} %p%")
+        self.progress_bar.setValue(percent)
+
+    def clear_progress(self) -> None:
+        self.progress_widget.setVisible(False)
 
 
 class FilterCheck(QCheckBox):
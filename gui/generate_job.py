@@ -0,0 +1,85 @@
+from PySide6.QtCore import QThread, Signal
+
+import snapshot
+from cohort_filter import from_spec
+from comparison import compare
+from data import CohortAggregate, pick_seq_ids, PatientAttributeStore
+from timeline import EventTimelineAggregate
+
+
+class GenerationCancelled(Exception):
+    pass
+
+
+class GenerateJob(QThread):
+    """Loads the data of a plot in a background thread.
+
+    Only the widgets are built on the GUI thread, from the aggregate handed
+    over by done_signal. The aggregate of the previous plot is updated when
+    only the patient count or the event files changed, aggregates that had to
+    be built are stored as snapshots and reopened from them next time.
+    """
+
+    progress_signal = Signal(str, int)  # stage, percent
+    # Cohort, the pruned aggregate to show and its CohortComparison or None
+    done_signal = Signal(
+        CohortAggregate, EventTimelineAggregate, PatientAttributeStore, object
+    )
+    failed_signal = Signal(str)
+
+    def __init__(self, data: dict, previous: CohortAggregate | None = None):
+        super().__init__()
+        self.data = data
+        self.previous = previous
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        # Checked at every progress report of the loading code
+        self.cancelled = True
+
+    def run(self) -> None:
+        data = self.data
+        try:
+            cohort_filter = from_spec(data["cohort_filter"])
+            params = (
+                data["data_paths"],
+                data["pick_from"],
+                data["patient_attributes"],
+                data["num_patients"],
+                self._on_progress,
+                cohort_filter,
+            )
+            cohort = snapshot.load(*params[:4], cohort_filter)
+            if cohort is None:
+                if self.previous is not None:
+                    cohort = self.previous.update(*params)
+                if cohort is None:
+                    cohort = CohortAggregate.build(*params)
+                self._on_progress("Saving", 0.0)
+                snapshot.save(cohort)
+            # The full aggregate is kept to update and store, only the plot
+            # is pruned
+            agg = cohort.aggregate.pruned(
+                data["min_support"],
+                data["min_support_percent"] / 100,
+                data["max_children"],
+            )
+            self._on_progress("Reading", 1.0)
+            attributes = PatientAttributeStore.load(
+                data["patient_attributes"],
+                pick_seq_ids(data["pick_from"], data["num_patients"], cohort_filter),
+            )
+            # The cohorts to compare are counted on the tree already built
+            comparison = compare(agg, attributes, data["compare"], data["compare_event"])
+            self._on_progress("Layout", 0.0)
+        except GenerationCancelled:
+            return
+        except Exception as e:
+            self.failed_signal.emit(f"{type(e).__name__}: {e}")
+            return
+        self.done_signal.emit(cohort, agg, attributes, comparison)
+
+    def _on_progress(self, stage: str, fraction: float) -> None:
+        if self.cancelled:
+            raise GenerationCancelled()
+        self.progress_signal.emit(stage, round(fraction * 100))
@@ -12,6 +12,9 @@ from PySide6.QtGui import QCursor, QMouseEvent, QWheelEvent
 class ColorBox(QPushButton):
 
     clicked_signal = Signal(QMouseEvent)
+    # Only emitted if double_click_enabled, double clicks are two clicks
+    # otherwise
+    double_clicked_signal = Signal()
 
     def __init__(
         self,
@@ -25,6 +28,7 @@ class ColorBox(QPushButton):
         super().__init__(parent)
         self.color = color
         self.selected_counter = 0
+        self.double_click_enabled = False
         if height < 0:
             self.setFixedWidth(width)
             self.setSizePolicy(QSizePolicy.Policy.Fixed, QSizePolicy.Policy.Expanding)
@@ -82,6 +86,12 @@ class ColorBox(QPushButton):
     def mousePressEvent(self, mouse_event: QMouseEvent):
         self.clicked_signal.emit(mouse_event)
 
+    def mouseDoubleClickEvent(self, mouse_event: QMouseEvent):
+        if self.double_click_enabled:
+            self.double_clicked_signal.emit()
+        else:
+            super().mouseDoubleClickEvent(mouse_event)
+
 
 class Selected:
     def __init__(self, obj) -> None:
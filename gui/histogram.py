@@ -1,69 +1,144 @@
 import sys
 import numpy as np
-from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.figure import Figure
 from PySide6.QtWidgets import (
     QApplication,
     QMainWindow,
     QWidget,
-    QVBoxLayout,
     QSizePolicy,
 )
-import matplotlib.ticker as ticker
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QRectF
+from PySide6.QtGui import QColor, QPainter, QPaintEvent, QPen
 import math
 
+BAR_COLOR = "skyblue"
+
+
+def format_minutes(x: float) -> str:
+    return f"{math.floor(int(x)/60)}:{(int(x)%60):0>2}"
+
+
+def count_step(max_count: float) -> int:
+    """Distance between the ticks of the count axis."""
+    if max_count <= 20:
+        return 1
+    elif max_count <= 200:
+        return 10
+    elif max_count <= 2000:
+        return 100
+    else:
+        return 1000
+
+
 class HistogramWidget(QWidget):
+    """Histogram of wait times in minutes, painted with QPainter.
+
+    The bins are counted once when the widget is made, painting only draws
+    the bars and the axes, so many histograms can be open at once.
+    """
+
     def __init__(self, data, height: int = -1, width:int = 300, bins=10, parent=None):
         super().__init__(parent)
+        self.counts, self.edges = np.histogram(np.asarray(data, dtype=float), bins=bins)
 
-        # Create a Matplotlib figure and canvas
-        self.figure = Figure(figsize=(4, 3), constrained_layout=True)
-        self.canvas = FigureCanvas(self.figure)
         self.setFixedWidth(width)
         if height > 0:
             self.setFixedHeight(height)
         else:
             self.setMaximumHeight(500)
         self.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
-        # Create a vertical layout and add the canvas
-        layout = QVBoxLayout()
-        layout.addWidget(self.canvas)
-        layout.setAlignment(Qt.AlignmentFlag.AlignTop)
-        self.setLayout(layout)
-    
-        # Plot the histogram
-        self.plot_histogram(data, bins)
-
-    def plot_histogram(self, data, num_bins):
-        ax = self.figure.add_subplot(111)
-        ax.clear()
-        counts, bins, patches = ax.hist(data, bins=num_bins, color="skyblue", edgecolor="black")
-        ax.set_xticks(bins)
-        ax.set_ylabel("Frequency")
-        
-        max_count = max(counts)
-
-        if max_count <= 20:
-            ax.yaxis.set_major_locator(ticker.MultipleLocator(1))
-        elif max_count <= 200:
-            ax.yaxis.set_major_locator(ticker.MultipleLocator(10))
-        elif max_count <= 2000:
-            ax.yaxis.set_major_locator(ticker.MultipleLocator(100))
+
+    def paintEvent(self, event: QPaintEvent) -> None:
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor("white"))
+        metrics = painter.fontMetrics()
+        line = metrics.height()
+
+        max_count = max(int(self.counts.max()), 1)
+        # Room above the highest bar, as matplotlib leaves it
+        top_count = max_count * 1.05
+        step = count_step(max_count)
+
+        # Too low for labels, only the bars are drawn
+        with_axes = self.height() >= 5 * line
+        if with_axes:
+            left = line + metrics.horizontalAdvance(str(max_count)) + 12
+            right = metrics.horizontalAdvance(format_minutes(self.edges[-1])) / 2 + 4
+            top = line / 2
+            bottom = 2 * line + 8
         else:
-            ax.yaxis.set_major_locator(ticker.MultipleLocator(1000))
+            left = right = top = bottom = 1
+        plot = QRectF(
+            left,
+            top,
+            max(self.width() - left - right, 1),
+            max(self.height() - top - bottom, 1),
+        )
+
+        # Bars
+        painter.setPen(QPen(QColor("black"), 1))
+        painter.setBrush(QColor(BAR_COLOR))
+        span = max(self.edges[-1] - self.edges[0], 1e-9)
+        for count, start, end in zip(self.counts.tolist(), self.edges[:-1], self.edges[1:]):
+            height = plot.height() * count / top_count
+            x = plot.left() + plot.width() * (start - self.edges[0]) / span
+            x_end = plot.left() + plot.width() * (end - self.edges[0]) / span
+            painter.drawRect(QRectF(x, plot.bottom() - height, x_end - x, height))
+
+        if not with_axes:
+            painter.end()
+            return
+
+        painter.setBrush(Qt.BrushStyle.NoBrush)
+        painter.drawRect(plot)
 
-        ax.yaxis.set_major_formatter(ticker.FuncFormatter(lambda x, _: str(int(x))))
-        ax.xaxis.set_major_formatter(ticker.FuncFormatter(lambda x, _: f"{math.floor(int(x)/60)}:{(int(x)%60):0>2}" ))
-        ax.set_xlabel("Time (HH:MM)")
+        # Count axis, every step or a multiple of it if the labels overlap
+        while plot.height() * step / top_count < line and step < top_count:
+            step *= 2
+        for count in range(0, int(top_count) + 1, step):
+            y = plot.bottom() - plot.height() * count / top_count
+            painter.drawLine(int(plot.left()) - 4, int(y), int(plot.left()), int(y))
+            label_rect = QRectF(0, y - line / 2, plot.left() - 6, line)
+            painter.drawText(
+                label_rect,
+                Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter,
+                str(count),
+            )
+        painter.save()
+        painter.translate(0, plot.center().y())
+        painter.rotate(-90)
+        painter.drawText(
+            QRectF(-plot.height() / 2, 0, plot.height(), line),
+            Qt.AlignmentFlag.AlignCenter,
+            "Frequency",
+        )
+        painter.restore()
 
-        self.canvas.draw()
+        # Time axis, a tick at every bin edge
+        labels = [format_minutes(edge) for edge in self.edges]
+        widest = max(metrics.horizontalAdvance(label) for label in labels) + 6
+        bin_width = plot.width() / len(self.counts)
+        every = max(math.ceil(widest / bin_width), 1)
+        for i, (edge, label) in enumerate(zip(self.edges, labels)):
+            x = plot.left() + plot.width() * (edge - self.edges[0]) / span
+            painter.drawLine(int(x), int(plot.bottom()), int(x), int(plot.bottom()) + 4)
+            if i % every == 0:
+                painter.drawText(
+                    QRectF(x - widest / 2, plot.bottom() + 4, widest, line),
+                    Qt.AlignmentFlag.AlignCenter,
+                    label,
+                )
+        painter.drawText(
+            QRectF(plot.left(), plot.bottom() + 4 + line, plot.width(), line + 4),
+            Qt.AlignmentFlag.AlignCenter,
+            "Time (HH:MM)",
+        )
+        painter.end()
 
 
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
-        self.setWindowTitle("Qt + Matplotlib Histogram")
+        self.setWindowTitle("Qt Histogram")
 
         # Sample data
         data = np.random.normal(loc=0, scale=1, size=5)
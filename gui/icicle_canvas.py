@@ -0,0 +1,517 @@
+from PySide6.QtWidgets import QAbstractScrollArea, QToolTip
+from PySide6.QtCore import Qt, Signal, QEvent, QPoint, QRectF
+from PySide6.QtGui import (
+    QBrush,
+    QColor,
+    QHelpEvent,
+    QMouseEvent,
+    QPainter,
+    QPaintEvent,
+    QPen,
+    QResizeEvent,
+    QWheelEvent,
+)
+
+import numpy as np
+
+import timeline
+from comparison import CohortComparison
+from gui.histogram import HistogramWidget
+from gui.icicle_plot import node_tooltip
+
+# Colors of nodes the first compared cohort passes through more and less
+# often than the others, nodes without a difference are white
+DIFF_MORE = QColor("#C0392B")
+DIFF_LESS = QColor("#2E6DB4")
+
+
+def diff_color(t: float) -> QColor:
+    """Color of a difference scaled to -1..1."""
+    end = DIFF_MORE if t > 0 else DIFF_LESS
+    t = min(abs(t), 1.0)
+    return QColor(
+        round(255 + (end.red() - 255) * t),
+        round(255 + (end.green() - 255) * t),
+        round(255 + (end.blue() - 255) * t),
+    )
+
+
+class IcicleLayout:
+    """Positions of the nodes of an aggregate in an icicle plot.
+
+    Nodes at depth d are in column d, a node starts top rows below the top of
+    the plot and is as many rows tall as it has timelines. Children are
+    stacked under the top of their parent in the order IciclePlot uses, the
+    timelines ending at a node take the rows below its children.
+    """
+
+    tree: timeline.EventTimelineAggregate
+    top: np.ndarray  # int64 first row of every node
+    # Per column, the nodes sorted by top, their tops and their bottoms
+    columns: list[np.ndarray]
+    column_tops: list[np.ndarray]
+    column_bottoms: list[np.ndarray]
+    # Color of every node as a code in color_table
+    colors: np.ndarray
+    color_table: list[str]
+    # Number of nodes in the subtree of every node, itself included
+    subtree_nodes: np.ndarray
+
+    def __init__(self, tree: timeline.EventTimelineAggregate, group_similar: bool):
+        self.tree = tree
+        num_nodes = len(tree)
+
+        key_colors = [] if tree.store is None else tree.store.key_colors
+        self.color_table = list(key_colors) + [timeline.OTHER_COLOR, "#000000"]
+        codes = np.asarray(tree.keys, dtype=np.int64)
+        self.colors = np.where(codes == timeline.OTHER_KEY, len(key_colors), codes)
+        self.colors[0] = len(key_colors) + 1
+        # Position of every color in sorted order, to group similar events
+        color_rank = np.unique(np.array(self.color_table), return_inverse=True)[1]
+
+        sizes = tree.sizes
+        self.top = np.zeros(num_nodes, dtype=np.int64)
+        self.columns = [np.zeros(1, dtype=np.int64)]
+        for level in tree.levels():
+            parents = tree.parents[level]
+            level_sizes = sizes[level]
+            # Biggest first, of every color if grouped, oldest first on ties
+            if group_similar:
+                order = np.lexsort(
+                    (level, -level_sizes, -color_rank[self.colors[level]], parents)
+                )
+            else:
+                order = np.lexsort((level, -level_sizes, parents))
+            nodes = level[order]
+            ends = np.cumsum(sizes[nodes])
+            starts = ends - sizes[nodes]
+            first = np.concatenate([[True], parents[order][1:] != parents[order][:-1]])
+            group_start = np.maximum.accumulate(np.where(first, starts, 0))
+            self.top[nodes] = self.top[parents[order]] + starts - group_start
+            self.columns.append(nodes[np.argsort(self.top[nodes], kind="stable")])
+
+        self.column_tops = [self.top[nodes] for nodes in self.columns]
+        self.column_bottoms = [self.top[nodes] + sizes[nodes] for nodes in self.columns]
+
+        self.subtree_nodes = np.ones(num_nodes, dtype=np.int64)
+        for nodes in reversed(self.columns[1:]):
+            np.add.at(
+                self.subtree_nodes, tree.parents[nodes], self.subtree_nodes[nodes]
+            )
+
+    @property
+    def num_rows(self) -> int:
+        # The root is empty, its children hold every timeline
+        if len(self.columns) < 2:
+            return 0
+        return int(self.column_bottoms[1][-1])
+
+    def visible(self, column: int, first_row: float, last_row: float) -> np.ndarray:
+        """Nodes of a column that overlap the rows from first_row to last_row."""
+        start = np.searchsorted(self.column_bottoms[column], first_row, side="right")
+        end = np.searchsorted(self.column_tops[column], last_row, side="left")
+        return self.columns[column][start:end]
+
+    def level_of_detail(
+        self, nodes: np.ndarray, min_rows: float
+    ) -> tuple[np.ndarray, list["LodBlock"]]:
+        """Splits nodes of a column, sorted by top, into the nodes to draw and
+        blocks of the subtrees smaller than min_rows.
+
+        Adjacent small siblings make one block. Nodes below a small node are
+        in the block of an ancestor and left out of both.
+        """
+        tree = self.tree
+        parents = tree.parents[nodes]
+        small = tree.sizes[nodes] < min_rows
+        # The root is empty but never hidden
+        hidden = (parents > 0) & (tree.sizes[np.maximum(parents, 0)] < min_rows)
+        small &= nodes != 0
+        shown = nodes[~small & ~hidden]
+
+        merged = nodes[small & ~hidden]
+        if len(merged) == 0:
+            return shown, []
+        tops = self.top[merged]
+        bottoms = tops + tree.sizes[merged]
+        merged_parents = tree.parents[merged]
+        starts = np.flatnonzero(
+            np.concatenate(
+                [
+                    [True],
+                    (merged_parents[1:] != merged_parents[:-1])
+                    | (tops[1:] != bottoms[:-1]),
+                ]
+            )
+        )
+        ends = np.append(starts[1:], len(merged))
+        num_nodes = np.add.reduceat(self.subtree_nodes[merged], starts)
+        blocks = [
+            LodBlock(
+                int(tops[start]),
+                int(bottoms[end - 1] - tops[start]),
+                int(count),
+                int(end - start),
+            )
+            for start, end, count in zip(
+                starts.tolist(), ends.tolist(), num_nodes.tolist()
+            )
+        ]
+        return shown, blocks
+
+    def node_at(self, column: int, row: float) -> int | None:
+        if column < 0 or column >= len(self.columns):
+            return None
+        i = int(np.searchsorted(self.column_tops[column], row, side="right")) - 1
+        if i < 0 or row >= self.column_bottoms[column][i]:
+            return None
+        return int(self.columns[column][i])
+
+
+class LodBlock:
+    """Adjacent sibling subtrees drawn as one block, see level_of_detail."""
+
+    __slots__ = ("top", "rows", "num_nodes", "num_subtrees")
+
+    def __init__(self, top: int, rows: int, num_nodes: int, num_subtrees: int) -> None:
+        self.top = top
+        self.rows = rows  # also the number of timelines in the block
+        self.num_nodes = num_nodes
+        self.num_subtrees = num_subtrees
+
+    @property
+    def label(self) -> str:
+        return f"{self.num_nodes} nodes / {self.rows} patients"
+
+
+class CanvasIcicle:
+    """Node selected in an IcicleCanvas, has the data of an Icicle."""
+
+    __slots__ = ("data",)
+
+    def __init__(self, data: timeline.EventAggregate) -> None:
+        self.data = data
+
+
+class IcicleCanvas(QAbstractScrollArea):
+    """Icicle plot painted on one widget.
+
+    Draws the same boxes as IciclePlot without a widget per node, only the
+    nodes in view are painted, so it stays fast for any size of tree. Ctrl +
+    wheel zooms the rows around the cursor, dragging pans.
+
+    Sibling subtrees less than LOD_PIXELS tall are drawn as one hatched
+    block, so the number of boxes painted is bounded by the size of the
+    view. Zooming in, or clicking a block, shows the nodes again.
+
+    With a CohortComparison the boxes are colored by the difference of the
+    cohorts and the event color is a strip at their left edge.
+    """
+
+    BOX_WIDTH = 50
+    COLUMN_WIDTH = 60
+    STOP_WIDTH = 5
+    # Row heights (px) that can be zoomed to
+    MIN_ROW_HEIGHT = 0.01
+    MAX_ROW_HEIGHT = 400.0
+    # Pixels the mouse moves before a press is a drag
+    DRAG_DISTANCE = 4
+    # Subtrees less tall than this (px) are merged into blocks
+    LOD_PIXELS = 4.0
+    # Width of the event color of a compared node
+    KEY_STRIP_WIDTH = 6
+
+    icicle_selection_signal = Signal(list)  # selected nodes in click order
+
+    # Left click selects one node, shift left click adds or removes one
+    selected_nodes: list[int]
+
+    def __init__(
+        self,
+        data: timeline.EventAggregate,
+        row_height: int,
+        group_similar: bool,
+        comparison: CohortComparison | None = None,
+    ):
+        super().__init__()
+        self.data = data
+        self.row_height = float(max(row_height, self.MIN_ROW_HEIGHT))
+        self.icicle_layout = IcicleLayout(data.tree, group_similar)
+        self.selected_nodes = []
+        self.comparison = comparison
+        # Differences of the nodes relative to the largest one
+        self.diff_scaled = np.zeros(len(data.tree))
+        if comparison is not None and len(data.tree) > 1:
+            differences = comparison.differences
+            largest = float(np.abs(differences[1:]).max())
+            self.diff_scaled = differences / max(largest, 1e-9)
+
+        # Press of a click or a drag, and the scroll position at the press
+        self.press_pos: QPoint | None = None
+        self.scroll_start = QPoint()
+        self.dragging = False
+        self.colors: dict[int, QColor] = {}
+        # Blocks painted last, with their column, for hit-testing
+        self.blocks: list[tuple[int, LodBlock]] = []
+
+        self.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOn)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOn)
+        self._update_scroll_bars()
+
+    def _update_scroll_bars(self) -> None:
+        width = len(self.icicle_layout.columns) * self.COLUMN_WIDTH + self.STOP_WIDTH
+        height = int(np.ceil(self.icicle_layout.num_rows * self.row_height))
+        viewport = self.viewport().size()
+        self.horizontalScrollBar().setRange(0, max(width - viewport.width(), 0))
+        self.horizontalScrollBar().setPageStep(viewport.width())
+        self.verticalScrollBar().setRange(0, max(height - viewport.height(), 0))
+        self.verticalScrollBar().setPageStep(viewport.height())
+        self.verticalScrollBar().setSingleStep(max(int(self.row_height), 1))
+
+    def resizeEvent(self, event: QResizeEvent) -> None:
+        super().resizeEvent(event)
+        self._update_scroll_bars()
+
+    def scrollContentsBy(self, dx: int, dy: int) -> None:
+        self.viewport().update()
+
+    def _color(self, code: int) -> QColor:
+        color = self.colors.get(code)
+        if color is None:
+            color = QColor(self.icicle_layout.color_table[code])
+            self.colors[code] = color
+        return color
+
+    def paintEvent(self, event: QPaintEvent) -> None:
+        painter = QPainter(self.viewport())
+        left = self.horizontalScrollBar().value()
+        top = self.verticalScrollBar().value()
+        rect = event.rect()
+        first_row = (top + rect.top()) / self.row_height
+        last_row = (top + rect.bottom() + 1) / self.row_height
+        first_column = max((left + rect.left()) // self.COLUMN_WIDTH - 1, 0)
+        last_column = min(
+            (left + rect.right()) // self.COLUMN_WIDTH,
+            len(self.icicle_layout.columns) - 1,
+        )
+
+        border = QPen(QColor(0, 0, 0, 77), 2)
+        selected_border = QPen(QColor("black"), 2)
+        selected = set(self.selected_nodes)
+        text_height = painter.fontMetrics().height()
+        tree = self.icicle_layout.tree
+
+        min_rows = self.LOD_PIXELS / self.row_height
+        hatch = QBrush(QColor(0, 0, 0, 90), Qt.BrushStyle.BDiagPattern)
+        self.blocks = []
+
+        for column in range(first_column, last_column + 1):
+            x = column * self.COLUMN_WIDTH - left
+            visible = self.icicle_layout.visible(column, first_row, last_row)
+            nodes, blocks = self.icicle_layout.level_of_detail(visible, min_rows)
+            for node in nodes.tolist():
+                y = self.icicle_layout.top[node] * self.row_height - top
+                size = int(tree.sizes[node])
+                box = QRectF(
+                    x + 1, y + 1, self.BOX_WIDTH - 2, size * self.row_height - 2
+                )
+                painter.setPen(selected_border if node in selected else border)
+                key_color = self._color(int(self.icicle_layout.colors[node]))
+                text_box = box.adjusted(2, 2, -2, -2)
+                if self.comparison is None:
+                    painter.setBrush(key_color)
+                    painter.drawRect(box)
+                else:
+                    painter.setBrush(diff_color(float(self.diff_scaled[node])))
+                    painter.drawRect(box)
+                    strip = QRectF(box.left(), box.top(), self.KEY_STRIP_WIDTH, box.height())
+                    painter.fillRect(strip, key_color)
+                    text_box.setLeft(strip.right() + 2)
+                if box.height() >= text_height:
+                    painter.setPen(QColor("black"))
+                    painter.drawText(
+                        text_box,
+                        Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignLeft,
+                        timeline.EventAggregate.view(tree, node).key,
+                    )
+
+                # Timelines ending at the node, below its children
+                stop_here = int(tree.stop_here[node])
+                if stop_here > 0:
+                    painter.setPen(selected_border)
+                    painter.setBrush(QColor("black"))
+                    painter.drawRect(
+                        QRectF(
+                            x + self.COLUMN_WIDTH + 1,
+                            y + (size - stop_here) * self.row_height + 1,
+                            self.STOP_WIDTH - 2,
+                            stop_here * self.row_height - 2,
+                        )
+                    )
+
+            painter.setPen(Qt.PenStyle.NoPen)
+            for block in blocks:
+                box = self._block_rect(column, block)
+                painter.fillRect(box, QColor("#E0E0E0"))
+                painter.fillRect(box, hatch)
+                if box.height() >= text_height:
+                    painter.setPen(QColor("black"))
+                    painter.drawText(
+                        box.adjusted(2, 2, -2, -2),
+                        Qt.AlignmentFlag.AlignTop
+                        | Qt.AlignmentFlag.AlignLeft
+                        | Qt.TextFlag.TextWordWrap,
+                        block.label,
+                    )
+                    painter.setPen(Qt.PenStyle.NoPen)
+                self.blocks.append((column, block))
+        painter.end()
+
+    def _block_rect(self, column: int, block: LodBlock) -> QRectF:
+        # At least a pixel tall, a block stands for nodes that are less
+        return QRectF(
+            column * self.COLUMN_WIDTH - self.horizontalScrollBar().value() + 1,
+            block.top * self.row_height - self.verticalScrollBar().value(),
+            self.BOX_WIDTH - 2,
+            max(block.rows * self.row_height, 1.0),
+        )
+
+    def block_at(self, pos: QPoint) -> LodBlock | None:
+        """Block painted at a point of the viewport."""
+        for column, block in self.blocks:
+            if self._block_rect(column, block).contains(pos.toPointF()):
+                return block
+        return None
+
+    def node_at(self, pos: QPoint) -> int | None:
+        """Node whose box is at a point of the viewport, nodes in blocks are
+        left out."""
+        x = pos.x() + self.horizontalScrollBar().value()
+        column = x // self.COLUMN_WIDTH
+        if x - column * self.COLUMN_WIDTH >= self.BOX_WIDTH:
+            return None
+        row = (pos.y() + self.verticalScrollBar().value()) / self.row_height
+        node = self.icicle_layout.node_at(column, row)
+        if (
+            node is None
+            or self.icicle_layout.tree.sizes[node] * self.row_height < self.LOD_PIXELS
+        ):
+            return None
+        return node
+
+    def zoom_to(self, block: LodBlock) -> None:
+        """Zooms in until the block fills the view, or as far as possible."""
+        height = self.viewport().height()
+        self.row_height = min(
+            max(height / block.rows, self.row_height), self.MAX_ROW_HEIGHT
+        )
+        self._update_scroll_bars()
+        self.verticalScrollBar().setValue(round(block.top * self.row_height))
+        self.viewport().update()
+
+    def zoom(self, factor: float, anchor_y: int) -> None:
+        """Scales the row height, keeping the row at anchor_y in place."""
+        row_height = min(
+            max(self.row_height * factor, self.MIN_ROW_HEIGHT), self.MAX_ROW_HEIGHT
+        )
+        row = (self.verticalScrollBar().value() + anchor_y) / self.row_height
+        self.row_height = row_height
+        self._update_scroll_bars()
+        self.verticalScrollBar().setValue(round(row * row_height - anchor_y))
+        self.viewport().update()
+
+    def wheelEvent(self, event: QWheelEvent) -> None:
+        if event.modifiers() & Qt.KeyboardModifier.ControlModifier:
+            # 120 is one notch of a mouse wheel, touchpads send less per event
+            self.zoom(1.2 ** (event.angleDelta().y() / 120), int(event.position().y()))
+            event.accept()
+        else:
+            super().wheelEvent(event)
+
+    def mousePressEvent(self, event: QMouseEvent) -> None:
+        self.press_pos = event.position().toPoint()
+        self.scroll_start = QPoint(
+            self.horizontalScrollBar().value(), self.verticalScrollBar().value()
+        )
+        self.dragging = False
+
+    def mouseMoveEvent(self, event: QMouseEvent) -> None:
+        if self.press_pos is None:
+            return
+        moved = event.position().toPoint() - self.press_pos
+        if moved.manhattanLength() >= self.DRAG_DISTANCE:
+            self.dragging = True
+            self.viewport().setCursor(Qt.CursorShape.ClosedHandCursor)
+        if self.dragging:
+            self.horizontalScrollBar().setValue(self.scroll_start.x() - moved.x())
+            self.verticalScrollBar().setValue(self.scroll_start.y() - moved.y())
+
+    def mouseReleaseEvent(self, event: QMouseEvent) -> None:
+        was_dragging = self.dragging
+        self.press_pos = None
+        self.dragging = False
+        self.viewport().unsetCursor()
+        if was_dragging:
+            return
+
+        block = self.block_at(event.position().toPoint())
+        if block is not None and event.button() == Qt.MouseButton.LeftButton:
+            self.zoom_to(block)
+            return
+        node = self.node_at(event.position().toPoint())
+        if node is None:
+            return
+        if event.button() == Qt.MouseButton.LeftButton:
+            shift = bool(event.modifiers() & Qt.KeyboardModifier.ShiftModifier)
+            self.select(node, shift)
+        elif event.button() == Qt.MouseButton.RightButton:
+            self.show_local_histogram(node, event.globalPosition().toPoint())
+
+    def select(self, node: int, shift: bool) -> None:
+        if shift:
+            if node in self.selected_nodes:
+                self.selected_nodes.remove(node)
+            else:
+                self.selected_nodes.append(node)
+        elif self.selected_nodes == [node]:
+            self.selected_nodes = []
+        else:
+            self.selected_nodes = [node]
+        self.viewport().update()
+        tree = self.icicle_layout.tree
+        self.icicle_selection_signal.emit(
+            [CanvasIcicle(timeline.EventAggregate.view(tree, n)) for n in self.selected_nodes]
+        )
+
+    def show_local_histogram(self, node: int, pos: QPoint) -> None:
+        """Opens the wait times from the parent of node next to the cursor."""
+        data = timeline.EventAggregate.view(self.icicle_layout.tree, node)
+        parent = data.parent
+        diffs = [] if parent is None else data.get_time_diffs(parent)
+        histogram = HistogramWidget(diffs, 250, 300, 4)
+        histogram.setParent(self, Qt.WindowType.Popup)
+        histogram.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
+        histogram.move(pos)
+        histogram.show()
+
+    def viewportEvent(self, event: QEvent) -> bool:
+        if event.type() == QEvent.Type.ToolTip:
+            help_event: QHelpEvent = event  # type: ignore
+            block = self.block_at(help_event.pos())
+            node = self.node_at(help_event.pos())
+            if block is not None:
+                QToolTip.showText(
+                    help_event.globalPos(),
+                    f"{block.label}\nin {block.num_subtrees} subtrees\n\nClick to zoom in",
+                    self,
+                )
+            elif node is None:
+                QToolTip.hideText()
+            else:
+                data = timeline.EventAggregate.view(self.icicle_layout.tree, node)
+                tooltip = node_tooltip(data)
+                if self.comparison is not None:
+                    tooltip += "\n\n" + self.comparison.describe(node)
+                QToolTip.showText(help_event.globalPos(), tooltip, self)
+            return True
+        return super().viewportEvent(event)
@@ -5,27 +5,55 @@ from PySide6.QtWidgets import (
     QVBoxLayout,
     QScrollArea,
 )
-from PySide6.QtCore import Qt, Signal
-from PySide6.QtGui import QMouseEvent
+from PySide6.QtCore import Qt, Signal, QTimer
+from PySide6.QtGui import QMouseEvent, QResizeEvent
 
 import timeline
 from gui.gui_components import Selected, ColorBox
-from gui.histogram import HistogramWidget
+from gui.histogram import HistogramWidget, format_minutes
 from icd import ICD_SE
 
+
+def node_tooltip(data: timeline.EventAggregate) -> str:
+    tooltip = (
+        f"{data.key}\n\nnum sequences: {data.size}\nend here: {data.stop_here}\n{data.info}"
+    )
+    wait = data.wait_stats
+    if wait.count > 0:
+        tooltip += (
+            f"\nwait p50: {format_minutes(wait.quantile(0.5))}"
+            f", p90: {format_minutes(wait.quantile(0.9))}"
+        )
+    return tooltip
+
+
 class Icicle(QWidget):
     data: timeline.EventAggregate
+    # Nodes shown by the icicle, more than data if it is a compressed chain
+    steps: list[timeline.EventAggregate]
     parent_icicle: "Icicle|None"
-    selected_signal = Signal(Selected, bool)  # bool = is_shift
+    selected_signal = Signal(QWidget, bool)  # bool = is_shift
+    expand_signal = Signal(QWidget)
+    # Sub icicles are made when asked for and torn down on collapse
+    expand_children_signal = Signal(QWidget)
+    collapse_signal = Signal(QWidget)
 
-    def __init__(self, data: timeline.EventAggregate, height_mult: int):
+    def __init__(
+        self,
+        data: timeline.EventAggregate,
+        height_mult: int,
+        steps: list[timeline.EventAggregate] | None = None,
+    ):
         super().__init__()
         self.data = data
+        self.steps = steps or [data]
 
-        stop_here_count = data.stop_here
+        stop_here_count = self.tail.stop_here
         total_count = data.size
         color = data.color
         label = data.key
+        if len(self.steps) > 1:
+            label += f"\n+{len(self.steps) - 1}"
 
         self.icicle_height = height_mult * total_count
 
@@ -44,9 +72,13 @@ class Icicle(QWidget):
         # Dummy histogram
         self.histogram = QWidget()
 
-        tooltip: str = (
-            f"{label}\n\nnum sequences: {total_count}\nend here: {stop_here_count}\n{data.info}"
-        )
+        tooltip: str = node_tooltip(data)
+        if len(self.steps) > 1:
+            path = " -> ".join(step.key.replace("\n", " ") for step in self.steps)
+            tooltip = (
+                f"{path}\n\nnum sequences: {total_count}\nend here: {stop_here_count}"
+                "\n\nDouble-click to expand"
+            )
 
         # Left colored box
         self.left_box = ColorBox(
@@ -54,6 +86,11 @@ class Icicle(QWidget):
         )
         self.left_box.clicked.connect(self.clicked)
         self.left_box.clicked_signal.connect(self._on_clicked)
+        if len(self.steps) > 1:
+            self.left_box.double_click_enabled = True
+            self.left_box.double_clicked_signal.connect(
+                lambda: self.expand_signal.emit(self)
+            )
         self.h_layout.addWidget(self.left_box)
 
         # Right vertical layout container
@@ -74,6 +111,22 @@ class Icicle(QWidget):
 
         v_layout.addWidget(self.child_v_container)
 
+        # Takes the place of the sub icicles until they are made
+        self.children_built = False
+        self.more_box = ColorBox(
+            "+",
+            "#E0E0E0",
+            width=20,
+            height=(total_count - stop_here_count) * height_mult,
+            tooltip="Click to show the following events\n"
+            "Ctrl-click an event to hide them again",
+        )
+        self.more_box.clicked_signal.connect(
+            lambda _: self.expand_children_signal.emit(self)
+        )
+        self.more_box.setVisible(False)
+        v_layout.addWidget(self.more_box)
+
         # Bottom colored box in the VBox
         self.bottom_box = ColorBox(
             label, "#000000", width=5, height=stop_here_count * height_mult
@@ -86,14 +139,32 @@ class Icicle(QWidget):
 
         self.setLayout(self.h_layout)
 
+    @property
+    def tail(self) -> timeline.EventAggregate:
+        """Last node shown, the parent of the nodes of the sub icicles."""
+        return self.steps[-1]
+
+    @property
+    def has_children(self) -> bool:
+        return bool(self.tail.tree.first_child[self.tail.node] >= 0)
+
+    def set_children_built(self, built: bool) -> None:
+        self.children_built = built
+        self.more_box.setVisible(self.has_children and not built)
+
     def add_sub_icicle(self, sub_icicle) -> None:
         sub_icicle.parent_icicle = self
         self.child_v_container_layout.addWidget(sub_icicle)
 
     def _on_clicked(self, mouse_event: QMouseEvent):
-        if mouse_event.button() == Qt.MouseButton.LeftButton:
+        if (
+            mouse_event.button() == Qt.MouseButton.LeftButton
+            and mouse_event.modifiers() & Qt.KeyboardModifier.ControlModifier
+        ):
+            self.collapse_signal.emit(self)
+        elif mouse_event.button() == Qt.MouseButton.LeftButton:
             self.selected_signal.emit(
-                Selected(self), mouse_event.modifiers().value == Qt.Modifier.SHIFT.value
+                self, mouse_event.modifiers().value == Qt.Modifier.SHIFT.value
             )
         else:
             self.toggle_local_histogram()
@@ -102,7 +173,7 @@ class Icicle(QWidget):
         if type(self.histogram) != HistogramWidget:
             data: list[float] = []
             if not self.parent_icicle is None:  # cast to icicle
-                data = self.data.get_time_diffs(self.parent_icicle.data)
+                data = self.data.get_time_diffs(self.parent_icicle.tail)
 
             self.histogram = HistogramWidget(data, self.icicle_height, 300, 4)
             self.h_layout.insertWidget(0, self.histogram)
@@ -115,7 +186,7 @@ class Icicle(QWidget):
         if self.left_box.isChecked():
             data: list[float] = []
             if not self.parent_icicle is None:  # cast to icicle
-                data = self.data.get_time_diffs(self.parent_icicle.data)
+                data = self.data.get_time_diffs(self.parent_icicle.tail)
 
             self.histogram = HistogramWidget(data, self.icicle_height, 300, 3)
             self.h_layout.insertWidget(0, self.histogram)
@@ -126,13 +197,20 @@ class Icicle(QWidget):
 
 
 class IciclePlot(QWidget):
-    icicle_selection_signal = Signal(Icicle, Icicle)
+    """Icicles of an aggregate, made a few levels at a time.
+
+    The first EXPAND_LEVELS levels are made up front. Deeper icicles are made
+    when the placeholder of their parent is clicked or scrolled into view, so
+    the time to show a plot doesn't depend on the size of the tree.
+    """
+
+    EXPAND_LEVELS = 3
+
+    icicle_selection_signal = Signal(list)  # selected icicles in click order
     data: timeline.EventAggregate
 
-    # left click
-    selected_icicle_1: Selected | None
-    # shift left click
-    selected_icicle_2: Selected | None
+    # Left click selects one icicle, shift left click adds or removes one
+    selected: list[Selected]
 
     def __init__(
         self,
@@ -140,6 +218,7 @@ class IciclePlot(QWidget):
         row_height: int,
         group_similar: bool,
         label: str = "",
+        compress_chains: bool = False,
     ):
         print("Creating IciclePlot")
         super().__init__()
@@ -148,8 +227,11 @@ class IciclePlot(QWidget):
         self.data = data
         self.row_height = row_height
         self.group_similar = group_similar
-        self.selected_icicle_1 = None
-        self.selected_icicle_2 = None
+        # Chains of single children are shown as one icicle until expanded
+        self.chain_ends = data.tree.chain_ends() if compress_chains else None
+        self.selected = []
+        # Icicles whose sub icicles are not made
+        self.collapsed: set[Icicle] = set()
 
         scroll_area = QScrollArea(self)
         scroll_area.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOn)
@@ -161,54 +243,164 @@ class IciclePlot(QWidget):
 
         qlabel = QLabel(label)
         main_layout.addWidget(qlabel)
-        self.main_icicle = self.to_icicle_recursive(data)
+        self.main_icicle = self.to_icicle_recursive(data, self.EXPAND_LEVELS + 1)
         main_layout.addWidget(scroll_area)
         scroll_area.setWidget(self.main_icicle)
-
-    def _on_icicle_clicked(self, icicle_selected: Selected, shift: bool) -> None:
+        self.scroll_area = scroll_area
+
+        # Checks for placeholders in view once scrolling stops
+        self.expand_timer = QTimer(self)
+        self.expand_timer.setSingleShot(True)
+        self.expand_timer.setInterval(50)
+        self.expand_timer.timeout.connect(self.expand_visible)
+        scroll_area.horizontalScrollBar().valueChanged.connect(self.expand_timer.start)
+        scroll_area.verticalScrollBar().valueChanged.connect(self.expand_timer.start)
+        self.expand_timer.start()
+
+    def resizeEvent(self, event: QResizeEvent) -> None:
+        super().resizeEvent(event)
+        self.expand_timer.start()
+
+    def _on_icicle_clicked(self, icicle: Icicle, shift: bool) -> None:
+        index = next((i for i, s in enumerate(self.selected) if s.obj is icicle), None)
         if shift:
-            if (
-                not self.selected_icicle_2 is None
-            ) and self.selected_icicle_2.obj == icicle_selected.obj:
-                self.selected_icicle_2 = None
+            if index is None:
+                self.selected.append(Selected(icicle))
             else:
-                self.selected_icicle_2 = icicle_selected
+                del self.selected[index]
+        elif index is not None and len(self.selected) == 1:
+            self.selected = []
         else:
-            if (
-                not self.selected_icicle_1 is None
-            ) and self.selected_icicle_1.obj == icicle_selected.obj:
-                self.selected_icicle_1 = None
-            else:
-                self.selected_icicle_1 = icicle_selected
-            self.selected_icicle_2 = None
-        i1: Icicle | None = None
-        i2: Icicle | None = None
-        if not self.selected_icicle_1 is None:
-            i1 = self.selected_icicle_1.obj
-        if not self.selected_icicle_2 is None:
-            i2 = self.selected_icicle_2.obj
-
-        self.icicle_selection_signal.emit(i1, i2)
-
-    def to_icicle_recursive(self, data: timeline.EventAggregate) -> Icicle:
-        icicle = Icicle(data, self.row_height)
-        icicle.selected_signal.connect(self._on_icicle_clicked)
+            # Keeps the Selected of the icicle, dropping it clears the highlight
+            self.selected = [Selected(icicle) if index is None else self.selected[index]]
+        self._emit_selection()
+
+    def to_icicle_recursive(
+        self, data: timeline.EventAggregate, levels: int = EXPAND_LEVELS
+    ) -> Icicle:
+        """Icicle of data and the given number of levels of icicles, counting
+        its own."""
+        steps = None
+        if self.chain_ends is not None and data.node != 0:
+            steps = data.tree.chain(data.node, self.chain_ends)
+        icicle = self._create_icicle(data, steps)
+        if levels > 1:
+            self._add_sub_icicles(icicle, levels - 1)
+        else:
+            self._set_collapsed(icicle)
+        return icicle
+
+    def _add_sub_icicles(self, icicle: Icicle, levels: int) -> None:
         keys: list[str]
+        # Views of the children are made on every access, get them once
+        children = icicle.tail.children
 
         if self.group_similar:
             keys = sorted(
-                data.children.keys(),
-                key=lambda k: data.children[k].color
-                + str(f"{data.children[k].size:0>10}"),
+                children.keys(),
+                key=lambda k: children[k].color
+                + str(f"{children[k].size:0>10}"),
                 reverse=True,
             )
         else:
             keys = sorted(
-                data.children.keys(),
-                key=lambda k: data.children[k].size,
+                children.keys(),
+                key=lambda k: children[k].size,
                 reverse=True,
             )
 
         for key in keys:
-            icicle.add_sub_icicle(self.to_icicle_recursive(data.children[key]))
+            icicle.add_sub_icicle(self.to_icicle_recursive(children[key], levels))
+        icicle.set_children_built(True)
+
+    def _set_collapsed(self, icicle: Icicle) -> None:
+        icicle.set_children_built(False)
+        if icicle.has_children:
+            self.collapsed.add(icicle)
+
+    def expand(self, icicle: Icicle) -> None:
+        if icicle.children_built:
+            return
+        self.collapsed.discard(icicle)
+        self._add_sub_icicles(icicle, self.EXPAND_LEVELS)
+
+    def collapse(self, icicle: Icicle) -> None:
+        """Tears down the sub icicles of icicle."""
+        if not icicle.children_built or not icicle.has_children:
+            return
+        selection_changed = self._unselect_inside(icicle.child_v_container)
+        self.collapsed = {c for c in self.collapsed if not icicle.isAncestorOf(c)}
+        layout = icicle.child_v_container_layout
+        while layout.count() > 0:
+            layout.takeAt(0).widget().deleteLater()
+        self._set_collapsed(icicle)
+        if selection_changed:
+            self._emit_selection()
+
+    def expand_visible(self) -> None:
+        """Expands the icicles whose placeholder is in view."""
+        visible = [
+            icicle
+            for icicle in self.collapsed
+            if not icicle.more_box.visibleRegion().isEmpty()
+        ]
+        for icicle in visible:
+            self.expand(icicle)
+        if len(visible) > 0:
+            # The new icicles can have placeholders in view too
+            self.expand_timer.start()
+
+    def _create_icicle(
+        self,
+        data: timeline.EventAggregate,
+        steps: list[timeline.EventAggregate] | None = None,
+    ) -> Icicle:
+        icicle = Icicle(data, self.row_height, steps)
+        icicle.selected_signal.connect(self._on_icicle_clicked)
+        icicle.expand_signal.connect(self.expand_chain)
+        icicle.expand_children_signal.connect(self.expand)
+        icicle.collapse_signal.connect(self.collapse)
         return icicle
+
+    def expand_chain(self, icicle: Icicle) -> None:
+        """Replaces a compressed chain with one icicle per step."""
+        expanded = [self._create_icicle(step) for step in icicle.steps]
+        for parent, child in zip(expanded, expanded[1:]):
+            parent.add_sub_icicle(child)
+        layout = icicle.child_v_container_layout
+        while layout.count() > 0:
+            expanded[-1].add_sub_icicle(layout.takeAt(0).widget())
+        for step in expanded[:-1]:
+            step.set_children_built(True)
+        if icicle.children_built:
+            expanded[-1].set_children_built(True)
+        else:
+            self._set_collapsed(expanded[-1])
+        self.collapsed.discard(icicle)
+
+        # A selected chain is unselected, its steps can be selected instead
+        selection_changed = self._unselect(icicle)
+
+        parent_layout = icicle.parent_icicle.child_v_container_layout
+        parent_layout.insertWidget(parent_layout.indexOf(icicle), expanded[0])
+        expanded[0].parent_icicle = icicle.parent_icicle
+        parent_layout.removeWidget(icicle)
+        icicle.deleteLater()
+
+        if selection_changed:
+            self._emit_selection()
+
+    def _unselect(self, icicle: Icicle) -> bool:
+        return self._unselect_where(lambda selected: selected is icicle)
+
+    def _unselect_inside(self, container: QWidget) -> bool:
+        return self._unselect_where(container.isAncestorOf)
+
+    def _unselect_where(self, condition) -> bool:
+        kept = [s for s in self.selected if not condition(s.obj)]
+        changed = len(kept) != len(self.selected)
+        self.selected = kept
+        return changed
+
+    def _emit_selection(self) -> None:
+        self.icicle_selection_signal.emit([s.obj for s in self.selected])
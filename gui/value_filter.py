@@ -1,77 +1,316 @@
-import sys, os
+import os
+import json
 
 from PySide6.QtWidgets import (
-    QApplication,
     QWidget,
-    QGroupBox,
     QHBoxLayout,
     QVBoxLayout,
-    QSizePolicy,
-    QScrollArea,
     QLabel,
     QFormLayout,
-    QSpinBox,
     QCheckBox,
-    QLineEdit
+    QLineEdit,
+    QDoubleSpinBox,
+    QPushButton,
+    QGroupBox,
 )
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QSettings, Signal
 
 from gui.gui_components import NoScrollComboBox
-import pandas as pd
+from data import read_header
+from catalog import Catalog
+
+# Kinds of predicates, as shown and as named in a cohort_filter spec
+KINDS = {"Range": "range", "Category": "category", "Has event": "event"}
 
 
 class ValueFilter(QWidget):
+    """Predicates on the data source files that narrow the cohort.
+
+    Every row is one predicate, rows are combined with and or or and can be
+    negated. The rows are stored in the settings, spec gives the enabled ones
+    in the form cohort_filter.from_spec reads.
+    """
 
     def __init__(self):
         super().__init__()
+        self.settings = QSettings("InfraVis", "PatientFlow")
         self.dir_path = ""
+        self.files: list[str] = []
+        self.catalog: Catalog | None = None
+        self.rows: list[PredicateRow] = []
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.setAlignment(Qt.AlignmentFlag.AlignTop)
+        self.setLayout(layout)
+
+        combine_layout = QFormLayout()
+        self.combine_combo_box = NoScrollComboBox()
+        self.combine_combo_box.addItems(["All", "Any"])
+        self.combine_combo_box.currentIndexChanged.connect(self.save)
+        combine_layout.addRow(QLabel("Patients matching"), self.combine_combo_box)
+        layout.addLayout(combine_layout)
+
+        self.rows_layout = QVBoxLayout()
+        self.rows_layout.setContentsMargins(0, 0, 0, 0)
+        layout.addLayout(self.rows_layout)
+
+        self.add_button = QPushButton("Add filter")
+        self.add_button.clicked.connect(self.add_empty_row)
+        layout.addWidget(self.add_button)
+
+        saved = self.settings.value("cohort_filter", "", str)
+        try:
+            state = json.loads(saved) if type(saved) is str and saved != "" else {}
+        except ValueError:
+            state = {}
+        if state.get("combine") == "or":
+            self.combine_combo_box.setCurrentText("Any")
+        for row_state in state.get("predicates", []):
+            self.add_row(row_state)
+
+    def add_row(self, state: dict) -> None:
+        row = PredicateRow(state)
+        row.catalog = self.catalog
+        row.set_files(self.dir_path, self.files)
+        row.changed_signal.connect(self.save)
+        row.remove_signal.connect(self.remove_row)
+        self.rows_layout.addWidget(row)
+        self.rows.append(row)
+
+    def add_empty_row(self) -> None:
+        self.add_row({})
+        self.save()
+
+    def remove_row(self, row: "PredicateRow") -> None:
+        self.rows_layout.removeWidget(row)
+        self.rows.remove(row)
+        row.deleteLater()
+        self.save()
+
+    def update_files(self, dir_path: str):
+        self.dir_path = dir_path
+        self.files = sorted(f for f in os.listdir(self.dir_path) if not f.startswith("."))
+        for row in self.rows:
+            row.set_files(self.dir_path, self.files)
+
+    def update_catalog(self, catalog: Catalog):
+        if catalog.directory != os.path.abspath(self.dir_path):
+            # Finished after the directory was changed
+            return
+        self.catalog = catalog
+        for row in self.rows:
+            row.catalog = catalog
+            row.update_columns()
+
+    def _combine(self) -> str:
+        return "or" if self.combine_combo_box.currentText() == "Any" else "and"
 
+    def save(self) -> None:
+        state = {
+            "combine": self._combine(),
+            "predicates": [row.state() for row in self.rows],
+        }
+        self.settings.setValue("cohort_filter", json.dumps(state))
+
+    def spec(self) -> dict | None:
+        """The enabled and complete predicates, None if there are none."""
+        predicates = [row.spec() for row in self.rows if row.is_active()]
+        if len(predicates) == 0:
+            return None
+        return {"combine": self._combine(), "predicates": predicates}
+
+
+class PredicateRow(QGroupBox):
+
+    changed_signal = Signal()
+    remove_signal = Signal(QWidget)
+
+    def __init__(self, state: dict):
+        super().__init__()
+        self.dir_path = ""
+        self.catalog: Catalog | None = None
+        self.saved_file = state.get("file", "")
+        self.saved_column = state.get("column", "")
         layout = QFormLayout()
         self.setLayout(layout)
-        self.filter_enabled_check_box = QCheckBox()
+
+        self.enabled_check_box = QCheckBox("Enabled")
+        self.enabled_check_box.setChecked(state.get("enabled", True))
+        self.negate_check_box = QCheckBox("Not")
+        self.negate_check_box.setChecked(state.get("negate", False))
+        remove_button = QPushButton("Remove")
+        remove_button.clicked.connect(lambda: self.remove_signal.emit(self))
+        header_layout = QHBoxLayout()
+        header_layout.setContentsMargins(0, 0, 0, 0)
+        header_layout.addWidget(self.enabled_check_box)
+        header_layout.addWidget(self.negate_check_box)
+        header_layout.addWidget(remove_button)
+        header = QWidget()
+        header.setLayout(header_layout)
+
+        self.kind_combo_box = NoScrollComboBox()
+        self.kind_combo_box.addItems(list(KINDS))
+        for name, kind in KINDS.items():
+            if kind == state.get("kind"):
+                self.kind_combo_box.setCurrentText(name)
 
         self.file_combo_box = NoScrollComboBox()
         self.file_combo_box.currentIndexChanged.connect(self.update_columns)
-
         self.column_name_combo_box = NoScrollComboBox()
+        self.column_name_combo_box.currentIndexChanged.connect(self.update_hints)
 
-        self.min_value_spin_box = QSpinBox()
-        self.min_value_spin_box.setMinimum(-1000000)
-        self.min_value_spin_box.setMaximum(1000000)
+        self.min_value_spin_box = QDoubleSpinBox()
+        self.min_value_spin_box.setRange(-1000000, 1000000)
+        self.min_value_spin_box.setValue(state.get("low", 0))
+        self.max_value_spin_box = QDoubleSpinBox()
+        self.max_value_spin_box.setRange(-1000000, 1000000)
+        self.max_value_spin_box.setValue(state.get("high", 0))
 
-        self.max_value_spin_box = QSpinBox()
-        self.max_value_spin_box.setMinimum(-1000000)
-        self.max_value_spin_box.setMaximum(1000000)
+        self.values_line_edit = QLineEdit(", ".join(state.get("values", [])))
+        self.values_line_edit.setPlaceholderText("Comma separated")
+        self.event_type_line_edit = QLineEdit(state.get("event_type", ""))
+        self.event_value_line_edit = QLineEdit(state.get("event_value", ""))
+        self.event_value_line_edit.setPlaceholderText("Any value")
 
-        layout.addRow(QLabel("Enabled"), self.filter_enabled_check_box)
+        layout.addRow(header)
+        layout.addRow(QLabel("Kind"), self.kind_combo_box)
         layout.addRow(QLabel("File"), self.file_combo_box)
         layout.addRow(QLabel("Value"), self.column_name_combo_box)
         layout.addRow(QLabel("Min"), self.min_value_spin_box)
         layout.addRow(QLabel("Max"), self.max_value_spin_box)
+        layout.addRow(QLabel("Values"), self.values_line_edit)
+        layout.addRow(QLabel("Event type"), self.event_type_line_edit)
+        layout.addRow(QLabel("Event value"), self.event_value_line_edit)
+
+        self.kind_combo_box.currentIndexChanged.connect(self.update_kind)
+        self.update_kind()
 
-    def apply_filter(self, seq_ids: list[int]) -> list[int]:
-        if not self.filter_enabled_check_box.isChecked():
-            return seq_ids
+        for check_box in [self.enabled_check_box, self.negate_check_box]:
+            check_box.checkStateChanged.connect(lambda _: self.changed_signal.emit())
+        for combo_box in [
+            self.kind_combo_box,
+            self.file_combo_box,
+            self.column_name_combo_box,
+        ]:
+            combo_box.currentIndexChanged.connect(lambda _: self.changed_signal.emit())
+        for spin_box in [self.min_value_spin_box, self.max_value_spin_box]:
+            spin_box.valueChanged.connect(lambda _: self.changed_signal.emit())
+        for line_edit in [
+            self.values_line_edit,
+            self.event_type_line_edit,
+            self.event_value_line_edit,
+        ]:
+            line_edit.editingFinished.connect(self.changed_signal.emit)
 
-        data = pd.read_csv(f"{self.dir_path}/{self.file_combo_box.currentText()}")
-        data = data.loc[data["seqID"].isin(seq_ids)]
-        data = data[
-            data[self.column_name_combo_box.currentText()].between(
-                self.min_value_spin_box.value(), self.max_value_spin_box.value()
-            )
-        ]
+    def _kind(self) -> str:
+        return KINDS[self.kind_combo_box.currentText()]
 
-        return data["seqID"].to_list()
+    def update_kind(self) -> None:
+        layout: QFormLayout = self.layout()  # type: ignore
+        kind = self._kind()
+        layout.setRowVisible(self.column_name_combo_box, kind != "event")
+        layout.setRowVisible(self.min_value_spin_box, kind == "range")
+        layout.setRowVisible(self.max_value_spin_box, kind == "range")
+        layout.setRowVisible(self.values_line_edit, kind == "category")
+        layout.setRowVisible(self.event_type_line_edit, kind == "event")
+        layout.setRowVisible(self.event_value_line_edit, kind == "event")
+        self.update_columns()
 
-    def update_files(self, dir_path:str):
+    def set_files(self, dir_path: str, files: list[str]) -> None:
         self.dir_path = dir_path
-        files = os.listdir(self.dir_path)
-        
+        current = self.file_combo_box.currentText() or self.saved_file
+        # Only the file finally selected should fill the columns
+        self.file_combo_box.blockSignals(True)
         self.file_combo_box.clear()
         self.file_combo_box.addItems(files)
+        if current in files:
+            self.file_combo_box.setCurrentText(current)
+        self.file_combo_box.blockSignals(False)
+        self.update_columns()
 
     def update_columns(self):
-        cols = pd.read_csv(f"{self.dir_path}/{self.file_combo_box.currentText()}").columns
-        
+        if self.file_combo_box.currentText() == "":
+            return
+        current = self.column_name_combo_box.currentText() or self.saved_column
+        path = f"{self.dir_path}/{self.file_combo_box.currentText()}"
+        entry = None if self.catalog is None else self.catalog.entry(path)
+        if entry is None:
+            # Not cataloged yet, only the names are known
+            columns = [(c, "") for c in read_header(path)]
+        else:
+            # Ranges only make sense on numbers
+            columns = [
+                (c.name, c.describe())
+                for c in entry.columns
+                if self._kind() != "range" or c.is_numeric
+            ]
+
+        self.column_name_combo_box.blockSignals(True)
         self.column_name_combo_box.clear()
-        self.column_name_combo_box.addItems(cols.to_list())
+        for i, (name, description) in enumerate(columns):
+            self.column_name_combo_box.addItem(name)
+            self.column_name_combo_box.setItemData(i, description, Qt.ItemDataRole.ToolTipRole)
+        if current in [name for name, _ in columns]:
+            self.column_name_combo_box.setCurrentText(current)
+        self.column_name_combo_box.blockSignals(False)
+        self.update_hints()
+
+    def update_hints(self):
+        """Shows the range and the values of the chosen column from the catalog."""
+        path = f"{self.dir_path}/{self.file_combo_box.currentText()}"
+        entry = None if self.catalog is None else self.catalog.entry(path)
+        column = self.column_name_combo_box.currentText()
+        if self._kind() == "event":
+            column = "event_type"
+        stats = None if entry is None else entry.column(column)
+
+        self.column_name_combo_box.setToolTip("" if stats is None else stats.describe())
+        numeric = stats is not None and stats.is_numeric and stats.min is not None
+        range_text = f"Values from {stats.min:g} to {stats.max:g}" if numeric else ""  # type: ignore
+        self.min_value_spin_box.setToolTip(range_text)
+        self.max_value_spin_box.setToolTip(range_text)
+        values = "" if stats is None or stats.values is None else ", ".join(stats.values)
+        self.values_line_edit.setPlaceholderText(values or "Comma separated")
+        self.event_type_line_edit.setPlaceholderText(values)
+
+    def is_active(self) -> bool:
+        if not self.enabled_check_box.isChecked() or self.file_combo_box.currentText() == "":
+            return False
+        match self._kind():
+            case "range":
+                return self.column_name_combo_box.currentText() != ""
+            case "category":
+                return self.column_name_combo_box.currentText() != "" and self.values_line_edit.text().strip() != ""
+            case _:
+                return self.event_type_line_edit.text().strip() != ""
+
+    def state(self) -> dict:
+        state = dict(
+            self.spec(),
+            enabled=self.enabled_check_box.isChecked(),
+            file=self.file_combo_box.currentText() or self.saved_file,
+        )
+        if "column" in state:
+            state["column"] = state["column"] or self.saved_column
+        return state
+
+    def spec(self) -> dict:
+        spec: dict = {
+            "kind": self._kind(),
+            "path": f"{self.dir_path}/{self.file_combo_box.currentText()}",
+            "negate": self.negate_check_box.isChecked(),
+        }
+        match spec["kind"]:
+            case "range":
+                spec["column"] = self.column_name_combo_box.currentText()
+                spec["low"] = self.min_value_spin_box.value()
+                spec["high"] = self.max_value_spin_box.value()
+            case "category":
+                spec["column"] = self.column_name_combo_box.currentText()
+                values = self.values_line_edit.text().split(",")
+                spec["values"] = [v.strip() for v in values if v.strip() != ""]
+            case "event":
+                spec["event_type"] = self.event_type_line_edit.text().strip()
+                spec["event_value"] = self.event_value_line_edit.text().strip()
+        return spec
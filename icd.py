@@ -3,29 +3,53 @@ import os
 
 path = "icd-10-se.tsv"
 
+UNKNOWN_TITLE = "Unknown diagnosis"
+
 
 class ICD_SE:
     data_frame: pd.DataFrame
+    # Code -> title, codes without dot such as "N301" map to "N30.1"
+    titles: dict[str, str]
 
-    def __init__(self) -> None:
+    def __init__(self, tsv_path: str = path) -> None:
         self.data_frame = pd.read_csv(
-            os.path.join(path), delimiter="\t", low_memory=False
+            os.path.join(tsv_path), delimiter="\t", low_memory=False
         )
 
+        # The first row of a code wins, like the previous row scan did
+        codes = self.data_frame.drop_duplicates(subset="Kod")
+        titles = dict(zip(codes["Kod"].astype(str), codes["Titel"]))
+
+        # 4 character codes are always read as "XXX.X", so only the dotted
+        # codes can be looked up with 4 characters
+        self.titles = {k: t for k, t in titles.items() if len(k) != 4}
+        for code, title in titles.items():
+            if len(code) == 5 and code[3] == ".":
+                self.titles[code[:3] + code[4]] = title
+
     def get_title(self, code: str) -> str:
-        if len(code) == 4:
-            code = code[:3] + "." + code[-1]
+        return self.titles.get(code, UNKNOWN_TITLE)
+
+    def annotate(self, codes: pd.Series) -> pd.Series:
+        """Titles of a whole column of codes."""
+        return codes.astype(str).map(self.titles).fillna(UNKNOWN_TITLE)
+
+
+_icd_se: ICD_SE | None = None
+
+
+def get_icd_se() -> ICD_SE:
+    """Shared instance, the tsv is read on first use."""
+    global _icd_se
+    if _icd_se is None:
+        _icd_se = ICD_SE()
+    return _icd_se
 
-        search = self.data_frame.loc[self.data_frame["Kod"] == code]
-        for _i, row in search.iterrows():
-            return row["Titel"]
-        return "Unknown diagnosis"
 
 def get_title(code:str) -> str:
-    icd_se = ICD_SE()
-    return icd_se.get_title("N30.1")
+    return get_icd_se().get_title(code)
 
 
 if __name__ == "__main__":
-    icd_se = ICD_SE()
+    icd_se = get_icd_se()
     print(icd_se.get_title("N30.1"))
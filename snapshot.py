@@ -0,0 +1,262 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+import cache
+from cohort_filter import CohortFilter
+from data import CohortAggregate
+from timeline import EventStore, EventTimelineAggregate
+
+# Bump when the arrays stored in a snapshot change
+SNAPSHOT_VERSION = 3
+# Snapshots kept per data directory, the least recently stored are removed
+MAX_SNAPSHOTS = 4
+
+STORE_ARRAYS = [
+    "seq_ids",
+    "start_epochs",
+    "offsets",
+    "epochs",
+    "time_missing",
+    "types",
+    "titles",
+    "values",
+    "infos",
+    "keys",
+]
+STORE_TABLES = ["title_table", "value_table", "info_table", "key_table", "key_colors"]
+TREE_ARRAYS = [
+    "parents",
+    "keys",
+    "info_events",
+    "merged",
+    "first_child",
+    "next_sibling",
+    "sizes",
+    "stop_here",
+    "member_offsets",
+    "member_seq_ids",
+    "member_epochs",
+    "member_missing",
+    "member_events",
+    "member_last",
+    "wait_counts",
+    "wait_sums",
+    "wait_mins",
+    "wait_maxs",
+    "wait_bins",
+    "edge_codes",
+    "edge_nodes",
+]
+
+
+def snapshot_dir(
+    data_paths: list[str],
+    pick_from_csv: str,
+    patient_attributes_csv: str,
+    num_patients: int,
+    cohort_filter: CohortFilter | None = None,
+) -> str:
+    """Directory of the snapshot of an aggregate, in the cache directory next
+    to the pick-from file."""
+    params = _params(
+        data_paths, pick_from_csv, patient_attributes_csv, num_patients, cohort_filter
+    )
+    return _entry(params)
+
+
+def _entry(params: dict) -> str:
+    key = json.dumps(params)
+    name = "snapshot." + hashlib.sha1(key.encode()).hexdigest()[:16]
+    directory = os.path.dirname(params["pick_from_csv"])
+    return os.path.join(directory, cache.CACHE_DIR_NAME, name)
+
+
+def save(cohort: CohortAggregate) -> bool:
+    """Stores the aggregate of a cohort, returns False if it can't be stored."""
+    params = _params(
+        cohort.data_paths,
+        cohort.pick_from_csv,
+        cohort.patient_attributes_csv,
+        cohort.num_patients,
+        cohort.cohort_filter,
+    )
+    entry = _entry(params)
+    directory, name = os.path.split(entry)
+    agg = cohort.aggregate
+    if agg.store is None:
+        return False
+    try:
+        os.makedirs(directory, exist_ok=True)
+        building = tempfile.mkdtemp(prefix=name + ".tmp", dir=directory)
+    except OSError:
+        return False
+
+    try:
+        for name in STORE_ARRAYS:
+            array = getattr(agg.store, name)
+            np.save(os.path.join(building, f"store.{name}.npy"), array)
+        for name in TREE_ARRAYS:
+            np.save(os.path.join(building, f"tree.{name}.npy"), getattr(agg, name))
+        with open(os.path.join(building, "tables.json"), "w") as f:
+            json.dump({name: getattr(agg.store, name) for name in STORE_TABLES}, f)
+        # Written last, a snapshot without header is never read
+        with open(os.path.join(building, "header.json"), "w") as f:
+            json.dump(
+                {
+                    "version": SNAPSHOT_VERSION,
+                    "params": params,
+                    "fingerprints": _fingerprints(params),
+                },
+                f,
+            )
+        shutil.rmtree(entry, ignore_errors=True)
+        os.rename(building, entry)
+    except OSError:
+        return False
+    finally:
+        if os.path.isdir(building):
+            shutil.rmtree(building, ignore_errors=True)
+    _remove_old(directory)
+    return True
+
+
+def load(
+    data_paths: list[str],
+    pick_from_csv: str,
+    patient_attributes_csv: str,
+    num_patients: int,
+    cohort_filter: CohortFilter | None = None,
+) -> CohortAggregate | None:
+    """Opens the snapshot of the aggregate built from the given files.
+
+    Arrays are memory mapped read-only, so only the pages that are used are
+    read and viewers of the same snapshot share them. Returns None if there is
+    no snapshot or a file changed since it was stored.
+    """
+    params = (
+        data_paths,
+        pick_from_csv,
+        patient_attributes_csv,
+        num_patients,
+        cohort_filter,
+    )
+    if not is_current(*params):
+        return None
+    entry = snapshot_dir(*params)
+
+    try:
+        store = EventStore.__new__(EventStore)
+        for name in STORE_ARRAYS:
+            setattr(store, name, _load_array(entry, f"store.{name}"))
+        with open(os.path.join(entry, "tables.json")) as f:
+            tables = json.load(f)
+        for name in STORE_TABLES:
+            setattr(store, name, tables[name])
+
+        agg = EventTimelineAggregate.__new__(EventTimelineAggregate)
+        agg.store = store
+        for name in TREE_ARRAYS:
+            setattr(agg, name, _load_array(entry, f"tree.{name}"))
+        agg.pairs = OrderedDict()
+    except (OSError, ValueError, KeyError):
+        return None
+
+    # The cohort is read again from the cached csv if it is updated
+    return CohortAggregate(
+        data_paths,
+        pick_from_csv,
+        patient_attributes_csv,
+        num_patients,
+        None,
+        agg,
+        cohort_filter,
+    )
+
+
+def is_current(
+    data_paths: list[str],
+    pick_from_csv: str,
+    patient_attributes_csv: str,
+    num_patients: int,
+    cohort_filter: CohortFilter | None = None,
+) -> bool:
+    """Whether there is a snapshot of the given files that is up to date.
+
+    Snapshots of files that changed since they were stored are removed.
+    """
+    params = _params(
+        data_paths, pick_from_csv, patient_attributes_csv, num_patients, cohort_filter
+    )
+    entry = _entry(params)
+    header = _read_header(entry)
+    if header is None or header["params"] != params:
+        return False
+    try:
+        if header["fingerprints"] == _fingerprints(params):
+            return True
+    except OSError:
+        # An input file is gone
+        pass
+    shutil.rmtree(entry, ignore_errors=True)
+    return False
+
+
+def _params(
+    data_paths: list[str],
+    pick_from_csv: str,
+    patient_attributes_csv: str,
+    num_patients: int,
+    cohort_filter: CohortFilter | None,
+) -> dict:
+    return {
+        "data_paths": [os.path.abspath(p) for p in data_paths],
+        "pick_from_csv": os.path.abspath(pick_from_csv),
+        "patient_attributes_csv": os.path.abspath(patient_attributes_csv),
+        "num_patients": int(num_patients),
+        "cohort_filter": None if cohort_filter is None else cohort_filter.spec,
+        "filter_paths": (
+            []
+            if cohort_filter is None
+            else [os.path.abspath(p) for p in cohort_filter.paths()]
+        ),
+    }
+
+
+def _fingerprints(params: dict) -> list[str]:
+    paths = params["data_paths"] + [
+        params["pick_from_csv"],
+        params["patient_attributes_csv"],
+    ]
+    return [cache.fingerprint(p) for p in paths + params["filter_paths"]]
+
+
+def _read_header(entry: str) -> dict | None:
+    try:
+        with open(os.path.join(entry, "header.json")) as f:
+            header = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if header.get("version") != SNAPSHOT_VERSION:
+        return None
+    return header
+
+
+def _remove_old(directory: str) -> None:
+    snapshots = [
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.startswith("snapshot.") and ".tmp" not in name
+    ]
+    snapshots.sort(key=os.path.getmtime, reverse=True)
+    for entry in snapshots[MAX_SNAPSHOTS:]:
+        shutil.rmtree(entry, ignore_errors=True)
+
+
+def _load_array(entry: str, name: str) -> np.ndarray:
+    return np.load(os.path.join(entry, name + ".npy"), mmap_mode="r")
@@ -0,0 +1,88 @@
+import csv
+import json
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+# The modules of the application are at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Event files of the synthetic data source, how likely a patient has the
+# event, its values and, for files with an event_info column, its infos
+EVENT_FILES = [
+    ("ankomst_events.csv", "ankomst", [""], 1.0, None),
+    ("lakare_events.csv", "forsta_ansvariga_lakare", [""], 0.8, None),
+    (
+        "lab_bestallning_events.csv",
+        "lab_bestallning",
+        [json.dumps([{"analys_namn": n} for n in names]) for names in (["CRP"], ["Hb"], ["CRP", "Hb"])],
+        0.5,
+        None,
+    ),
+    ("rontgen_events.csv", "rontgen", ["X1", "X2"], 0.4, None),
+    ("operation_events.csv", "operation", ["OP1", "OP2"], 0.2, None),
+    ("diagnos_events.csv", "Huvuddiagnos", ["S720", "N301"], 0.6, ["Fraktur", "Cystit"]),
+    ("ut_events.csv", "ut_till_namn", ["Hem", "Avd"], 0.9, None),
+]
+
+
+@pytest.fixture
+def data_source(tmp_path):
+    """A small data source directory in the layout the application reads,
+    with the same patients every time."""
+    rng = random.Random(7)
+    start = datetime(2020, 1, 1)
+    attributes = []
+    events: dict[str, list] = {name: [] for name, *_ in EVENT_FILES}
+    for i in range(240):
+        seq_id = 3 * i + 5
+        arrival = start + timedelta(minutes=rng.randint(0, 300 * 24 * 60))
+        attributes.append(
+            [
+                seq_id,
+                f"{arrival:%Y-%m-%d %H:%M:%S}",
+                rng.choice(["Man", "Kvinna"]),
+                rng.choice(["Ambulans", "Gående"]),
+                rng.choice(["1", "2", "3", ""]),
+                rng.choice(["Fall", "Smärta"]),
+                rng.randint(1, 99),
+            ]
+        )
+        time = arrival
+        for name, event_type, values, chance, infos in EVENT_FILES:
+            if rng.random() < chance:
+                if event_type != "ankomst":
+                    time += timedelta(minutes=rng.randint(1, 120))
+                value = rng.randrange(len(values))
+                row = [seq_id, f"{time:%Y-%m-%d %H:%M:%S}", event_type, values[value]]
+                events[name].append(row if infos is None else row + [infos[value]])
+
+    def write(name: str, header: list[str], rows: list) -> None:
+        with open(tmp_path / name, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+
+    for name, *_, infos in EVENT_FILES:
+        header = ["seqID", "time", "event_type", "event_value"]
+        write(name, header if infos is None else header + ["event_info"], events[name])
+    write(
+        "patient_attributes.csv",
+        [
+            "seqID",
+            "ankomst_tidpunkt",
+            "kon",
+            "akutankomstsatt_namn",
+            "prioritet_akut_kod",
+            "besokorsak_forsta",
+            "alder",
+        ],
+        attributes,
+    )
+    picked = [a[0] for a in attributes]
+    rng.shuffle(picked)
+    write("pick_from.csv", ["seqID"], [[s] for s in picked])
+    return tmp_path
@@ -0,0 +1,93 @@
+import csv
+
+import numpy as np
+import pytest
+
+import cache
+import cohort_filter
+
+ROWS = [
+    # seqID, priority, weight
+    (1, "1", "50.5"),
+    (2, "2", "70"),
+    (3, "", "80"),
+    (4, "1", ""),
+    (5, "3", "65"),
+    (5, "1", "65"),
+    (7, "2", "90.25"),
+]
+
+
+@pytest.fixture(params=[True, False], ids=["arrow", "numpy"])
+def attributes(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "HAS_ARROW", request.param and cache.HAS_ARROW)
+    path = tmp_path / "attributes.csv"
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["seqID", "priority", "weight"])
+        writer.writerows(ROWS)
+    return str(path)
+
+
+def brute_force(test) -> np.ndarray:
+    return np.array(sorted({seq for seq, *values in ROWS if test(*values)}), dtype=np.int64)
+
+
+def evaluate(spec: dict, universe: np.ndarray) -> np.ndarray:
+    compiled = cohort_filter.from_spec(spec)
+    assert compiled is not None
+    return np.sort(np.asarray(universe)[compiled.apply(universe)])
+
+
+UNIVERSE = np.arange(1, 9)
+
+
+@pytest.mark.parametrize("repeat", [1, 2])
+def test_category_of_integer_column_with_blanks(attributes, repeat):
+    spec = {
+        "combine": "and",
+        "predicates": [
+            {"kind": "category", "path": attributes, "column": "priority", "values": ["1"]}
+        ],
+    }
+    # The second run reads the cached table
+    for _ in range(repeat):
+        found = evaluate(spec, UNIVERSE)
+    assert found.tolist() == brute_force(lambda p, w: p == "1").tolist()
+
+
+def test_range(attributes):
+    spec = {
+        "combine": "and",
+        "predicates": [
+            {"kind": "range", "path": attributes, "column": "weight", "low": 60, "high": 80}
+        ],
+    }
+    expected = brute_force(lambda p, w: w != "" and 60 <= float(w) <= 80)
+    assert evaluate(spec, UNIVERSE).tolist() == expected.tolist()
+
+
+@pytest.mark.parametrize("combine", ["and", "or"])
+def test_combined_and_negated(attributes, combine):
+    spec = {
+        "combine": combine,
+        "predicates": [
+            {"kind": "category", "path": attributes, "column": "priority", "values": ["1", "2"]},
+            {
+                "kind": "range",
+                "path": attributes,
+                "column": "weight",
+                "low": 60,
+                "high": 75,
+                "negate": True,
+            },
+        ],
+    }
+    in_category = set(brute_force(lambda p, w: p in ("1", "2")).tolist())
+    in_range = set(brute_force(lambda p, w: w != "" and 60 <= float(w) <= 75).tolist())
+    universe = set(UNIVERSE.tolist())
+    if combine == "and":
+        expected = in_category & (universe - in_range)
+    else:
+        expected = (in_category | (universe - in_range)) & universe
+    assert evaluate(spec, UNIVERSE).tolist() == sorted(expected)
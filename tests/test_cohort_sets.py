@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from cohort_sets import NodeSelection, contains, difference, intersect, union
+from data import CohortAggregate
+
+SETS = [
+    ([], []),
+    ([1, 4, 9], []),
+    ([], [2, 3]),
+    ([1, 2, 3, 10, 20], [2, 3, 4, 20, 30, 40]),
+    ([5, 6, 7], [5, 6, 7]),
+    ([100], [1, 2, 3, 50, 99, 101]),
+]
+
+
+@pytest.mark.parametrize("a, b", SETS)
+def test_operations(a, b):
+    x, y = np.array(a, dtype=np.int64), np.array(b, dtype=np.int64)
+    assert contains(y, x).tolist() == [v in b for v in a]
+    assert intersect(x, y).tolist() == sorted(set(a) & set(b))
+    assert union(x, y).tolist() == sorted(set(a) | set(b))
+    assert difference(x, y).tolist() == sorted(set(a) - set(b))
+
+
+def test_random_operations():
+    rng = np.random.default_rng(3)
+    for _ in range(50):
+        a = np.unique(rng.integers(0, 200, rng.integers(0, 80)))
+        b = np.unique(rng.integers(0, 200, rng.integers(0, 80)))
+        assert intersect(a, b).tolist() == sorted(set(a.tolist()) & set(b.tolist()))
+        assert union(a, b).tolist() == sorted(set(a.tolist()) | set(b.tolist()))
+        assert difference(a, b).tolist() == sorted(set(a.tolist()) - set(b.tolist()))
+
+
+@pytest.mark.parametrize("operations", [["and", "and", "and"], ["or", "or", "not"], ["or", "not", "and"]])
+def test_node_selection(data_source, operations):
+    names = ["ankomst_events.csv", "lakare_events.csv", "rontgen_events.csv", "ut_events.csv"]
+    cohort = CohortAggregate.build(
+        [str(data_source / n) for n in names],
+        str(data_source / "pick_from.csv"),
+        str(data_source / "patient_attributes.csv"),
+        200,
+    )
+    root = cohort.aggregate.event_aggregate_root
+    # The largest node of each of the first three levels
+    nodes = []
+    level = list(root.children.values())
+    while len(level) > 0 and len(nodes) < 3:
+        largest = max(level, key=lambda n: n.size)
+        nodes.append(largest)
+        level = [c for n in level for c in n.children.values()]
+    assert len(nodes) == 3
+
+    selection = NodeSelection(nodes, operations)
+    expected = set(nodes[0].seq_ids.tolist())
+    for node, operation in zip(nodes[1:], operations[1:]):
+        ids = set(node.seq_ids.tolist())
+        expected = {"and": expected & ids, "or": expected | ids, "not": expected - ids}[operation]
+    assert selection.seq_ids().tolist() == sorted(expected)
+
+    # Minutes between the first and the last node that isn't removed
+    ends = [n for n, o in zip(nodes, operations) if o != "not" or n is nodes[0]]
+    first, last = ends[0], ends[-1]
+    times = {}
+    for node in (first, last):
+        for seq_id, epoch, missing in zip(
+            node.seq_ids.tolist(), node.epochs.tolist(), node.time_missing.tolist()
+        ):
+            times.setdefault(seq_id, []).append(None if missing else epoch)
+    diffs = [
+        abs(times[s][1] - times[s][0]) / 60.0
+        for s in sorted(expected)
+        if len(times.get(s, [])) == 2 and None not in times[s]
+    ]
+    assert selection.time_diffs().tolist() == pytest.approx(diffs)
+
+    # The pair of ends is kept by the tree, a new selection of the same nodes reuses it
+    tree = first.tree
+    assert (min(first.node, last.node), max(first.node, last.node)) in tree.pairs
+    pair = tree.node_pair(first, last)
+    again = NodeSelection(nodes, operations)
+    assert again.time_diffs().tolist() == selection.time_diffs().tolist()
+    assert all(x is y for x, y in zip(tree.node_pair(first, last), pair))
@@ -0,0 +1,124 @@
+import csv
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from comparison import CohortComparison, split_by_attribute, split_by_event
+from data import CohortAggregate, PatientAttributeStore
+from timeline import EventTimelineAggregate
+
+ALL_FILES = [
+    "ankomst_events.csv",
+    "lakare_events.csv",
+    "rontgen_events.csv",
+    "operation_events.csv",
+    "ut_events.csv",
+]
+WITHOUT_RONTGEN = [n for n in ALL_FILES if n != "rontgen_events.csv"]
+
+
+def build(directory, names, num_patients) -> CohortAggregate:
+    return CohortAggregate.build(
+        [str(directory / n) for n in names],
+        str(directory / "pick_from.csv"),
+        str(directory / "patient_attributes.csv"),
+        num_patients,
+    )
+
+
+def seq_ids_of(path) -> set[int]:
+    with open(path, newline="") as f:
+        return {int(row["seqID"]) for row in csv.DictReader(f)}
+
+
+def brute_force_counts(tree: EventTimelineAggregate, cohort_of) -> np.ndarray:
+    """Timelines of every node in every cohort, counted one by one."""
+    counts = {}
+    for node in range(1, len(tree)):
+        members = tree.member_seq_ids[tree.member_slice(node)].tolist()
+        counts[node] = [cohort_of(seq_id) for seq_id in members]
+    return counts
+
+
+def assert_counts(comparison: CohortComparison, tree: EventTimelineAggregate, cohort_of):
+    for node, cohorts in brute_force_counts(tree, cohort_of).items():
+        expected = np.bincount(cohorts, minlength=len(comparison.names))
+        assert comparison.counts[node].tolist() == expected.tolist()
+    in_tree = np.unique(tree.member_seq_ids).tolist()
+    expected = np.bincount([cohort_of(s) for s in in_tree], minlength=len(comparison.names))
+    assert comparison.totals.tolist() == expected.tolist()
+
+
+def test_split_by_event(data_source):
+    tree = build(data_source, ALL_FILES, 150).aggregate
+    with_rontgen = seq_ids_of(data_source / "rontgen_events.csv")
+    comparison = split_by_event(tree, "rontgen")
+    assert_counts(comparison, tree, lambda s: 0 if s in with_rontgen else 1)
+
+
+def test_split_by_event_after_update(data_source):
+    cohort = build(data_source, ALL_FILES, 120)
+    updated = cohort.update(
+        [str(data_source / n) for n in WITHOUT_RONTGEN],
+        str(data_source / "pick_from.csv"),
+        str(data_source / "patient_attributes.csv"),
+        120,
+    )
+    assert updated is not None
+    built = build(data_source, WITHOUT_RONTGEN, 120)
+
+    comparison = split_by_event(updated.aggregate, "rontgen")
+    expected = split_by_event(built.aggregate, "rontgen")
+    assert comparison.totals.tolist() == expected.totals.tolist()
+    assert comparison.totals[0] == 0
+
+
+def test_split_by_event_ignores_replaced_timelines(data_source):
+    tree = build(data_source, ALL_FILES, 150).aggregate
+    without = build(data_source, WITHOUT_RONTGEN, 150).aggregate
+    with_rontgen = seq_ids_of(data_source / "rontgen_events.csv")
+    replaced = sorted(with_rontgen & set(tree.member_seq_ids.tolist()))[::2]
+
+    # The timelines are read again without rontgen, the old ones stay in
+    # the store until it is compacted
+    tree = tree.copy()
+    tree.remove_event_timelines(replaced)
+    assert without.store is not None
+    tree.add_event_timelines(without.store, np.flatnonzero(np.isin(without.store.seq_ids, replaced)))
+    comparison = split_by_event(tree, "rontgen")
+    kept = with_rontgen - set(replaced)
+    assert_counts(comparison, tree, lambda s: 0 if s in kept else 1)
+
+
+def test_split_by_attribute(data_source):
+    cohort = build(data_source, ALL_FILES, 150)
+    tree = cohort.aggregate
+    attributes = PatientAttributeStore.load(
+        str(data_source / "patient_attributes.csv"), pd.Series(np.unique(tree.member_seq_ids))
+    )
+    comparison = split_by_attribute(tree, attributes, "Gender")
+    assert comparison.names == ["Kvinna", "Man"]
+
+    table = pd.read_csv(data_source / "patient_attributes.csv").drop_duplicates("seqID")
+    gender = dict(zip(table["seqID"].tolist(), table["kon"].tolist()))
+    assert_counts(comparison, tree, lambda s: comparison.names.index(gender[s]))
+
+
+def test_differences(data_source):
+    tree = build(data_source, ALL_FILES, 150).aggregate
+    comparison = split_by_event(tree, "rontgen")
+    frequencies = comparison.counts / comparison.totals
+    assert np.allclose(comparison.differences, frequencies[:, 0] - frequencies[:, 1])
+
+
+@pytest.mark.parametrize("num_cohorts", [0, 1])
+def test_too_few_cohorts(data_source, num_cohorts):
+    tree = build(data_source, ALL_FILES, 50).aggregate
+    seq_ids = np.unique(tree.member_seq_ids)
+    names = ["All"][:num_cohorts]
+    labels = np.zeros(len(seq_ids) if num_cohorts > 0 else 0, dtype=np.int64)
+    comparison = CohortComparison(tree, names, seq_ids[: len(labels)], labels)
+    assert comparison.counts.shape == (len(tree), num_cohorts)
+    assert len(comparison.differences) == len(tree)
+    assert "vs" not in comparison.describe(1)
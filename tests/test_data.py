@@ -0,0 +1,270 @@
+import csv
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import cache
+from data import CohortAggregate, PatientAttributeStore, read_csv
+from time_utils import epoch2datetime
+from timeline import EventTimelineAggregate
+
+
+def describe(tree: EventTimelineAggregate) -> list:
+    """Every node by the keys on its path in tree order, with what is
+    counted there."""
+    nodes = []
+
+    def visit(node, path):
+        for key, child in node.children.items():
+            nodes.append(
+                (
+                    path + (key,),
+                    child.size,
+                    child.stop_here,
+                    child.seq_ids.tolist(),
+                    child.epochs.tolist(),
+                    child.info,
+                    child.wait_stats.count,
+                )
+            )
+            visit(child, path + (key,))
+
+    visit(tree.event_aggregate_root, ())
+    return nodes
+
+
+def paths(directory, names):
+    return [str(directory / name) for name in names]
+
+
+ALL_FILES = [
+    "ankomst_events.csv",
+    "lakare_events.csv",
+    "lab_bestallning_events.csv",
+    "rontgen_events.csv",
+    "operation_events.csv",
+    "diagnos_events.csv",
+    "ut_events.csv",
+]
+WITHOUT_RONTGEN = [n for n in ALL_FILES if n != "rontgen_events.csv"]
+WITHOUT_LAB = [n for n in ALL_FILES if n != "lab_bestallning_events.csv"]
+
+# Event files and number of patients of every step
+STEPS = [
+    (ALL_FILES, 120),
+    (WITHOUT_RONTGEN, 120),
+    (WITHOUT_RONTGEN, 200),
+    (ALL_FILES, 80),
+    (ALL_FILES[:2], 150),
+    (ALL_FILES, 120),
+    (ALL_FILES, 40),
+    (WITHOUT_LAB, 200),
+    (ALL_FILES, 200),
+]
+
+
+@pytest.mark.parametrize("step", range(1, len(STEPS)))
+def test_update_equals_build(data_source, step):
+    pick_from = str(data_source / "pick_from.csv")
+    attributes = str(data_source / "patient_attributes.csv")
+    names, num_patients = STEPS[0]
+    cohort = CohortAggregate.build(paths(data_source, names), pick_from, attributes, num_patients)
+    for names, num_patients in STEPS[1 : step + 1]:
+        updated = cohort.update(paths(data_source, names), pick_from, attributes, num_patients)
+        assert updated is not None
+        cohort = updated
+
+    built = CohortAggregate.build(paths(data_source, names), pick_from, attributes, num_patients)
+    assert describe(cohort.aggregate) == describe(built.aggregate)
+    # Nodes are numbered the same too, snapshots of both are the same tree
+    assert np.array_equal(cohort.aggregate.parents, built.aggregate.parents)
+
+    # Only the timelines in the tree are kept in the store
+    tree = cohort.aggregate
+    assert tree.store is not None
+    assert len(tree.store) == len(np.unique(tree.member_seq_ids))
+    assert np.array_equal(tree.member_epochs, tree.store.epochs[tree.member_events])
+
+
+@pytest.mark.parametrize("arrow", [True, False], ids=["arrow", "pandas"])
+def test_read_csv_types_are_the_same_in_every_chunk(tmp_path, monkeypatch, arrow):
+    monkeypatch.setattr(cache, "HAS_ARROW", arrow and cache.HAS_ARROW)
+    # Without arrow the file is read in chunks of this many rows
+    monkeypatch.setattr(cache, "CHUNK_ROWS", 4)
+    path = tmp_path / "patient_attributes.csv"
+    rows = [(seq_id, "Man", "Gående", "1", "Fall", "40") for seq_id in range(1, 9)]
+    rows[4] = (5, "Man", "Gående", "", "Fall", "")
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            ["seqID", "kon", "akutankomstsatt_namn", "prioritet_akut_kod", "besokorsak_forsta", "alder"]
+        )
+        writer.writerows(rows)
+
+    # The second read is from the cache
+    for _ in range(2):
+        table = read_csv(str(path), None)
+        assert table["seqID"].dtype == np.int64
+        assert table["seqID"].tolist() == list(range(1, 9))
+        priorities = table["prioritet_akut_kod"].tolist()
+        assert priorities[:4] + priorities[5:] == ["1"] * 7
+        assert pd.isna(priorities[4])
+
+        attributes = PatientAttributeStore(table)
+        assert sorted(attributes.categories["Priority"].tolist()) == ["1", "nan"]
+        assert attributes.age[0] == 40 and np.isnan(attributes.age[4])
+
+
+EVENT_HEADER = ["seqID", "time", "event_type", "event_value"]
+
+
+@pytest.fixture
+def small_source(tmp_path):
+    """Seven patients with payloads, repeated events, missing times and a
+    missing arrival."""
+
+    def write(name: str, header: list[str], rows: list) -> None:
+        with open(tmp_path / name, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+
+    write("pick_from.csv", ["seqID"], [[4], [1], [2], [3], [5], [6], [7]])
+    write(
+        "patient_attributes.csv",
+        ["seqID", "ankomst_tidpunkt", "kon", "akutankomstsatt_namn", "prioritet_akut_kod", "besokorsak_forsta", "alder"],
+        [[s, f"2021-03-0{s} 10:00:00", "Man", "Gående", "1", "Fall", 40] for s in range(1, 8)],
+    )
+    # Patient 5 has no arrival
+    write(
+        "ankomst_events.csv",
+        EVENT_HEADER,
+        [[s, f"2021-03-0{s} 10:00:00", "ankomst", ""] for s in (1, 2, 3, 4, 6, 7)],
+    )
+    write(
+        "lakare_events.csv",
+        EVENT_HEADER,
+        [
+            [1, "2021-03-01 10:20:00", "forsta_ansvariga_lakare", ""],
+            [2, "2021-03-02 10:10:00", "forsta_ansvariga_lakare", ""],
+            [2, "2021-03-02 10:40:00", "forsta_ansvariga_lakare", ""],
+            [4, "2021-03-04 10:15:00", "forsta_ansvariga_lakare", ""],
+            [5, "2021-03-05 10:15:00", "forsta_ansvariga_lakare", ""],
+            [7, "2021-03-07 10:05:00", "forsta_ansvariga_lakare", ""],
+        ],
+    )
+    write(
+        "lab_bestallning_events.csv",
+        EVENT_HEADER,
+        [
+            [4, "2021-03-04 10:30:00", "lab_bestallning", json.dumps([{"analys_namn": "Hb"}])],
+            [
+                1,
+                "2021-03-01 10:30:00",
+                "lab_bestallning",
+                json.dumps([{"analys_namn": "CRP"}, {"analys_namn": "Na"}]),
+            ],
+            [7, "2021-03-07 10:30:00", "lab_bestallning", json.dumps([{"analys_namn": "Hb"}])],
+        ],
+    )
+    write(
+        "lakemedel_events.csv",
+        EVENT_HEADER,
+        [
+            [
+                2,
+                "2021-03-02 11:00:00",
+                "lakemedel",
+                json.dumps([{"atc_kod": "N02BE01", "beredningsform": "Tablett"}]),
+            ],
+            [7, "2021-03-07 11:00:00", "lakemedel", json.dumps([])],
+        ],
+    )
+    # Events without a time are put first, before the arrival
+    write(
+        "diagnos_events.csv",
+        EVENT_HEADER + ["event_info"],
+        [
+            [1, "2021-03-01 11:00:00", "Huvuddiagnos", "S720", "Fraktur"],
+            [2, "2021-03-02 11:30:00", "Huvuddiagnos", "S720", "Fraktur"],
+            [2, "2021-03-02 11:40:00", "Huvuddiagnos", "S720", "Fraktur"],
+            [4, "2021-03-04 11:00:00", "Bidiagnos", "N301", "Cystit"],
+            [6, "", "Huvuddiagnos", "S720", "Fraktur"],
+            [7, "", "Bidiagnos", "N301", "Cystit"],
+        ],
+    )
+    write(
+        "ut_events.csv",
+        EVENT_HEADER,
+        [
+            [1, "2021-03-01 12:00:00", "ut_till_namn", "Hem"],
+            [2, "2021-03-02 12:00:00", "ut_till_namn", "Avd"],
+            [3, "2021-03-03 12:00:00", "ut_till_namn", "Hem"],
+            [4, "2021-03-04 12:00:00", "ut_till_namn", "Hem"],
+            [5, "2021-03-05 12:00:00", "ut_till_namn", "Hem"],
+        ],
+    )
+    return tmp_path
+
+
+# The tree the original timeline and aggregate classes build from small_source,
+# path, size, stop_here, members, info and color of every node in tree order
+SMALL_TREE = [
+    (("Arrival",), 4, 0, [1, 2, 3, 4], "", "#8dd3c7"),
+    (("Arrival", "Doctor"), 3, 0, [1, 2, 4], "", "#bebada"),
+    (("Arrival", "Doctor", "Lab order"), 2, 0, [1, 4], "CRP\nNa\n", "#93B5C0"),
+    (("Arrival", "Doctor", "Lab order", "MD:\nS720"), 1, 0, [1], "Fraktur", "#80b1d3"),
+    (("Arrival", "Doctor", "Lab order", "MD:\nS720", "Sent:\nHem"), 1, 1, [1], "", "#fdb462"),
+    (("Arrival", "Doctor", "Lab order", "BD:\nN301"), 1, 0, [4], "Cystit", "#80b1d3"),
+    (("Arrival", "Doctor", "Lab order", "BD:\nN301", "Sent:\nHem"), 1, 1, [4], "", "#fdb462"),
+    (("Arrival", "Doctor", "Meds:\nN02BE01"), 1, 0, [2], "Tablett", "#ff00ff"),
+    (("Arrival", "Doctor", "Meds:\nN02BE01", "MD:\nS720"), 1, 0, [2], "Fraktur", "#80b1d3"),
+    (
+        ("Arrival", "Doctor", "Meds:\nN02BE01", "MD:\nS720", "Sent:\nAvd"),
+        1,
+        1,
+        [2],
+        "",
+        "#fdb462",
+    ),
+    (("Arrival", "Sent:\nHem"), 1, 1, [3], "", "#fdb462"),
+]
+
+
+def test_build_matches_original_tree(small_source):
+    names = [
+        "ankomst_events.csv",
+        "lakare_events.csv",
+        "lab_bestallning_events.csv",
+        "lakemedel_events.csv",
+        "diagnos_events.csv",
+        "ut_events.csv",
+    ]
+    cohort = CohortAggregate.build(
+        paths(small_source, names),
+        str(small_source / "pick_from.csv"),
+        str(small_source / "patient_attributes.csv"),
+        7,
+    )
+    nodes = []
+
+    def visit(node, path):
+        for key, child in node.children.items():
+            nodes.append(
+                (path + (key,), child.size, child.stop_here, child.seq_ids.tolist(), child.info, child.color)
+            )
+            visit(child, path + (key,))
+
+    root = cohort.aggregate.event_aggregate_root
+    visit(root, ())
+    assert nodes == SMALL_TREE
+
+    # A repeated event keeps the time of the first one
+    doctor = root.children["Arrival"].children["Doctor"]
+    assert [str(epoch2datetime(int(e))) for e in doctor.epochs] == [
+        "2021-03-01 10:20:00",
+        "2021-03-02 10:10:00",
+        "2021-03-04 10:15:00",
+    ]
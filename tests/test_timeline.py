@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from data import CohortAggregate
+from timeline import OTHER_KEY, EventStore, EventTimelineAggregate
+
+NAMES = [
+    "ankomst_events.csv",
+    "lakare_events.csv",
+    "rontgen_events.csv",
+    "operation_events.csv",
+    "ut_events.csv",
+]
+
+
+def children(tree: EventTimelineAggregate, node: int) -> list[tuple[str, int]]:
+    """Event title and size of the children of node, in order."""
+    store = tree.store
+    assert store is not None
+    return [
+        (
+            "other" if tree.keys[c] == OTHER_KEY
+            else store.title_table[store.titles[tree.info_events[c]]],
+            int(tree.sizes[c]),
+        )
+        for c in tree.child_nodes(node)
+    ]
+
+
+@pytest.fixture
+def small_tree():
+    # Four first events with the support 4, 3, 2 and 1
+    titles = "aaaabbbccd"
+    store = EventStore.from_records(
+        [(seq_id, 0) for seq_id in range(len(titles))],
+        [(i, 60, False, title, "", "") for i, title in enumerate(titles)],
+    )
+    tree = EventTimelineAggregate()
+    tree.add_event_timelines(store, np.arange(len(titles)))
+    return tree
+
+
+@pytest.mark.parametrize(
+    "max_children, expected",
+    [
+        (0, [("a", 4), ("b", 3), ("c", 2), ("d", 1)]),
+        (4, [("a", 4), ("b", 3), ("c", 2), ("d", 1)]),
+        (3, [("a", 4), ("b", 3), ("other", 3)]),
+        (2, [("a", 4), ("other", 6)]),
+        (1, [("other", 10)]),
+    ],
+)
+def test_pruned_max_children_counts_other(small_tree, max_children, expected):
+    assert children(small_tree.pruned(max_children=max_children), 0) == expected
+
+
+@pytest.mark.parametrize("max_children", [1, 2, 3])
+def test_pruned_max_children(data_source, max_children):
+    tree = CohortAggregate.build(
+        [str(data_source / n) for n in NAMES],
+        str(data_source / "pick_from.csv"),
+        str(data_source / "patient_attributes.csv"),
+        200,
+    ).aggregate
+    pruned = tree.pruned(max_children=max_children)
+    for node in range(1, len(pruned)):
+        below = pruned.child_nodes(node)
+        assert len(below) <= max_children
+        # Every timeline through a node ends there or goes on to a child
+        assert sum(pruned.sizes[c] for c in below) + pruned.stop_here[node] == pruned.sizes[node]
+    assert np.array_equal(np.unique(pruned.member_seq_ids), np.unique(tree.member_seq_ids))
@@ -1,5 +1,15 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Used in place of missing event times
+MISSING_TIME = "2000-01-01 00:00:00"
+
+EPOCH = datetime(1970, 1, 1)
+MISSING_EPOCH = int((datetime.strptime(MISSING_TIME, TIME_FORMAT) - EPOCH).total_seconds())
 
-from datetime import datetime
 
 def str2datetime(string: str) -> datetime:
     date, time = string.split(" ")
@@ -11,3 +21,23 @@ def str2datetime(string: str) -> datetime:
 
 def timediff(s1: str, s2: str) -> float:
     return (str2datetime(s2) - str2datetime(s1)).total_seconds()
+
+
+def parse_times(strings) -> tuple[np.ndarray, np.ndarray]:
+    """Parses a column of TIME_FORMAT strings into int64 epoch seconds.
+
+    Missing values are set to MISSING_EPOCH and flagged in the returned mask.
+    """
+    parsed = pd.to_datetime(pd.Series(strings, dtype=object), format=TIME_FORMAT)
+    missing = parsed.isna().to_numpy()
+    epochs = parsed.to_numpy(dtype="datetime64[s]").astype("int64")
+    epochs[missing] = MISSING_EPOCH
+    return epochs, missing
+
+
+def epoch2datetime(epoch: int) -> datetime:
+    return EPOCH + timedelta(seconds=int(epoch))
+
+
+def datetime2epoch(dt: datetime) -> int:
+    return int((dt - EPOCH).total_seconds())
@@ -1,9 +1,17 @@
+from collections import OrderedDict
 from datetime import datetime
 from enum import Enum
 
+import functools
 import json
+import math
+import sys
 
-from icd import ICD_SE
+import numpy as np
+import pandas as pd
+
+from icd import get_icd_se
+from time_utils import datetime2epoch, epoch2datetime
 
 class bcolors:
     HEADER = "\033[95m"
@@ -40,11 +48,15 @@ class Attributes:
 
 
 class Event:
-    time: datetime
-    title: str
-    value: str
-    descriptive: str
-    color: str
+    """A single event, a view of one row of an EventStore.
+
+    Events constructed directly get a private single event store.
+    """
+
+    __slots__ = ("store", "index")
+
+    store: "EventStore"
+    index: int
 
     class Type(Enum):
         OTHER = -1
@@ -59,70 +71,129 @@ class Event:
         SURGERY = 8
         MEDICATION = 9
 
-    event_type: Type
-    key: str
-    info : str
-    
-    def __init__(self, time: datetime, title: str, value: str, info:str = "") -> None:
-        self.time: datetime = time
-        self.title: str = title
-        self.value: str = value
-        self.info: str = info
+    # Event type value of each known title, used for bulk classification
+    TITLE_TYPES: dict[str, int] = {
+        "ankomst": Type.ARRIVAL.value,
+        "ut_till_namn": Type.EXIT.value,
+        "Bidiagnos": Type.DIAGNOSIS.value,
+        "Huvuddiagnos": Type.DIAGNOSIS.value,
+        "skoterske_tidpunkt": Type.NURSE.value,
+        "forsta_ansvariga_lakare": Type.DOCTOR.value,
+        "rontgen": Type.XRAY.value,
+        "lakemedel": Type.MEDICATION.value,
+        "operation": Type.SURGERY.value,
+        "lab_svar": Type.LAB_RESULTS.value,
+        "lab_bestallning": Type.LAB_ORDER.value,
+    }
+
+    def __init__(
+        self,
+        time: datetime | int,
+        title: str,
+        value: str,
+        info: str = "",
+        time_missing: bool = False,
+    ) -> None:
+        # Missing times keep their place in the sort order, see MISSING_TIME
+        epoch = datetime2epoch(time) if isinstance(time, datetime) else int(time)
+        self.store = EventStore.from_records(
+            [(0, epoch)], [(0, epoch, time_missing, title, value, info)]
+        )
+        self.index = 0
+
+    @staticmethod
+    def view(store: "EventStore", index: int) -> "Event":
+        event = Event.__new__(Event)
+        event.store = store
+        event.index = index
+        return event
+
+    # Titles whose info is parsed from the json payload in the value
+    PAYLOAD_TITLES = ("lakemedel", "lab_svar", "lab_bestallning")
+
+    @staticmethod
+    def describe(
+        title: str, value: str, atc_code: str = ""
+    ) -> tuple["Event.Type", str, str]:
+        """Type, key and color of an event.
+
+        atc_code is the medication code of lakemedel events, see parse_atc_codes.
+        """
         match title:
             case "ankomst":
-                self.event_type = self.Type.ARRIVAL
-                self.key = "Arrival"
-                self.color = "#8dd3c7"
+                return Event.Type.ARRIVAL, "Arrival", "#8dd3c7"
             case "ut_till_namn":
-                self.event_type = self.Type.EXIT
-                self.key = "Sent:\n" + value
-                self.color = "#fdb462"
+                return Event.Type.EXIT, "Sent:\n" + value, "#fdb462"
             case "Bidiagnos":
-                self.event_type = self.Type.DIAGNOSIS
-                self.key = "BD:\n" + value
-                self.color = "#80b1d3"
-                # timeline_str.append(self.icd_se.get_title(event.value))
+                # timeline_str.append(get_icd_se().get_title(event.value))
+                return Event.Type.DIAGNOSIS, "BD:\n" + value, "#80b1d3"
             case "Huvuddiagnos":
-                self.event_type = self.Type.DIAGNOSIS
-                self.key = "MD:\n" + value
-                self.color = "#80b1d3"
-                # timeline_str.append(self.icd_se.get_title(event.value))
+                # timeline_str.append(get_icd_se().get_title(event.value))
+                return Event.Type.DIAGNOSIS, "MD:\n" + value, "#80b1d3"
             case "skoterske_tidpunkt":
-                self.event_type = self.Type.NURSE
-                self.key = "Nurse"
-                self.color = "#ffffb3"
+                return Event.Type.NURSE, "Nurse", "#ffffb3"
             case "forsta_ansvariga_lakare":
-                self.event_type = self.Type.DOCTOR
-                self.key = "Doctor"
-                self.color = "#bebada"
+                return Event.Type.DOCTOR, "Doctor", "#bebada"
             case "rontgen":
-                self.event_type = self.Type.XRAY
-                self.key = "XR:\n" + value
-                self.color = "#5fb86e"
+                return Event.Type.XRAY, "XR:\n" + value, "#5fb86e"
             case "lakemedel":
-                self.event_type = self.Type.MEDICATION
-                code, description, count = Event.parse_meds(value)
-                self.key = "Meds:\n" + code  # More info needed? pill vs drink
-                self.info = description
-                self.color = "#ff00ff"
+                # More info needed? pill vs drink
+                return Event.Type.MEDICATION, "Meds:\n" + atc_code, "#ff00ff"
             case "operation":
-                self.event_type = self.Type.SURGERY
-                self.key = "Surgery:\n" + value
-                self.color = "#a57620"
+                return Event.Type.SURGERY, "Surgery:\n" + value, "#a57620"
             case "lab_svar":
-                self.event_type = self.Type.LAB_RESULTS
-                self.key = "Lab results"
-                self.color = "#A6D3E2"
-                self.info = Event.parse_test_results(value)
+                return Event.Type.LAB_RESULTS, "Lab results", "#A6D3E2"
             case "lab_bestallning":
-                self.event_type = self.Type.LAB_ORDER
-                self.key = "Lab order"
-                self.color = "#93B5C0"
-                self.info = Event.parse_test_order(value)
+                return Event.Type.LAB_ORDER, "Lab order", "#93B5C0"
             case _:
-                self.event_type = self.Type.OTHER
-                self.key = "?\n" + title + value
-                self.color = "#FFFFFF"
+                return Event.Type.OTHER, "?\n" + title + value, "#FFFFFF"
+
+    @property
+    def epoch(self) -> int:
+        """Seconds since 1970-01-01."""
+        return int(self.store.epochs[self.index])
+
+    @property
+    def time(self) -> datetime:
+        return epoch2datetime(self.epoch)
+
+    @property
+    def time_missing(self) -> bool:
+        return bool(self.store.time_missing[self.index])
+
+    @property
+    def title(self) -> str:
+        return self.store.title_table[self.store.titles[self.index]]
+
+    @property
+    def value(self) -> str:
+        return self.store.value_table[self.store.values[self.index]]
+
+    @property
+    def info(self) -> str:
+        return self.store.info(self.index)
+
+    @property
+    def key(self) -> str:
+        return self.store.key_table[self.store.keys[self.index]]
+
+    @property
+    def color(self) -> str:
+        return self.store.key_colors[self.store.keys[self.index]]
+
+    @property
+    def event_type(self) -> "Event.Type":
+        return Event.Type(int(self.store.types[self.index]))
+
+    def __eq__(self, other: object) -> bool:
+        return (
+            isinstance(other, Event)
+            and self.store is other.store
+            and self.index == other.index
+        )
+
+    def __hash__(self) -> int:
+        return hash((id(self.store), self.index))
 
     def __str__(self) -> str:
         return str(self.time) + " " + self.title + " : " + self.value
@@ -151,6 +222,13 @@ class Event:
         return out
 
 
+    @staticmethod
+    def parse_atc_codes(payloads: pd.Series) -> pd.Series:
+        """ATC code of the first medication of every lakemedel payload, without
+        parsing the json."""
+        codes = payloads.astype(object).str.extract(ATC_CODE_PATTERN, expand=False)
+        return codes.fillna("")
+
     @staticmethod
     def parse_meds(s: str) -> tuple[str, str, int]:
         # [{""atc_kod"" : ""J01DD14"", ""beredningsform"" : ""Granulat till oral suspension""}]"
@@ -168,28 +246,94 @@ class Event:
         return code, description, count
 
 
+# First "atc_kod" value of a lakemedel payload
+ATC_CODE_PATTERN = r'"atc_kod"\s*:\s*"([^"]*)"'
+# Parsed payloads kept, enough for the nodes and tooltips of a few plots
+PAYLOAD_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=PAYLOAD_CACHE_SIZE)
+def payload_info(title: str, payload: str) -> str:
+    """Info text of a lab or medication payload.
+
+    Parsed on first use, identical payloads share the result while they are
+    among the PAYLOAD_CACHE_SIZE used most recently.
+    """
+    match title:
+        case "lakemedel":
+            return Event.parse_meds(payload)[1]
+        case "lab_svar":
+            return Event.parse_test_results(payload)
+        case "lab_bestallning":
+            return Event.parse_test_order(payload)
+    raise ValueError(f"{title} events have no payload")
+
+
 class EventTimeline:
-    seq_id: int
-    start_time: datetime
-    events: list[Event]
+    """The events of one sequence, a view of one timeline of an EventStore.
+
+    Timelines constructed directly get a private store. A view is copied to a
+    private store before it is changed.
+    """
+
+    __slots__ = ("store", "row")
+
+    store: "EventStore"
+    row: int
     patient_attributes: Attributes  # TODO
 
-    def __init__(self, id: int, start_time: datetime) -> None:
-        self.seq_id = id
-        self.start_time = start_time
-        self.events = []
+    def __init__(self, id: int, start_time: datetime | int) -> None:
+        start_epoch = (
+            datetime2epoch(start_time)
+            if isinstance(start_time, datetime)
+            else int(start_time)
+        )
+        self.store = EventStore.from_records([(id, start_epoch)], [])
+        self.row = 0
+
+    @staticmethod
+    def view(store: "EventStore", row: int) -> "EventTimeline":
+        timeline = EventTimeline.__new__(EventTimeline)
+        timeline.store = store
+        timeline.row = row
+        return timeline
+
+    @property
+    def seq_id(self) -> int:
+        return int(self.store.seq_ids[self.row])
+
+    @property
+    def start_epoch(self) -> int:
+        return int(self.store.start_epochs[self.row])
+
+    @property
+    def start_time(self) -> datetime:
+        return epoch2datetime(self.start_epoch)
+
+    @property
+    def events(self) -> list[Event]:
+        start, end = self.store.span(self.row)
+        return [Event.view(self.store, i) for i in range(start, end)]
 
     def add_event(self, event: Event) -> None:
+        events = self.events
         if (
-            len(self.events) > 0
-            and event.event_type == self.events[-1].event_type
-            and event.value == self.events[-1].value
+            len(events) > 0
+            and event.event_type == events[-1].event_type
+            and event.value == events[-1].value
         ):
             return
-        self.events.append(event)
+        self._set_events(events + [event])
 
     def sort(self) -> None:
-        self.events.sort(key=lambda x: x.time)
+        self._set_events(sorted(self.events, key=lambda x: x.epoch))
+
+    def _set_events(self, events: list[Event]) -> None:
+        self.store = EventStore.from_records(
+            [(self.seq_id, self.start_epoch)],
+            [(0, e.epoch, e.time_missing, e.title, e.value, e.info) for e in events],
+        )
+        self.row = 0
 
     def __str__(self) -> str:
         out = "SeqID " + str(self.seq_id)
@@ -198,71 +342,944 @@ class EventTimeline:
         return out
 
 
-class EventAggregate:
-    key: str
-    color: str
-    events: dict[int, Event]
-
-    stop_here: int
-    size: int
-
-    parent: "EventAggregate|None"
-    children: dict[str, "EventAggregate"]
-
-    def __init__(self, event_key: str, info:str) -> None:
-        # Data
-        self.key = event_key
-        self.wait_times = []
-        self.stop_here = 0
-        self.size = 0
-        self.events = {}
-        self.color = "#000000"
-        self.info = info
-
-        # Node
-        self.parent = None
-        self.children = {}
-
-    def add_event(self, seq_id: int, event: Event, last_event: bool):
-        self.events[seq_id] = event
-        self.size += 1
-        self.color = event.color
-        if last_event:
-            self.stop_here += 1
-
-    def get_or_create_child(self, key: str, info: str) -> "EventAggregate":
-        if key in self.children.keys():
-            return self.children[key]
+class EventStore:
+    """The events of many timelines in flat arrays.
+
+    The events of timeline i are rows offsets[i] to offsets[i + 1], sorted by
+    time. Strings are interned in tables and the rows hold their int codes.
+    """
+
+    # Per timeline
+    seq_ids: np.ndarray  # int64
+    start_epochs: np.ndarray  # int64
+    offsets: np.ndarray  # int64, one more than the number of timelines
+
+    # Per event
+    epochs: np.ndarray  # int64 seconds since 1970-01-01
+    time_missing: np.ndarray  # bool
+    types: np.ndarray  # int8 Event.Type value
+    titles: np.ndarray  # code in title_table
+    values: np.ndarray  # code in value_table
+    infos: np.ndarray  # code in info_table, -1 if parsed from the value
+    keys: np.ndarray  # code in key_table and key_colors
+
+    title_table: list[str]
+    value_table: list[str]
+    info_table: list[str]
+    key_table: list[str]
+    key_colors: list[str]
+
+    def __init__(
+        self,
+        seq_ids: np.ndarray,
+        start_epochs: np.ndarray,
+        counts: np.ndarray,
+        epochs: np.ndarray,
+        time_missing: np.ndarray,
+        titles: np.ndarray,
+        values: np.ndarray,
+        infos: np.ndarray,
+    ) -> None:
+        """counts holds the number of events of every timeline, titles, values
+        and infos are string arrays with one entry per event."""
+        self.seq_ids = np.asarray(seq_ids, dtype=np.int64)
+        self.start_epochs = np.asarray(start_epochs, dtype=np.int64)
+        self.offsets = np.zeros(len(self.seq_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.offsets[1:])
+        self.epochs = np.asarray(epochs, dtype=np.int64)
+        self.time_missing = np.asarray(time_missing, dtype=bool)
+
+        title_codes, title_table = _intern(titles)
+        value_codes, value_table = _intern(values)
+        self.titles = title_codes.astype(np.int16)
+        self.values = value_codes.astype(np.int32)
+        self.title_table = title_table
+        self.value_table = value_table
+
+        # Key and color only depend on title and value, describe every
+        # distinct pair once
+        _, first, pair_index = np.unique(
+            title_codes.astype(np.int64) * max(len(value_table), 1) + value_codes,
+            return_index=True,
+            return_inverse=True,
+        )
+        pair_titles = [title_table[title_codes[i]] for i in first]
+        pair_values = pd.Series(
+            [value_table[value_codes[i]] for i in first], dtype=object
+        )
+        is_meds = np.array([t == "lakemedel" for t in pair_titles], dtype=bool)
+        atc_codes = np.full(len(first), "", dtype=object)
+        atc_codes[is_meds] = Event.parse_atc_codes(pair_values[is_meds]).to_numpy()
+        described = [
+            Event.describe(title, value, atc_code)
+            for title, value, atc_code in zip(pair_titles, pair_values, atc_codes)
+        ]
+        self.types = np.array([d[0].value for d in described], dtype=np.int8)[pair_index]
+        key_codes, self.key_table = _intern(np.array([d[1] for d in described], dtype=object))
+        self.keys = key_codes.astype(np.int32)[pair_index]
+        self.key_colors = [""] * len(self.key_table)
+        for key_code, d in zip(key_codes, described):
+            self.key_colors[key_code] = d[2]
+
+        # Payload info is parsed from the value when it is first asked for
+        info_codes, self.info_table = _intern(infos)
+        self.infos = info_codes.astype(np.int32)
+        has_payload = np.array([t in Event.PAYLOAD_TITLES for t in pair_titles], dtype=bool)
+        self.infos[has_payload[pair_index]] = -1
+
+    @staticmethod
+    def from_records(
+        timelines: list[tuple[int, int]],
+        events: list[tuple[int, int, bool, str, str, str]],
+    ) -> "EventStore":
+        """Builds a store from (seq_id, start_epoch) timelines and
+        (timeline, epoch, time_missing, title, value, info) events."""
+        rows = np.array([e[0] for e in events], dtype=np.int64)
+        order = np.argsort(rows, kind="stable")
+        events = [events[i] for i in order]
+
+        def column(i: int, dtype) -> np.ndarray:
+            return np.array([e[i] for e in events], dtype=dtype)
+
+        return EventStore(
+            np.array([t[0] for t in timelines], dtype=np.int64),
+            np.array([t[1] for t in timelines], dtype=np.int64),
+            np.bincount(rows, minlength=len(timelines)),
+            column(1, np.int64),
+            column(2, bool),
+            column(3, object),
+            column(4, object),
+            column(5, object),
+        )
+
+    def extend(self, other: "EventStore") -> "EventStore":
+        """A store with the timelines of self followed by those of other.
+
+        Timelines, events and strings of self keep their rows, indices and
+        codes, so views and aggregates of self are valid in the new store.
+        """
+        store = EventStore.__new__(EventStore)
+        store.seq_ids = np.concatenate([self.seq_ids, other.seq_ids])
+        store.start_epochs = np.concatenate([self.start_epochs, other.start_epochs])
+        store.offsets = np.concatenate(
+            [self.offsets, other.offsets[1:] + self.offsets[-1]]
+        )
+        store.epochs = np.concatenate([self.epochs, other.epochs])
+        store.time_missing = np.concatenate([self.time_missing, other.time_missing])
+        store.types = np.concatenate([self.types, other.types])
+
+        store.titles, store.title_table = _extend_codes(
+            self.titles, self.title_table, other.titles, other.title_table
+        )
+        store.values, store.value_table = _extend_codes(
+            self.values, self.value_table, other.values, other.value_table
+        )
+        store.infos, store.info_table = _extend_codes(
+            self.infos, self.info_table, other.infos, other.info_table
+        )
+        store.keys, store.key_table = _extend_codes(
+            self.keys, self.key_table, other.keys, other.key_table
+        )
+        colors = dict(zip(other.key_table, other.key_colors))
+        store.key_colors = self.key_colors + [
+            colors[key] for key in store.key_table[len(self.key_table) :]
+        ]
+        return store
+
+    def take(self, rows: np.ndarray) -> tuple["EventStore", np.ndarray]:
+        """A store with only the given timelines, in the given order, and the
+        new index of every event of self, -1 for the events left out.
+
+        Strings keep their codes, the tables are shared with self.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = self.offsets[rows]
+        counts = self.offsets[rows + 1] - starts
+        store = EventStore.__new__(EventStore)
+        store.seq_ids = self.seq_ids[rows]
+        store.start_epochs = self.start_epochs[rows]
+        store.offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(counts, out=store.offsets[1:])
+
+        events = np.repeat(starts - store.offsets[:-1], counts) + np.arange(
+            store.offsets[-1]
+        )
+        store.epochs = self.epochs[events]
+        store.time_missing = self.time_missing[events]
+        store.types = self.types[events]
+        store.titles = self.titles[events]
+        store.values = self.values[events]
+        store.infos = self.infos[events]
+        store.keys = self.keys[events]
+        store.title_table = self.title_table
+        store.value_table = self.value_table
+        store.info_table = self.info_table
+        store.key_table = self.key_table
+        store.key_colors = self.key_colors
+
+        new_events = np.full(len(self.epochs), -1, dtype=np.int64)
+        new_events[events] = np.arange(len(events))
+        return store, new_events
+
+    def __len__(self) -> int:
+        return len(self.seq_ids)
+
+    def span(self, row: int) -> tuple[int, int]:
+        return int(self.offsets[row]), int(self.offsets[row + 1])
+
+    def info(self, index: int) -> str:
+        code = self.infos[index]
+        if code >= 0:
+            return self.info_table[code]
+        return payload_info(
+            self.title_table[self.titles[index]], self.value_table[self.values[index]]
+        )
+
+    def timeline(self, row: int) -> EventTimeline:
+        return EventTimeline.view(self, row)
+
+    def timelines(self) -> list[EventTimeline]:
+        return [EventTimeline.view(self, row) for row in range(len(self))]
+
+
+def _intern(strings: np.ndarray) -> tuple[np.ndarray, list[str]]:
+    """Codes of the strings and the table of distinct strings they point to."""
+    if len(strings) == 0:
+        return np.zeros(0, dtype=np.int64), []
+    codes, table = pd.factorize(np.asarray(strings, dtype=object))
+    return codes, [sys.intern(str(s)) for s in table]
+
+
+def _extend_codes(
+    codes: np.ndarray, table: list[str], other_codes: np.ndarray, other_table: list[str]
+) -> tuple[np.ndarray, list[str]]:
+    """Codes and table of codes followed by other_codes, strings missing from
+    table are added to the end of it. Negative codes are kept."""
+    index = {string: code for code, string in enumerate(table)}
+    table = list(table)
+    recode = np.empty(len(other_table) + 1, dtype=np.int64)
+    for code, string in enumerate(other_table):
+        recode[code] = index.setdefault(string, len(table))
+        if recode[code] == len(table):
+            table.append(string)
+    recode[-1] = -1  # other_codes of -1 stay -1
+    other = recode[other_codes].astype(codes.dtype)
+    return np.concatenate([codes, other]), table
+
+
+# Key code and color of the "other" children made by pruning
+OTHER_KEY = -2
+OTHER_COLOR = "#A0A0A0"
+
+# Waits are counted in bins of a quarter of an octave of minutes, waits under
+# a minute in bin 0 and waits over the last bin in the last bin
+WAIT_BINS_PER_OCTAVE = 4
+NUM_WAIT_BINS = 64
+
+
+def wait_bin(minutes: np.ndarray) -> np.ndarray:
+    octaves = np.log2(np.maximum(minutes, 1.0)) * WAIT_BINS_PER_OCTAVE
+    bins = np.where(minutes < 1.0, 0, 1 + np.floor(octaves).astype(np.int64))
+    return np.minimum(bins, NUM_WAIT_BINS - 1)
+
+
+class WaitStats:
+    """Minutes from the events of the parent of a node to its events, over
+    the timelines of the node that have both times."""
+
+    __slots__ = ("count", "mean", "min", "max", "bins")
+
+    count: int
+    mean: float
+    min: float
+    max: float
+    bins: np.ndarray  # count per wait_bin
+
+    def __init__(
+        self, count: int, total: float, minimum: float, maximum: float, bins: np.ndarray
+    ) -> None:
+        self.count = count
+        self.mean = total / count if count > 0 else math.nan
+        self.min = minimum
+        self.max = maximum
+        self.bins = bins
+
+    def quantile(self, q: float) -> float:
+        """Approximate quantile, the middle of the bin it falls in."""
+        if self.count == 0:
+            return math.nan
+        i = int(np.searchsorted(np.cumsum(self.bins), q * self.count))
+        if i == 0:
+            low, high = 0.0, 1.0
         else:
-            ea = EventAggregate(key, info)
-            self.children[key] = ea
-            ea.parent = self
-            return ea
+            low = 2.0 ** ((i - 1) / WAIT_BINS_PER_OCTAVE)
+            high = 2.0 ** (i / WAIT_BINS_PER_OCTAVE)
+        return min(max((low + high) / 2, self.min), self.max)
+
+
+class EventAggregate:
+    """One node of an EventTimelineAggregate.
+
+    A view of the node arrays of the aggregate, views of the same node compare
+    equal.
+    """
+
+    __slots__ = ("tree", "node")
+
+    tree: "EventTimelineAggregate"
+    node: int
+
+    @staticmethod
+    def view(tree: "EventTimelineAggregate", node: int) -> "EventAggregate":
+        ea = EventAggregate.__new__(EventAggregate)
+        ea.tree = tree
+        ea.node = node
+        return ea
+
+    @property
+    def key(self) -> str:
+        if self.node == 0:
+            return ""
+        if self.is_other:
+            return f"other ({self.tree.merged[self.node]})"
+        return self.tree.store.key_table[self.tree.keys[self.node]]
+
+    @property
+    def color(self) -> str:
+        if self.node == 0:
+            return "#000000"
+        if self.is_other:
+            return OTHER_COLOR
+        return self.tree.store.key_colors[self.tree.keys[self.node]]
+
+    @property
+    def info(self) -> str:
+        # Info of the event that created the node
+        if self.node == 0:
+            return ""
+        if self.is_other:
+            return "Events with too little support"
+        return self.tree.store.info(self.tree.info_events[self.node])
+
+    @property
+    def is_other(self) -> bool:
+        """Whether the node holds the children merged by pruning."""
+        return self.tree.keys[self.node] == OTHER_KEY
+
+    @property
+    def size(self) -> int:
+        return int(self.tree.sizes[self.node])
+
+    @property
+    def stop_here(self) -> int:
+        return int(self.tree.stop_here[self.node])
+
+    @property
+    def parent(self) -> "EventAggregate | None":
+        parent = self.tree.parents[self.node]
+        return None if parent < 0 else EventAggregate.view(self.tree, int(parent))
+
+    @property
+    def children(self) -> dict[str, "EventAggregate"]:
+        """Children by key, in the order they were first reached."""
+        return {child.key: child for child in self.tree.child_views(self.node)}
+
+    @property
+    def seq_ids(self) -> np.ndarray:
+        """Sorted sequence ids of the timelines passing through the node."""
+        return self.tree.member_seq_ids[self.tree.member_slice(self.node)]
+
+    @property
+    def epochs(self) -> np.ndarray:
+        """Event times of the node, aligned with seq_ids."""
+        return self.tree.member_epochs[self.tree.member_slice(self.node)]
+
+    @property
+    def time_missing(self) -> np.ndarray:
+        return self.tree.member_missing[self.tree.member_slice(self.node)]
+
+    @property
+    def wait_stats(self) -> WaitStats:
+        """Waits since the parent's events, counted when the tree was built."""
+        tree = self.tree
+        return WaitStats(
+            int(tree.wait_counts[self.node]),
+            float(tree.wait_sums[self.node]),
+            float(tree.wait_mins[self.node]),
+            float(tree.wait_maxs[self.node]),
+            tree.wait_bins[self.node],
+        )
+
+    @property
+    def events(self) -> dict[int, Event]:
+        members = self.tree.member_slice(self.node)
+        return {
+            seq_id: Event.view(self.tree.store, index)
+            for seq_id, index in zip(
+                self.tree.member_seq_ids[members].tolist(),
+                self.tree.member_events[members].tolist(),
+            )
+        }
 
     def get_time_diffs(self, other: "EventAggregate") -> list[float]:
-        diffs: list[float] = []
-        for seq_id in self.get_common_seqids(other):
-            diff = abs(self.events[seq_id].time - other.events[seq_id].time)
-            diffs.append(diff.total_seconds() / 60.0)
-        return diffs
-    
+        # Minutes between the events, pairs with a missing time are skipped
+        return self.tree.node_pair(self, other)[1].tolist()
+
     def get_common_seqids(self, other: "EventAggregate") -> list[int]:
-        common: list[int] = []
-        for seq_id in self.events.keys():
-            if seq_id in other.events.keys():
-                common.append(seq_id)
-        return common
+        return self.tree.node_pair(self, other)[0].tolist()
+
+    def __eq__(self, other: object) -> bool:
+        return (
+            isinstance(other, EventAggregate)
+            and self.tree is other.tree
+            and self.node == other.node
+        )
+
+    def __hash__(self) -> int:
+        return hash((id(self.tree), self.node))
+
 
 class EventTimelineAggregate:
-    event_aggregate_root: EventAggregate
+    """Prefix tree of the event keys of many timelines, stored in arrays.
+
+    Node 0 is the root. The children of a node are linked through first_child
+    and next_sibling in the order they were first reached. The timelines
+    passing through node n are rows member_offsets[n] to member_offsets[n + 1]
+    of the member arrays, sorted by seqID.
+
+    The arrays are replaced, never changed in place, so a copy can share them
+    and views of a tree being updated elsewhere keep a consistent state.
+    """
+
+    store: "EventStore | None"
+
+    # Per node, -1 where there is none
+    parents: np.ndarray  # int64
+    keys: np.ndarray  # int32 code in store.key_table, or OTHER_KEY
+    info_events: np.ndarray  # int64 event the node was created from
+    merged: np.ndarray  # int64 number of children merged into an other node
+    first_child: np.ndarray  # int64
+    next_sibling: np.ndarray  # int64
+    sizes: np.ndarray  # int64 number of timelines through the node
+    stop_here: np.ndarray  # int64 number of timelines ending at the node
+
+    # Per timeline passing through a node
+    member_offsets: np.ndarray  # int64, one more than the number of nodes
+    member_seq_ids: np.ndarray  # int64
+    member_epochs: np.ndarray  # int64
+    member_missing: np.ndarray  # bool
+    member_events: np.ndarray  # int64 event in store
+    member_last: np.ndarray  # bool, last event of the timeline
+
+    # Per node, minutes since the events of the parent, see WaitStats
+    wait_counts: np.ndarray  # int64
+    wait_sums: np.ndarray  # float64
+    wait_mins: np.ndarray  # float64, nan without waits
+    wait_maxs: np.ndarray  # float64, nan without waits
+    wait_bins: np.ndarray  # int32, NUM_WAIT_BINS per node
+
+    # parent << 32 | key of every node but the root, sorted, and their nodes
+    edge_codes: np.ndarray
+    edge_nodes: np.ndarray
+
+    # Node pairs compared most recently, see node_pair
+    PAIR_CACHE_SIZE = 256
+    pairs: OrderedDict[tuple[int, int], tuple[np.ndarray, np.ndarray, np.ndarray]]
 
     def __init__(self) -> None:
-        self.event_aggregate_root = EventAggregate("", "")
+        self.store = None
+        self.parents = np.array([-1], dtype=np.int64)
+        self.keys = np.array([-1], dtype=np.int32)
+        self.info_events = np.array([-1], dtype=np.int64)
+        self.merged = np.zeros(1, dtype=np.int64)
+        self.first_child = np.array([-1], dtype=np.int64)
+        self.next_sibling = np.array([-1], dtype=np.int64)
+        self.sizes = np.zeros(1, dtype=np.int64)
+        self.stop_here = np.zeros(1, dtype=np.int64)
+
+        self.member_offsets = np.zeros(2, dtype=np.int64)
+        self.member_seq_ids = np.zeros(0, dtype=np.int64)
+        self.member_epochs = np.zeros(0, dtype=np.int64)
+        self.member_missing = np.zeros(0, dtype=bool)
+        self.member_events = np.zeros(0, dtype=np.int64)
+        self.member_last = np.zeros(0, dtype=bool)
+
+        self.wait_counts = np.zeros(1, dtype=np.int64)
+        self.wait_sums = np.zeros(1, dtype=np.float64)
+        self.wait_mins = np.full(1, np.nan)
+        self.wait_maxs = np.full(1, np.nan)
+        self.wait_bins = np.zeros((1, NUM_WAIT_BINS), dtype=np.int32)
+
+        self.edge_codes = np.zeros(0, dtype=np.int64)
+        self.edge_nodes = np.zeros(0, dtype=np.int64)
+
+        self.pairs = OrderedDict()
+
+    @property
+    def event_aggregate_root(self) -> EventAggregate:
+        return EventAggregate.view(self, 0)
+
+    def __len__(self) -> int:
+        return len(self.parents)
+
+    def member_slice(self, node: int) -> slice:
+        return slice(int(self.member_offsets[node]), int(self.member_offsets[node + 1]))
+
+    def child_nodes(self, node: int) -> list[int]:
+        children = []
+        child = int(self.first_child[node])
+        while child >= 0:
+            children.append(child)
+            child = int(self.next_sibling[child])
+        return children
+
+    def child_views(self, node: int) -> list[EventAggregate]:
+        return [EventAggregate.view(self, child) for child in self.child_nodes(node)]
+
+    def chain_ends(self) -> np.ndarray:
+        """Last node of the chain of single children starting at every node.
+
+        A chain goes on through a node's only child if no timeline ends at
+        the node, so every node of a chain has the same timelines. Nodes with
+        another number of children are the end of their own chain.
+        """
+        num_children = np.bincount(self.parents[1:], minlength=len(self))
+        single = (num_children == 1) & (self.stop_here == 0)
+        single[0] = False
+        ends = np.where(single, self.first_child, np.arange(len(self)))
+        while True:
+            # Every step doubles the length of the chains followed
+            next_ends = ends[ends]
+            if np.array_equal(next_ends, ends):
+                return ends
+            ends = next_ends
+
+    def chain(self, node: int, ends: np.ndarray) -> list[EventAggregate]:
+        """The nodes from node to ends[node], see chain_ends."""
+        steps = [node]
+        while steps[-1] != ends[node]:
+            steps.append(int(self.first_child[steps[-1]]))
+        return [EventAggregate.view(self, step) for step in steps]
+
+    def levels(self) -> list[np.ndarray]:
+        """Nodes at every depth below the root, in order of their numbers."""
+        by_parent = np.argsort(self.parents, kind="stable")
+        sorted_parents = self.parents[by_parent]
+        levels = []
+        level = np.zeros(1, dtype=np.int64)
+        while True:
+            start = np.searchsorted(sorted_parents, level, side="left")
+            end = np.searchsorted(sorted_parents, level, side="right")
+            counts = end - start
+            if counts.sum() == 0:
+                return levels
+            rows = np.repeat(start - np.cumsum(np.append(0, counts[:-1])), counts)
+            level = np.sort(by_parent[rows + np.arange(counts.sum())])
+            levels.append(level)
+
+    def node_pair(
+        self, a: EventAggregate, b: EventAggregate
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Sequence ids of the timelines passing through both nodes, the
+        minutes between their events at the two nodes and the mask of the
+        sequence ids the minutes are of.
+
+        Pairs where either event is missing its time have no time diff. The
+        result is shared by both orders of the pair and kept for the
+        PAIR_CACHE_SIZE pairs used most recently.
+        """
+        key = (min(a.node, b.node), max(a.node, b.node))
+        if a.tree is self and b.tree is self and key in self.pairs:
+            self.pairs.move_to_end(key)
+            return self.pairs[key]
+
+        seq_ids, mine, theirs = np.intersect1d(
+            a.seq_ids, b.seq_ids, assume_unique=True, return_indices=True
+        )
+        timed = ~(a.time_missing[mine] | b.time_missing[theirs])
+        diffs = np.abs(a.epochs[mine] - b.epochs[theirs])[timed] / 60.0
+        for array in (seq_ids, diffs, timed):
+            array.flags.writeable = False
+        if a.tree is self and b.tree is self:
+            self.pairs[key] = (seq_ids, diffs, timed)
+            if len(self.pairs) > self.PAIR_CACHE_SIZE:
+                self.pairs.popitem(last=False)
+        return seq_ids, diffs, timed
+
+    def copy(self) -> "EventTimelineAggregate":
+        agg = EventTimelineAggregate.__new__(EventTimelineAggregate)
+        agg.__dict__.update(self.__dict__)
+        agg.pairs = OrderedDict()
+        return agg
 
     def add_event_timeline(self, timeline: EventTimeline):
-        current_node = self.event_aggregate_root
-        last = timeline.events[-1]
-        for event in timeline.events:
-            child_ea: EventAggregate = current_node.get_or_create_child(event.key, event.info)
-            child_ea.add_event(timeline.seq_id, event, event == last)
-            current_node = child_ea
+        self.add_event_timelines(timeline.store, [timeline.row])
+
+    def add_event_timelines(self, store: "EventStore", rows) -> None:
+        """Inserts timelines of store into the tree, one level at a time.
+
+        Timelines of another store than the one of the aggregate are appended
+        to it first.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if self.store is None:
+            self.store = store
+        elif store is not self.store:
+            rows = rows + len(self.store)
+            store = self.store = self.store.extend(store)
+
+        self.pairs.clear()
+        starts = store.offsets[rows]
+        lengths = store.offsets[rows + 1] - starts
+
+        # Node of every timeline at the current level, starting at the root
+        current = np.zeros(len(rows), dtype=np.int64)
+        num_nodes = len(self)
+        new_nodes: list[tuple[np.ndarray, np.ndarray]] = []  # codes, events
+        members: list[tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+
+        active = np.flatnonzero(lengths > 0)
+        depth = 0
+        while len(active) > 0:
+            events = starts[active] + depth
+            codes = (current[active] << 32) | store.keys[events].astype(np.int64)
+            nodes, created, first = self._find_children(codes, num_nodes)
+            new_nodes.append((created, events[first]))
+            num_nodes += len(created)
+
+            current[active] = nodes
+            members.append((nodes, active, events))
+            depth += 1
+            active = active[lengths[active] > depth]
+
+        if len(members) == 0:
+            return
+        codes = np.concatenate([c for c, _ in new_nodes])
+        self.parents = np.concatenate([self.parents, codes >> 32])
+        self.keys = np.concatenate([self.keys, (codes & 0xFFFFFFFF).astype(np.int32)])
+        self.merged = np.concatenate([self.merged, np.zeros(len(codes), dtype=np.int64)])
+        self.info_events = np.concatenate(
+            [self.info_events] + [e for _, e in new_nodes]
+        )
+        self._link_children()
+
+        nodes = np.concatenate([m[0] for m in members])
+        timelines = np.concatenate([m[1] for m in members])
+        events = np.concatenate([m[2] for m in members])
+        self._set_members(
+            np.concatenate([self._member_nodes(), nodes]),
+            np.concatenate([self.member_seq_ids, store.seq_ids[rows[timelines]]]),
+            np.concatenate([self.member_events, events]),
+            np.concatenate(
+                [self.member_last, events == starts[timelines] + lengths[timelines] - 1]
+            ),
+        )
+
+    def remove_event_timelines(self, seq_ids) -> None:
+        """Removes the timelines of the given sequence ids.
+
+        Nodes no timeline passes through any more are removed, the other nodes
+        keep their order but are numbered again.
+        """
+        removed = np.isin(self.member_seq_ids, np.asarray(seq_ids, dtype=np.int64))
+        if not removed.any():
+            return
+        self.pairs.clear()
+        keep = ~removed
+        nodes = self._member_nodes()[keep]
+        events = self.member_events[keep]
+
+        alive = np.bincount(nodes, minlength=len(self)) > 0
+        alive[0] = True
+        new_ids = np.cumsum(alive) - 1
+        parents = self.parents[alive]
+        self.parents = np.where(parents >= 0, new_ids[parents], -1)
+        self.keys = self.keys[alive]
+        self.merged = self.merged[alive]
+        info_events = self.info_events[alive]
+        self._link_children()
+        self._set_members(
+            new_ids[nodes], self.member_seq_ids[keep], events, self.member_last[keep]
+        )
+
+        # Nodes created by a removed timeline take the info of a remaining one
+        stale = np.isin(info_events, self.member_events, invert=True)
+        stale[0] = False
+        info_events[stale] = self.member_events[self.member_offsets[:-1][stale]]
+        self.info_events = info_events
+
+    def renumber(self, seq_ids: np.ndarray) -> None:
+        """Numbers the nodes and picks their info events the way adding all
+        timelines at once in the order of seq_ids does.
+
+        Nodes are numbered level by level, in the order of the first timeline
+        through them, which also orders the siblings. Every node gets the info
+        of its first timeline. After timelines were removed and added in
+        another order, this gives the tree a build of seq_ids gives.
+        """
+        if len(self) == 1:
+            return
+        # Rank of every member by the first appearance of its sequence id
+        unique, first = np.unique(np.asarray(seq_ids, dtype=np.int64), return_index=True)
+        rank = first[np.searchsorted(unique, self.member_seq_ids)]
+        nodes = self._member_nodes()
+        by_rank = np.lexsort((rank, nodes))
+        # Members are sorted by node, the root has none
+        first_member = by_rank[self.member_offsets[1:-1]]
+
+        depths = np.zeros(len(self), dtype=np.int64)
+        for depth, level in enumerate(self.levels()):
+            depths[level] = depth
+        order = np.lexsort((rank[first_member], depths[1:])) + 1
+        new_ids = np.empty(len(self), dtype=np.int64)
+        new_ids[0] = 0
+        new_ids[order] = np.arange(1, len(self))
+
+        self.pairs.clear()
+        parents = self.parents[order]
+        self.parents = np.concatenate([[-1], new_ids[parents]])
+        self.keys = self.keys[np.concatenate([[0], order])]
+        self.merged = self.merged[np.concatenate([[0], order])]
+        self.info_events = np.concatenate(
+            [self.info_events[:1], self.member_events[first_member][order - 1]]
+        )
+        self._link_children()
+        self._set_members(
+            new_ids[nodes], self.member_seq_ids, self.member_events, self.member_last
+        )
+
+    def timeline_rows(self) -> tuple[np.ndarray, np.ndarray]:
+        """Sequence ids of the timelines in the tree and their rows in the
+        store, in member order."""
+        # Every timeline passes through one child of the root
+        first_level = np.repeat(self.parents == 0, np.diff(self.member_offsets))
+        if self.store is None:
+            return self.member_seq_ids[first_level], np.zeros(0, dtype=np.int64)
+        events = self.member_events[first_level]
+        rows = np.searchsorted(self.store.offsets, events, side="right") - 1
+        return self.member_seq_ids[first_level], rows
+
+    def compact(self) -> None:
+        """Drops the timelines of the store no timeline of the tree uses.
+
+        Removed timelines stay in the store, and timelines read again are
+        appended to it once more, so the store of a tree that is updated
+        keeps growing until it is compacted.
+        """
+        if self.store is None:
+            return
+        rows = np.unique(self.timeline_rows()[1])
+        if len(rows) == len(self.store):
+            return
+        self.pairs.clear()
+        self.store, new_events = self.store.take(rows)
+        self.member_events = new_events[self.member_events]
+        info_events = self.info_events.copy()
+        has_event = info_events >= 0
+        info_events[has_event] = new_events[info_events[has_event]]
+        self.info_events = info_events
+
+    def pruned(
+        self, min_support: int = 0, min_fraction: float = 0.0, max_children: int = 0
+    ) -> "EventTimelineAggregate":
+        """A copy where the children of every node that fewer than min_support
+        timelines, or fewer than min_fraction of all timelines, pass through
+        are merged into one "other" child. If max_children is above 0, no
+        node gets more than max_children children, the other child included,
+        so the max_children - 1 with the most support are kept when any are
+        merged.
+
+        The timelines of merged children go on through the other node, whose
+        children are merged by key and pruned the same way, so sizes and
+        stop_here still add up.
+        """
+        total = int(self.sizes[self.parents == 0].sum())
+        threshold = max(min_support, math.ceil(min_fraction * total))
+        if threshold <= 1 and max_children <= 0:
+            return self.copy()
+
+        # Node of the pruned tree of every node
+        mapping = np.zeros(len(self), dtype=np.int64)
+        parents = [np.array([-1], dtype=np.int64)]
+        keys = [np.array([-1], dtype=np.int64)]
+        info_events = [np.array([-1], dtype=np.int64)]
+        merged = [np.zeros(1, dtype=np.int64)]
+        num_nodes = 1
+        for level in self.levels():
+            # Children of one pruned node with the same key are merged first
+            codes = (mapping[self.parents[level]] << 32) | (
+                self.keys[level].astype(np.int64) & 0xFFFFFFFF
+            )
+            groups, first, inverse = np.unique(codes, return_index=True, return_inverse=True)
+            inverse = inverse.reshape(-1)
+            support = np.bincount(inverse, weights=self.sizes[level])
+            group_parents = groups >> 32
+
+            # Rank the children of every node by support, then by age
+            order = np.lexsort((first, -support, group_parents))
+            run_start = np.flatnonzero(
+                np.concatenate([[True], group_parents[order][1:] != group_parents[order][:-1]])
+            )
+            run_lengths = np.diff(np.append(run_start, len(groups)))
+            rank = np.empty(len(groups), dtype=np.int64)
+            rank[order] = np.arange(len(groups)) - np.repeat(run_start, run_lengths)
+            siblings = np.empty(len(groups), dtype=np.int64)
+            siblings[order] = np.repeat(run_lengths, run_lengths)
+            keep = support >= threshold
+            if max_children > 0:
+                # The other child is one of the max_children
+                keep &= (siblings <= max_children) | (rank < max_children - 1)
+            targets = np.where(
+                keep, groups, (group_parents << 32) | (OTHER_KEY & 0xFFFFFFFF)
+            )
+
+            # New nodes are numbered in order of the first node they hold
+            nodes, target_first, target_inverse = np.unique(
+                targets, return_index=True, return_inverse=True
+            )
+            target_inverse = target_inverse.reshape(-1)
+            appearance = np.full(len(nodes), len(level), dtype=np.int64)
+            np.minimum.at(appearance, target_inverse, first)
+            by_age = np.argsort(appearance, kind="stable")
+            ids = np.empty(len(nodes), dtype=np.int64)
+            ids[by_age] = num_nodes + np.arange(len(nodes))
+            mapping[level] = ids[target_inverse[inverse]]
+            num_nodes += len(nodes)
+
+            nodes = nodes[by_age]
+            node_keys = (nodes & 0xFFFFFFFF).astype(np.int32).astype(np.int64)
+            is_other = node_keys == OTHER_KEY
+            parents.append(nodes >> 32)
+            keys.append(node_keys)
+            info_events.append(
+                np.where(is_other, -1, self.info_events[level[appearance[by_age]]])
+            )
+            merged.append(
+                np.where(is_other, np.bincount(target_inverse, minlength=len(nodes))[by_age], 0)
+            )
+
+        agg = EventTimelineAggregate()
+        agg.store = self.store
+        agg.parents = np.concatenate(parents)
+        agg.keys = np.concatenate(keys).astype(np.int32)
+        agg.info_events = np.concatenate(info_events)
+        agg.merged = np.concatenate(merged)
+        agg._link_children()
+        agg._set_members(
+            mapping[self._member_nodes()],
+            self.member_seq_ids,
+            self.member_events,
+            self.member_last,
+        )
+        return agg
+
+    def _find_children(
+        self, codes: np.ndarray, num_nodes: int
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Node of every parent << 32 | key code, missing nodes are numbered
+        from num_nodes in order of first appearance.
+
+        Returns the nodes, the codes of the new nodes and the position of the
+        first appearance of each new node.
+        """
+        nodes = np.empty(len(codes), dtype=np.int64)
+        # Only the nodes from before the insert have children already, the
+        # parents at this level were created by the level before
+        found = np.zeros(len(codes), dtype=bool)
+        if len(self.edge_codes) > 0:
+            pos = np.searchsorted(self.edge_codes, codes)
+            pos[pos == len(self.edge_codes)] = 0
+            found = self.edge_codes[pos] == codes
+            nodes[found] = self.edge_nodes[pos[found]]
+
+        missing = np.flatnonzero(~found)
+        unique, first, inverse = np.unique(
+            codes[missing], return_index=True, return_inverse=True
+        )
+        order = np.argsort(first, kind="stable")
+        ids = np.empty(len(unique), dtype=np.int64)
+        ids[order] = num_nodes + np.arange(len(unique))
+        nodes[missing] = ids[inverse.reshape(-1)]
+        return nodes, unique[order], missing[first[order]]
+
+    def _link_children(self) -> None:
+        """Links the children of every node from parents.
+
+        Nodes are numbered in the order they were first reached, so siblings
+        are linked in order of their numbers.
+        """
+        children = np.flatnonzero(self.parents >= 0)
+        by_parent = np.argsort(self.parents[children], kind="stable")
+        parents, children = self.parents[children][by_parent], children[by_parent]
+
+        first_child = np.full(len(self), -1, dtype=np.int64)
+        next_sibling = np.full(len(self), -1, dtype=np.int64)
+        same = parents[1:] == parents[:-1]
+        next_sibling[children[:-1][same]] = children[1:][same]
+        heads = np.concatenate([[True], ~same])[: len(children)]
+        first_child[parents[heads]] = children[heads]
+        self.first_child = first_child
+        self.next_sibling = next_sibling
+
+        codes = (self.parents[1:] << 32) | (self.keys[1:].astype(np.int64) & 0xFFFFFFFF)
+        order = np.argsort(codes)
+        self.edge_codes = codes[order]
+        self.edge_nodes = order + 1
+
+    def _member_nodes(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self.member_offsets) - 1), np.diff(self.member_offsets))
+
+    def _set_members(
+        self,
+        nodes: np.ndarray,
+        seq_ids: np.ndarray,
+        events: np.ndarray,
+        last: np.ndarray,
+    ) -> None:
+        order = np.lexsort((seq_ids, nodes))
+        nodes = nodes[order]
+        self.member_seq_ids = seq_ids[order]
+        self.member_events = events[order]
+        self.member_last = last[order]
+        self.member_epochs = self.store.epochs[self.member_events]
+        self.member_missing = self.store.time_missing[self.member_events]
+
+        self.sizes = np.bincount(nodes, minlength=len(self)).astype(np.int64)
+        self.stop_here = np.bincount(
+            nodes[self.member_last], minlength=len(self)
+        ).astype(np.int64)
+        member_offsets = np.zeros(len(self) + 1, dtype=np.int64)
+        np.cumsum(self.sizes, out=member_offsets[1:])
+        self.member_offsets = member_offsets
+        self._set_waits(nodes)
+
+    def _set_waits(self, nodes: np.ndarray) -> None:
+        """Wait statistics of every node from the members, sorted by node.
+
+        The event of the parent is the one before in the timeline, children
+        of the root have no wait.
+        """
+        previous = self.member_events - 1
+        has_wait = (self.parents[nodes] > 0) & ~self.member_missing
+        has_wait &= ~self.store.time_missing[previous]
+        waits = np.abs(self.member_epochs - self.store.epochs[previous])[has_wait] / 60.0
+        nodes = nodes[has_wait]
+
+        num_nodes = len(self)
+        self.wait_counts = np.bincount(nodes, minlength=num_nodes).astype(np.int64)
+        self.wait_sums = np.bincount(nodes, weights=waits, minlength=num_nodes)
+        self.wait_mins = np.full(num_nodes, np.nan)
+        self.wait_maxs = np.full(num_nodes, np.nan)
+        if len(waits) > 0:
+            with_waits = np.flatnonzero(self.wait_counts)
+            starts = np.searchsorted(nodes, with_waits)
+            self.wait_mins[with_waits] = np.minimum.reduceat(waits, starts)
+            self.wait_maxs[with_waits] = np.maximum.reduceat(waits, starts)
+        self.wait_bins = (
+            np.bincount(
+                nodes * NUM_WAIT_BINS + wait_bin(waits),
+                minlength=num_nodes * NUM_WAIT_BINS,
+            )
+            .astype(np.int32)
+            .reshape(num_nodes, NUM_WAIT_BINS)
+        )